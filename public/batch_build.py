@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+
+# Builds OBS PDFs for many languages/repos in one go
+#   (e.g., to regenerate them all after a template or version change)
+#   rather than queueing hundreds of independent jobs.
+#
+# Items can be Door43 Catalog language codes (e.g., 'en' or 'es-419'),
+#   'username/repoName' (for the master branch), or 'username/repoName/spec'.
+#
+# Examples:
+#   python3 batch_build.py en fr unfoldingWord/en_obs/v9
+#   python3 batch_build.py --all-catalog --workers 4 --report /tmp/obs-batch-report.json
+#
+# 'username/repoName/spec' items update the repo's PDF_details.json build log (and the Redis build status)
+#   as the webhook jobs do.
+#
+# The catalog, the font fallback data, the TeX templates and the ConTeXt font database are loaded once (before the worker processes fork)
+#   and each worker process keeps its own S3 connection.
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from time import time
+
+from redis import Redis
+
+from rq_settings import REDIS_URL
+from lib.aws_tools.s3_handler import S3Handler
+from lib.build_log import MY_NAME, MY_VERSION_STRING, load_build_log, save_build_log
+from lib.general_tools.file_utils import remove_tree
+from lib.general_tools.url_utils import get_catalog
+from lib.preloading import preload_templates, preload_font_data, reload_context_fonts
+from lib.queue_tools.build_status import save_build_status
+from lib.pdf_from_dcs import PdfFromDcs, AWS_REGION_NAME, CDN_BUCKET_NAME, DOOR43_SITE_URL, \
+                                get_catalog_obs_lang_codes
+
+
+prefix = os.getenv('QUEUE_PREFIX', '') # Gets (optional) QUEUE_PREFIX environment variable -- set to 'dev-' for development
+assert prefix in ('','dev-')
+
+DEFAULT_REPORT_FILEPATH = '/tmp/obs-batch-report.json'
+
+# Set in the main process before the pool is created, so inherited by the (forked) workers
+catalog:Optional[dict] = None
+# Set separately in each worker process (boto3 and Redis connections shouldn't be shared across a fork)
+cdn_s3_handler:Optional[S3Handler] = None
+redis_connection:Optional[Redis] = None
+
+
+
+def parse_item(item:str) -> Tuple[str, Union[str,Tuple[str,str,str]]]:
+    """
+    Returns the PdfFromDcs parameter_type and parameter(s) for a command line item.
+    """
+    parts = item.strip('/').split('/')
+    if len(parts) == 1:
+        return 'Catalog_lang_code', parts[0]
+    if len(parts) == 2:
+        return 'Door43_repo', '/'.join(parts)
+    if len(parts) == 3:
+        return 'username_repoName_spec', tuple(parts)
+    raise ValueError(f"Can't understand '{item}' -- expected a language code, username/repoName, or username/repoName/spec")
+# end of parse_item function
+
+
+def warm_up_shared_state(need_catalog:bool) -> None:
+    """
+    Loads everything that doesn't change between builds
+        so that the worker processes start warm.
+    """
+    global catalog
+    if need_catalog:
+        print("Downloading the Door43 Catalog…")
+        catalog = get_catalog()
+    preload_font_data()
+    preload_templates()
+    try:
+        reload_context_fonts()
+    except (OSError, subprocess.CalledProcessError) as e: # Then each build still does it
+        print(f"Unable to preload the ConTeXt fonts: {e}")
+    else:
+        PdfFromDcs.reload_fonts = False # Already done for all of the builds in this batch
+# end of warm_up_shared_state function
+
+
+def init_worker() -> None:
+    global cdn_s3_handler, redis_connection
+    cdn_s3_handler = S3Handler(bucket_name=f'{prefix}{CDN_BUCKET_NAME}',
+                                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+                                aws_region_name=AWS_REGION_NAME)
+    redis_connection = Redis.from_url(REDIS_URL) # Doesn't actually connect until it's used
+# end of init_worker function
+
+
+def save_build_record(parameter:Tuple[str,str,str], f:PdfFromDcs, result:Dict[str,Any]) -> None:
+    """
+    Updates the repo's JSON build log and the Redis build status
+        in the same way as webhook.process_PDF_job does after a build.
+    """
+    repo_owner_username, repo_name, tag_or_branch_name = parameter
+    PDF_log_dict = load_build_log(prefix, repo_owner_username, repo_name)
+    if tag_or_branch_name not in PDF_log_dict: PDF_log_dict[tag_or_branch_name] = {}
+    entry = PDF_log_dict[tag_or_branch_name]
+    entry['PDF_creator'] = MY_NAME
+    entry['PDF_creator_version'] = MY_VERSION_STRING
+    entry['source_url'] = f"{DOOR43_SITE_URL}/{repo_owner_username}/{repo_name}/archive/{tag_or_branch_name}.zip"
+    if result['status'] == 'success':
+        entry['status'] = 'success'
+        entry['PDF_url'] = result['PDF_url']
+        entry['message'] = "PDF made and uploaded"
+        if f.pdf_optimization is not None:
+            entry['PDF_optimization'] = f.pdf_optimization
+        if f.story_pdfs_url is not None:
+            entry['PDF_stories_url'] = f.story_pdfs_url
+        if f.pdf_pointer_url is not None:
+            entry['PDF_pointer_url'] = f.pdf_pointer_url
+        for key in ('preflight_errors', 'PDF_variants', 'options'): # Not from this build
+            entry.pop(key, None)
+        entry.pop('commit_hash', None) # Don't leave the one from an older build
+        entry['build_fingerprint'] = f.build_fingerprint
+    else:
+        entry['status'] = 'error'
+        entry['message'] = result['error']
+    entry.pop('superseded', None)
+    entry['processed_at'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    save_build_log(prefix, repo_owner_username, repo_name, PDF_log_dict,
+                   os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'])
+    if redis_connection is not None: # Only kept after a success
+        save_build_status(redis_connection, prefix, repo_owner_username, repo_name, tag_or_branch_name, entry)
+# end of save_build_record function
+
+
+def build_item(item:str) -> Dict[str,Any]:
+    """
+    Runs in a worker process.
+
+    Returns a summary dict for the report (never raises).
+    """
+    start_time = time()
+    result:Dict[str,Any] = {'item': item}
+    try:
+        parameter_type, parameter = parse_item(item)
+        result['parameter_type'] = parameter_type
+        with PdfFromDcs(prefix, parameter_type, parameter, catalog=catalog,
+                        cdn_s3_handler=cdn_s3_handler, isolated=True) as f:
+            try:
+                run_result = f.run()
+                if run_result.startswith('https://'):
+                    result['status'] = 'success'
+                    result['PDF_url'] = run_result
+                else: # PdfFromDcs.create_and_upload_pdf returns the error if the build wasn't good
+                    result['status'] = 'failed'
+                    result['error'] = run_result
+            except Exception as e:
+                result['status'] = 'failed'
+                result['error'] = f"{type(e).__name__}: {e}"
+            if result['status'] == 'success':
+                remove_tree(f.tmp_download_dirpath)
+            else: # Keep the ConTeXt logs
+                result['log_dirpath'] = f.log_dirpath
+            if parameter_type == 'username_repoName_spec':
+                try:
+                    save_build_record(parameter, f, result)
+                except Exception as e: # The PDF itself is still there
+                    result['build_log_error'] = f"{type(e).__name__}: {e}"
+    except Exception as e: # e.g., a bad item
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = round(time() - start_time, 1)
+    return result
+# end of build_item function
+
+
+def run_batch(items:List[str], num_workers:int) -> Dict[str,Any]:
+    """
+    Builds the items in a bounded pool of (forked) worker processes.
+
+    Returns the report dict.
+    """
+    start_time = time()
+    report:Dict[str,Any] = {'started_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                            'prefix': prefix, 'num_workers': num_workers, 'items': []}
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                             mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = [executor.submit(build_item, item) for item in items]
+        for n, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            print(f"[{n}/{len(items)}] {result['item']}: {result['status']} in {result['seconds']}s"
+                  f"{' -- '+result['error'] if 'error' in result else ''}")
+            report['items'].append(result)
+
+    report['items'].sort(key=lambda result: items.index(result['item']))
+    report['num_items'] = len(items)
+    report['num_succeeded'] = sum(1 for result in report['items'] if result['status'] == 'success')
+    report['num_failed'] = len(items) - report['num_succeeded']
+    report['elapsed_seconds'] = round(time() - start_time, 1)
+    return report
+# end of run_batch function
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build many OBS PDFs in one process pool.")
+    parser.add_argument('items', nargs='*',
+                        help="Language codes, username/repoName, or username/repoName/spec")
+    parser.add_argument('--all-catalog', action='store_true',
+                        help="Build every OBS in the Door43 Catalog (as well as any given items)")
+    parser.add_argument('--items-file', help="File with more items (one per line)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of builds to run at once (each one runs ConTeXt)")
+    parser.add_argument('--report', default=DEFAULT_REPORT_FILEPATH,
+                        help=f"Where to write the JSON summary report (default {DEFAULT_REPORT_FILEPATH})")
+    args = parser.parse_args()
+
+    items = list(args.items)
+    if args.items_file:
+        with open(args.items_file, 'rt') as items_file:
+            items += [line.strip() for line in items_file if line.strip() and not line.startswith('#')]
+    need_catalog = args.all_catalog or any('/' not in item.strip('/') for item in items)
+    warm_up_shared_state(need_catalog)
+    if args.all_catalog:
+        items += get_catalog_obs_lang_codes(catalog)
+    items = list(dict.fromkeys(items)) # Remove duplicates but keep the order
+    if not items:
+        parser.error("Nothing to build")
+
+    print(f"Building {len(items)} OBS PDF(s) with {args.workers} worker(s)…")
+    report = run_batch(items, args.workers)
+    with open(args.report, 'wt') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Built {report['num_succeeded']}/{report['num_items']} PDF(s) in {report['elapsed_seconds']}s"
+          f" -- report saved to {args.report}")
+    for result in report['items']:
+        if result['status'] != 'success':
+            print(f"  FAILED: {result['item']}: {result.get('error')}")
+    return 0 if not report['num_failed'] else 1
+# end of main function
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
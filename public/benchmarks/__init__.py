@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks for the Python side of the OBS PDF build
+    (parsing, verifying and TeX generation -- not ConTeXt itself)
+    using a synthetic (but realistic) 50-story corpus.
+
+Run them with `python3 -m benchmarks --help` from the public folder.
+"""
@@ -0,0 +1,62 @@
+"""
+Command line for the micro-benchmarks, e.g.,
+    python3 -m benchmarks --scripts latin,arabic --repeat 5
+    python3 -m benchmarks --save-baseline
+
+Exits with 1 if any benchmark regressed by more than the tolerance compared with the baseline file.
+"""
+import argparse
+import json
+import os
+import sys
+
+from benchmarks.corpus import SCRIPT_SAMPLES
+from benchmarks.suite import DEFAULT_REPEAT, DEFAULT_TOLERANCE, run_benchmarks, compare_with_baseline
+
+
+DEFAULT_BASELINE_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the OBS PDF Python hot paths.")
+    parser.add_argument('--scripts', default=','.join(SCRIPT_SAMPLES),
+                        help=f"Comma-separated scripts for the synthetic corpus (from {', '.join(SCRIPT_SAMPLES)})")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Number of timed calls of each benchmark")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILEPATH, help="Baseline JSON file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="Save these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed fractional slowdown (or extra allocations) before it counts as a regression")
+    args = parser.parse_args()
+
+    script_names = args.scripts.split(',')
+    for script_name in script_names:
+        if script_name not in SCRIPT_SAMPLES:
+            parser.error(f"Unknown script '{script_name}'")
+    results = run_benchmarks(script_names, args.repeat)
+
+    for script_name, script_results in results.items():
+        print(f"{script_name}:")
+        for benchmark_name, result in script_results.items():
+            print(f"  {benchmark_name:32} best {result['best_seconds']*1000:9.2f}ms"
+                  f"  median {result['median_seconds']*1000:9.2f}ms"
+                  f"  peak {result['peak_bytes']/1024:9.1f}KiB  {result['allocated_blocks']:7,} blocks")
+
+    if args.save_baseline:
+        with open(args.baseline, 'wt') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline at {args.baseline} to compare with (use --save-baseline)")
+        return 0
+    with open(args.baseline, 'rt') as baseline_file:
+        regressions = compare_with_baseline(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not regressions:
+        print(f"No regressions compared with {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Generator for realistic synthetic OBS content:
+    all 50 stories with the real number of frames (from chapters_and_frames.frame_counts),
+    text in one of several scripts, with emphasis, bold, links and the odd bare URL.
+
+The same seed always gives the same content.
+"""
+from typing import Dict, List, Tuple
+import random
+import unicodedata
+
+from lib.obs import chapters_and_frames
+
+
+
+# Script name: (language_id, language_name, direction, sample words)
+SCRIPT_SAMPLES:Dict[str,Tuple[str,str,str,List[str]]] = {
+    'latin': ('en', 'English', 'ltr',
+              'God made the world and everything in it in six days after that he rested '
+              'Adam and Eve lived in a beautiful garden with many trees'.split()),
+    'cyrillic': ('ru', 'Русский', 'ltr',
+                 'Бог создал мир и всё что в нём за шесть дней после этого он отдыхал '
+                 'Адам и Ева жили в прекрасном саду'.split()),
+    'greek': ('el', 'Ελληνικά', 'ltr',
+              'Ο Θεός δημιούργησε τον κόσμο και όλα όσα υπάρχουν σε έξι ημέρες'.split()),
+    'arabic': ('ar', 'العربية', 'rtl',
+               'خلق الله العالم وكل ما فيه في ستة أيام ثم استراح آدم وحواء عاشا في جنة جميلة'.split()),
+    'devanagari': ('hi', 'हिन्दी', 'ltr',
+                   'परमेश्वर ने छः दिनों में संसार और उसमें की सब वस्तुएँ बनाईं फिर उसने विश्राम किया'.split()),
+    'ethiopic': ('am', 'አማርኛ', 'ltr',
+                 'እግዚአብሔር ዓለምንና በውስጧ ያለውን ሁሉ በስድስት ቀናት ፈጠረ ከዚያም ዐረፈ'.split()),
+    'tamil': ('ta', 'தமிழ்', 'ltr',
+              'தேவன் ஆறு நாட்களில் உலகத்தையும் அதிலுள்ள அனைத்தையும் படைத்தார் பின்பு ஓய்வெடுத்தார்'.split()),
+    }
+LANGUAGE_SCRIPTS = {language_id:script_name for script_name, (language_id, _name, _direction, _words) in SCRIPT_SAMPLES.items()}
+
+
+
+def get_script_sample(script_name:str) -> Tuple[str,str,str,List[str]]:
+    """
+    Returns the (language_id, language_name, direction, sample words) for the script.
+
+    As well as the SCRIPT_SAMPLES names, any Unicode script name prefix (e.g., 'ORIYA' or 'GURMUKHI')
+        can be given, in which case the words are made up from the letters and vowel signs of that script.
+    """
+    if script_name in SCRIPT_SAMPLES:
+        return SCRIPT_SAMPLES[script_name]
+    letters, vowel_signs = [], []
+    for codepoint in range(0x0080, 0x10000):
+        char_name = unicodedata.name(chr(codepoint), '')
+        if char_name.startswith(f'{script_name} LETTER '):
+            letters.append(chr(codepoint))
+        elif char_name.startswith(f'{script_name} VOWEL SIGN '):
+            vowel_signs.append(chr(codepoint))
+    if not letters:
+        raise ValueError(f"No letters found for the '{script_name}' script")
+    direction = 'rtl' if unicodedata.bidirectional(letters[0]) in ('R', 'AL') else 'ltr'
+    rng = random.Random(script_name)
+    words = [''.join(rng.choice(letters) + (rng.choice(vowel_signs) if vowel_signs and rng.random() < 0.6 else '')
+                     for _ in range(rng.randint(1, 4)))
+             for _ in range(40)]
+    return 'x-synthetic', script_name.title(), direction, words
+# end of get_script_sample function
+
+
+def make_sentence(rng:random.Random, words:List[str]) -> str:
+    """
+    Returns a sentence of random words with occasional markup.
+    """
+    sentence_words = [rng.choice(words) for _ in range(rng.randint(6, 18))]
+    markup_choice = rng.random()
+    if markup_choice < 0.15:
+        n = rng.randrange(len(sentence_words))
+        sentence_words[n] = f'*{sentence_words[n]}*'
+    elif markup_choice < 0.22:
+        n = rng.randrange(len(sentence_words))
+        sentence_words[n] = f'**{sentence_words[n]}**'
+    elif markup_choice < 0.25:
+        sentence_words.append(f'[{rng.choice(words)}](https://openbiblestories.org/stories/{rng.randint(1,50)})')
+    elif markup_choice < 0.26:
+        sentence_words.append('https://unfoldingword.org/obs/')
+    return ' '.join(sentence_words) + rng.choice(('.', '.', '.', '!', '?'))
+# end of make_sentence function
+
+
+def make_obs_files(language_id:str='en', script_name:str='', seed:int=0) -> Dict[str,str]:
+    """
+    Returns a dict of relative paths to file contents for a complete OBS resource container.
+
+    The script defaults to the one for the language (else Latin).
+    """
+    script_name = script_name or LANGUAGE_SCRIPTS.get(language_id, 'latin')
+    _sample_language_id, language_name, direction, words = get_script_sample(script_name)
+    rng = random.Random(f'{seed}-{language_id}-{script_name}')
+
+    obs_files = {'manifest.yaml': "dublin_core:\n"
+                                  f"  language: {{identifier: {language_id}, title: '{language_name}', direction: {direction}}}\n"
+                                  "  version: '1'\n"
+                                  "  publisher: Synthetic OBS\n",
+                 'content/front/title.md': f"# {' '.join(words[:3])} #\n\n{make_sentence(rng, words)}\n",
+                 'content/front/intro.md': '\n\n'.join([f"# {' '.join(words[:3])} #"]
+                                                       + [make_sentence(rng, words) for _ in range(6)]
+                                                       + ['* ' + make_sentence(rng, words) for _ in range(3)]) + '\n',
+                 'content/back/intro.md': '\n\n'.join(['# About #']
+                                                      + [make_sentence(rng, words) for _ in range(4)]
+                                                      + ['https://creativecommons.org/licenses/by-sa/4.0/']) + '\n',
+                 }
+    for story_num, frame_count in enumerate(chapters_and_frames.frame_counts, start=1):
+        lines = [f'# {story_num}. {" ".join(rng.choice(words) for _ in range(3))}', '']
+        for frame_num in range(1, frame_count+1):
+            frame_id = f'{str(story_num).zfill(2)}-{str(frame_num).zfill(2)}'
+            lines += [f'![OBS Image](https://cdn.door43.org/obs/jpg/360px/obs-en-{frame_id}.jpg)', '',
+                      ' '.join(make_sentence(rng, words) for _ in range(rng.randint(2, 5))), '']
+        lines.append(f'_{" ".join(rng.choice(words) for _ in range(3))} {story_num}:{rng.randint(1,30)}-{rng.randint(31,60)}_')
+        obs_files[f'content/{str(story_num).zfill(2)}.md'] = '\n'.join(lines) + '\n'
+    return obs_files
+# end of make_obs_files function
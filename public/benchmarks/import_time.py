@@ -0,0 +1,121 @@
+"""
+Start-up (import time) check for the entry points, e.g.,
+    python3 -m benchmarks.import_time
+    python3 -m benchmarks.import_time --save-budget # After deliberately adding something slow
+
+Each entry point is imported in a fresh interpreter (with python -X importtime)
+    and its best cumulative import time is compared with the budget in import_budget.json.
+The heavy modules listed there mustn't be imported at all
+    (e.g., boto3 and the CloudWatch handler are only for the jobs themselves).
+
+Exits with 1 if anything is over budget.
+"""
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+
+PUBLIC_DIRPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_budget.json')
+DEFAULT_REPEAT = 5
+DEFAULT_HEADROOM = 1.5 # The saved budget allows for slower machines (and noisy containers)
+
+# The modules that read these at import time get harmless dummy values (nothing gets contacted)
+DUMMY_ENVIRONMENT = {'AWS_ACCESS_KEY_ID': 'import-time', 'AWS_SECRET_ACCESS_KEY': 'import-time'}
+
+IMPORTTIME_LINE_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*\S+)')
+
+
+
+def run_python(code:str, *python_options:str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *python_options, '-c', code], cwd=PUBLIC_DIRPATH,
+                          env={**DUMMY_ENVIRONMENT, **os.environ}, capture_output=True, text=True, check=True)
+
+
+def measure_import(module_name:str, repeat:int=DEFAULT_REPEAT) -> Dict[str,Any]:
+    """
+    Imports the module in fresh interpreters.
+
+    Returns a dict with the best cumulative milliseconds, its slowest direct imports
+        and the names of all the modules that got imported.
+    """
+    best_microseconds = None
+    for _n in range(repeat):
+        child_microseconds:Dict[str,int] = {} # The module's direct imports
+        for line in run_python(f'import {module_name}', '-X', 'importtime').stderr.splitlines():
+            match = IMPORTTIME_LINE_RE.match(line)
+            if not match:
+                continue
+            depth = (len(match.group(3)) - len(match.group(3).lstrip())) // 2
+            name, microseconds = match.group(3).strip(), int(match.group(2))
+            if depth == 0:
+                if name == module_name:
+                    break
+                child_microseconds = {} # Those were for something imported before it (e.g., site)
+            elif depth == 1:
+                child_microseconds[name] = microseconds
+        if best_microseconds is None or microseconds < best_microseconds:
+            best_microseconds = microseconds
+            slowest_imports = sorted(child_microseconds.items(),
+                                     key=lambda name_and_microseconds: -name_and_microseconds[1])[:5]
+    imported_module_names = json.loads(run_python(f'import json, sys, {module_name}; print(json.dumps(sorted(sys.modules)))').stdout)
+    return {'milliseconds': round(best_microseconds / 1000, 1),
+            'slowest_imports': [(name, round(microseconds / 1000, 1)) for name, microseconds in slowest_imports],
+            'imported_modules': imported_module_names}
+# end of measure_import function
+
+
+def check_budget(module_name:str, measurement:Dict[str,Any], budget:Dict[str,Any]) -> List[str]:
+    """
+    Returns a list of the ways that the module exceeded its budget (if any).
+    """
+    problems = []
+    if measurement['milliseconds'] > budget['max_milliseconds']:
+        problems.append(f"{module_name} took {measurement['milliseconds']}ms to import (budget {budget['max_milliseconds']}ms)")
+    for forbidden_module_name in budget.get('forbidden_modules', []):
+        if forbidden_module_name in measurement['imported_modules']:
+            problems.append(f"{module_name} imports {forbidden_module_name} (which should only be imported when needed)")
+    return problems
+# end of check_budget function
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import time check for the OBS PDF entry points.")
+    parser.add_argument('--budget', default=DEFAULT_BUDGET_FILEPATH, help="Budget JSON file")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Number of fresh imports of each module")
+    parser.add_argument('--save-budget', action='store_true',
+                        help="Save these times (with the headroom) as the new budget, keeping the forbidden modules")
+    parser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM, help="Multiplier used by --save-budget")
+    args = parser.parse_args()
+
+    with open(args.budget, 'rt') as budget_file:
+        budgets = json.load(budget_file)
+
+    all_problems = []
+    for module_name, budget in budgets.items():
+        measurement = measure_import(module_name, args.repeat)
+        print(f"{module_name:16} {measurement['milliseconds']:8.1f}ms (budget {budget['max_milliseconds']}ms)"
+              f"  slowest: {', '.join(f'{name} {milliseconds}ms' for name, milliseconds in measurement['slowest_imports'])}")
+        all_problems.extend(check_budget(module_name, measurement, budget))
+        budget['max_milliseconds'] = round(measurement['milliseconds'] * args.headroom)
+
+    if args.save_budget:
+        with open(args.budget, 'wt') as budget_file:
+            json.dump(budgets, budget_file, indent=2)
+            budget_file.write('\n')
+        print(f"Saved budget to {args.budget}")
+        return 0
+    for problem in all_problems:
+        print(f"OVER BUDGET: {problem}")
+    if not all_problems:
+        print(f"All within the budget in {args.budget}")
+    return 1 if all_problems else 0
+# end of main function
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Times the Python hot paths of a PDF build on the synthetic corpus
+    and compares the results against a stored baseline.
+
+For each benchmark we record
+    the best and median wall time per call (over several repeats), and
+    the peak traced memory and number of allocated blocks during one call (via tracemalloc).
+"""
+from typing import Any, Callable, Dict, List, Tuple
+import contextlib
+import datetime
+import io
+import os
+import statistics
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import yaml
+
+from benchmarks.corpus import SCRIPT_SAMPLES, make_obs_files
+from lib.obs.obs_classes import OBS, OBSChapter
+from lib.obs.obs_tex_export import OBSTexExport
+
+
+
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25 # Report times more than 25% slower than the baseline
+
+
+
+def time_call(func:Callable[[],Any], repeat:int) -> Dict[str,float]:
+    """
+    Returns the best and median seconds for calling func.
+    """
+    durations = []
+    for _ in range(repeat):
+        start_time = perf_counter()
+        func()
+        durations.append(perf_counter() - start_time)
+    return {'best_seconds': round(min(durations), 6), 'median_seconds': round(statistics.median(durations), 6)}
+# end of time_call function
+
+
+def measure_allocations(func:Callable[[],Any]) -> Dict[str,int]:
+    """
+    Returns the peak traced memory and the number of memory blocks allocated by one call of func
+        (keeping the result alive so that what it built is counted).
+    """
+    tracemalloc.start()
+    try:
+        before_snapshot = tracemalloc.take_snapshot()
+        result = func()
+        after_snapshot = tracemalloc.take_snapshot()
+        _current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    allocated_blocks = sum(stat.count_diff for stat in after_snapshot.compare_to(before_snapshot, 'filename')
+                           if stat.count_diff > 0)
+    del result
+    return {'peak_bytes': peak_bytes, 'allocated_blocks': allocated_blocks}
+# end of measure_allocations function
+
+
+def build_obs(obs_files:Dict[str,str]) -> OBS:
+    """
+    Makes the OBS object like PdfFromDcs.run() does (but from the files in memory).
+    """
+    dublin_core = yaml.safe_load(obs_files['manifest.yaml'])['dublin_core']
+    obs_obj = OBS()
+    obs_obj.date_modified = datetime.date.today().strftime('%Y%m%d')
+    obs_obj.language_id = dublin_core['language']['identifier']
+    obs_obj.language_name = dublin_core['language']['title']
+    obs_obj.language_direction = dublin_core['language']['direction']
+    obs_obj.version = dublin_core['version']
+    obs_obj.publisher = dublin_core['publisher']
+    obs_obj.description, obs_obj.extended_description = 'Benchmark', None
+    obs_obj.chapters = parse_chapters(get_chapter_markdowns(obs_files))
+    obs_obj.title = obs_files['content/front/title.md']
+    obs_obj.front_matter = obs_files['content/front/intro.md']
+    obs_obj.back_matter = obs_files['content/back/intro.md']
+    return obs_obj
+# end of build_obs function
+
+
+def get_chapter_markdowns(obs_files:Dict[str,str]) -> List[Tuple[int,str]]:
+    """
+    Returns the story numbers and markdown of the 50 chapter files (in order).
+    """
+    return [(int(path[8:10]), text) for path, text in sorted(obs_files.items())
+            if path.startswith('content/') and path[8:10].isdigit()]
+# end of get_chapter_markdowns function
+
+
+def parse_chapters(chapter_markdowns:List[Tuple[int,str]]) -> List[OBSChapter]:
+    return [OBSChapter.from_markdown(markdown, story_num) for story_num, markdown in chapter_markdowns]
+# end of parse_chapters function
+
+
+def run_script_benchmarks(script_name:str, repeat:int) -> Dict[str,Dict[str,Any]]:
+    """
+    Returns the results for each benchmark for one script's corpus.
+    """
+    obs_files = make_obs_files(SCRIPT_SAMPLES[script_name][0], script_name)
+    chapter_markdowns = get_chapter_markdowns(obs_files)
+    obs_obj = build_obs(obs_files)
+    tex_filepath = os.path.join(tempfile.mkdtemp(prefix='obs-benchmark--'), f'{obs_obj.language_id}.tex')
+    tex_export = OBSTexExport(obs_obj=obs_obj, out_path=tex_filepath, max_chapters=0, img_res='360px')
+    tex_export.check_for_standard_keys_json()
+
+    def verify_all() -> bool:
+        with contextlib.redirect_stdout(io.StringIO()): # It prints its result
+            return obs_obj.verify_all()
+
+    def create_tex_file() -> None:
+        with OBSTexExport(obs_obj=obs_obj, out_path=tex_filepath, max_chapters=0, img_res='360px') as tex:
+            tex.create_tex_file()
+
+    benchmarks = {
+        'OBSChapter.from_markdown': lambda: parse_chapters(chapter_markdowns),
+        'OBS.verify_all': verify_all,
+        'OBSTexExport.export_matter': lambda: (tex_export.export_matter(obs_obj.front_matter, test=False),
+                                               tex_export.export_matter(obs_obj.back_matter, test=False)),
+        'OBSTexExport.export_chapters': lambda: tex_export.export_chapters(tex_export.body_json['chapters'], 0,
+                                                                           '360px', obs_obj.language_id),
+        'OBSTexExport.create_tex_file': create_tex_file,
+        }
+    results = {}
+    for benchmark_name, func in benchmarks.items():
+        func() # Warm up (e.g., template caches)
+        results[benchmark_name] = {**time_call(func, repeat), **measure_allocations(func)}
+    return results
+# end of run_script_benchmarks function
+
+
+def run_benchmarks(script_names:List[str], repeat:int=DEFAULT_REPEAT) -> Dict[str,Dict[str,Dict[str,Any]]]:
+    """
+    Returns a dict of script names to the benchmark results for that script.
+    """
+    return {script_name:run_script_benchmarks(script_name, repeat) for script_name in script_names}
+# end of run_benchmarks function
+
+
+def compare_with_baseline(results:Dict[str,Dict[str,Dict[str,Any]]], baseline:Dict[str,Dict[str,Dict[str,Any]]],
+                            tolerance:float=DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Returns a list of descriptions of the benchmarks that got slower (using the best times)
+        or use more memory at their peak by more than the tolerance.
+    """
+    regressions = []
+    for script_name, script_results in results.items():
+        for benchmark_name, result in script_results.items():
+            baseline_result = baseline.get(script_name, {}).get(benchmark_name)
+            if not baseline_result:
+                continue
+            for measurement_name in ('best_seconds', 'peak_bytes'):
+                old_value, new_value = baseline_result.get(measurement_name), result[measurement_name]
+                if old_value and new_value > old_value * (1 + tolerance):
+                    regressions.append(f"{script_name} {benchmark_name} {measurement_name}:"
+                                       f" {old_value} -> {new_value} (+{round((new_value / old_value - 1) * 100)}%)")
+    return regressions
+# end of compare_with_baseline function
@@ -0,0 +1,244 @@
+"""
+End-to-end typesetting benchmark:
+    typesets a fixed synthetic fixture with each noto-*.tex fallback file in resources/tex/
+    and records how ConTeXt got on, e.g.,
+        python3 -m benchmarks.typesetting --chapters 10 --report /tmp/obs-typesetting.json
+        python3 -m benchmarks.typesetting --files noto-am.tex,noto-ar.tex --compare /tmp/obs-typesetting.json
+
+For each fallback file we record
+    the wall time, the number of ConTeXt passes,
+    the number of adjust-spacing loop iterations (and font scale-downs),
+    the peak RSS of the ConTeXt processes and the PDF size.
+
+Each case is typeset from its own worker process
+    so that the peak RSS is just for that case.
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+from benchmarks.corpus import make_obs_files
+from benchmarks.suite import build_obs
+from lib.build_progress import CONTEXT_RUN_RE, FIGURE_MESSAGE_RE
+from lib.context_runner import run_context, CONTEXT_FONTS_COMMAND, get_typeset_command
+from lib.general_tools.app_utils import get_resources_dir
+from lib.obs.obs_tex_export import OBSTexExport
+from lib.preloading import reload_context_fonts
+
+
+
+DEFAULT_CHAPTERS = 10 # Enough pages to see the spacing loops at work without taking all day
+DEFAULT_REPORT_FILEPATH = '/tmp/obs-typesetting-benchmark.json'
+
+# The fixture text for each fallback file (by the language code in its name)
+#   is either one of the corpus script samples or made up from the letters of that Unicode script
+FALLBACK_SCRIPTS = {
+    'am': 'ethiopic',
+    'ar': 'arabic', 'fa': 'arabic', 'ur': 'arabic',
+    'hi': 'devanagari', 'mr': 'devanagari', 'ne': 'devanagari', 'sgj': 'devanagari', 'ur-deva': 'devanagari',
+    'ta': 'tamil',
+    'as': 'BENGALI', 'bn': 'BENGALI',
+    'gu': 'GUJARATI', 'kn': 'KANNADA', 'lo': 'LAO', 'ml': 'MALAYALAM', 'or': 'ORIYA', 'pa': 'GURMUKHI', 'te': 'TELUGU',
+    } # Anything else gets Latin text
+
+LOOP_TRACE_RE = re.compile(r'TRACE: loops') # From adjust-spacing.tex (once per time around the loop)
+FONT_SCALE_DOWN_RE = re.compile(r'WARNING: Font size scaled-down')
+
+
+
+class ContextTypesetter:
+    """
+    Typesets with the real ConTeXt (the fonts are loaded once before the timed runs).
+
+    Any object with a get_command(tex_filepath) method can be used instead
+        (e.g., load_test.stand_ins.FakeTypesetter to try out the benchmark without ConTeXt).
+    """
+    def warm_up(self) -> None:
+        reload_context_fonts()
+
+    def get_command(self, tex_filepath:str) -> str:
+        return f'{CONTEXT_FONTS_COMMAND} && {get_typeset_command(tex_filepath)}'
+# end of ContextTypesetter class
+
+
+
+def get_fallback_filepaths(filenames:Optional[List[str]]=None) -> List[str]:
+    """
+    Returns the noto-*.tex filepaths (all of them if no filenames are given).
+    """
+    filepaths = sorted(glob.glob(os.path.join(get_resources_dir(), 'tex', 'noto-*.tex')))
+    if not filenames:
+        return filepaths
+    unknown_filenames = set(filenames) - {os.path.basename(filepath) for filepath in filepaths}
+    if unknown_filenames:
+        raise ValueError(f"Unknown fallback file(s): {sorted(unknown_filenames)}")
+    return [filepath for filepath in filepaths if os.path.basename(filepath) in filenames]
+# end of get_fallback_filepaths function
+
+
+def get_fallback_language_id(fallback_filepath:str) -> str:
+    """
+    Returns the language code from a noto-<lang>.tex filepath.
+    """
+    return os.path.splitext(os.path.basename(fallback_filepath))[0][len('noto-'):]
+
+
+def make_fixture(fallback_filepath:str, work_dirpath:str, max_chapters:int, seed:int=0) -> str:
+    """
+    Writes the TeX file for the fallback file's fixture into work_dirpath.
+
+    Returns the TeX filepath.
+    """
+    language_id = get_fallback_language_id(fallback_filepath)
+    obs_obj = build_obs(make_obs_files(language_id, FALLBACK_SCRIPTS.get(language_id, 'latin'), seed))
+    tex_filepath = os.path.join(work_dirpath, f'{language_id}.tex')
+    with contextlib.redirect_stdout(io.StringIO()), \
+        OBSTexExport(obs_obj=obs_obj, out_path=tex_filepath, max_chapters=max_chapters, img_res='360px',
+                        font_fallback_filepath=fallback_filepath) as tex:
+        tex.create_tex_file()
+    return tex_filepath
+# end of make_fixture function
+
+
+def run_case(fallback_filepath:str, typesetter:Any, max_chapters:int, seed:int=0) -> Dict[str,Any]:
+    """
+    Typesets the fixture for one fallback file (in a fresh worker process).
+
+    Returns a dict of the measurements.
+    """
+    work_dirpath = tempfile.mkdtemp(prefix=f'obs-typesetting--{get_fallback_language_id(fallback_filepath)}--')
+    tex_filepath = make_fixture(fallback_filepath, work_dirpath, max_chapters, seed)
+    counts = {'passes': 0, 'figures': 0, 'loop_iterations': 0, 'font_scale_downs': 0}
+
+    def count_line(line:str) -> None:
+        run_match = CONTEXT_RUN_RE.match(line)
+        if run_match:
+            counts['passes'] = max(counts['passes'], int(run_match.group(1)))
+        elif FIGURE_MESSAGE_RE.search(line):
+            counts['figures'] += 1
+        elif LOOP_TRACE_RE.search(line):
+            counts['loop_iterations'] += 1
+        elif FONT_SCALE_DOWN_RE.search(line):
+            counts['font_scale_downs'] += 1
+
+    start_time = perf_counter()
+    context_run = run_context(typesetter.get_command(tex_filepath), work_dirpath,
+                              os.path.join(work_dirpath, 'context.out'),
+                              abort_on_fatal=False, line_callback=count_line)
+    wall_seconds = perf_counter() - start_time
+    pdf_filepath = os.path.splitext(tex_filepath)[0] + '.pdf'
+    return {'language_id': get_fallback_language_id(fallback_filepath),
+            'return_code': context_run.return_code,
+            'error_lines': len(context_run.err_lines),
+            'wall_seconds': round(wall_seconds, 2),
+            **counts,
+            # ru_maxrss is in KiB on Linux
+            'peak_rss_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+            'tex_bytes': os.path.getsize(tex_filepath),
+            'pdf_bytes': os.path.getsize(pdf_filepath) if os.path.isfile(pdf_filepath) else None,
+            'work_dirpath': work_dirpath}
+# end of run_case function
+
+
+def run_matrix(fallback_filepaths:List[str], typesetter:Any, max_chapters:int=DEFAULT_CHAPTERS,
+                seed:int=0) -> Dict[str,Any]:
+    """
+    Returns the report dict with a case for each fallback file.
+    """
+    if hasattr(typesetter, 'warm_up'):
+        typesetter.warm_up()
+    cases = {}
+    for fallback_filepath in fallback_filepaths:
+        fallback_filename = os.path.basename(fallback_filepath)
+        print(f"Typesetting the {fallback_filename} fixture…", flush=True)
+        # A new process each time (so RUSAGE_CHILDREN only covers this case)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                    mp_context=multiprocessing.get_context('fork')) as executor:
+            try:
+                cases[fallback_filename] = executor.submit(run_case, fallback_filepath, typesetter,
+                                                           max_chapters, seed).result()
+            except Exception as e:
+                cases[fallback_filename] = {'exception': f'{type(e).__name__}: {e}'}
+    return {'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'config': {'max_chapters': max_chapters, 'seed': seed,
+                       'typesetter': type(typesetter).__name__, 'typesetter_settings': vars(typesetter)},
+            'cases': cases}
+# end of run_matrix function
+
+
+def compare_reports(report:Dict[str,Any], previous_report:Dict[str,Any]) -> List[str]:
+    """
+    Returns a line for each case that's in both reports, showing how the main numbers changed.
+    """
+    lines = []
+    for fallback_filename, case in report['cases'].items():
+        previous_case = previous_report.get('cases', {}).get(fallback_filename)
+        if not previous_case or 'exception' in case or 'exception' in previous_case:
+            continue
+        changes = []
+        for measurement_name in ('wall_seconds', 'passes', 'loop_iterations', 'peak_rss_bytes', 'pdf_bytes'):
+            old_value, new_value = previous_case.get(measurement_name), case.get(measurement_name)
+            if old_value and new_value is not None:
+                changes.append(f"{measurement_name} {old_value} -> {new_value} ({(new_value / old_value - 1) * 100:+.0f}%)")
+        lines.append(f"{fallback_filename}: {', '.join(changes)}")
+    return lines
+# end of compare_reports function
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Typesetting benchmark across the noto-*.tex fallback files.")
+    parser.add_argument('--files', help="Comma-separated fallback filenames (default: all of them)")
+    parser.add_argument('--chapters', type=int, default=DEFAULT_CHAPTERS, help="Number of stories to typeset (0 for all)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic fixture text")
+    parser.add_argument('--fake-latency', type=float,
+                        help="Use the fake ConTeXt (from the load test) with this many seconds per document")
+    parser.add_argument('--report', default=DEFAULT_REPORT_FILEPATH, help="Where to write the JSON report")
+    parser.add_argument('--compare', help="An earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    try:
+        fallback_filepaths = get_fallback_filepaths(args.files.split(',') if args.files else None)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.fake_latency is None:
+        typesetter = ContextTypesetter()
+    else:
+        from load_test.stand_ins import FakeTypesetter
+        typesetter = FakeTypesetter(latency=args.fake_latency, jitter=0)
+    report = run_matrix(fallback_filepaths, typesetter, args.chapters, args.seed)
+
+    with open(args.report, 'wt') as report_file:
+        json.dump(report, report_file, indent=2)
+    for fallback_filename, case in report['cases'].items():
+        if 'exception' in case:
+            print(f"  {fallback_filename:24} FAILED: {case['exception']}")
+        else:
+            print(f"  {fallback_filename:24} {case['wall_seconds']:8.1f}s  {case['passes']} passes"
+                  f"  {case['loop_iterations']:5} loops  {case['peak_rss_bytes']/1_048_576:7.1f}MiB RSS"
+                  f"  {(case['pdf_bytes'] or 0)/1_048_576:6.1f}MiB PDF"
+                  + (f"  (return code {case['return_code']})" if case['return_code'] else ''))
+    print(f"Full report saved to {args.report}")
+    if args.compare:
+        with open(args.compare, 'rt') as previous_report_file:
+            previous_report = json.load(previous_report_file)
+        print(f"Compared with {args.compare}:")
+        for line in compare_reports(report, previous_report):
+            print(f"  {line}")
+    return 0
+# end of main function
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,7 @@ import json
 import boto3
 from boto3.session import Session
 import botocore
+from botocore.exceptions import ClientError
 
 
 
@@ -42,16 +43,29 @@ class S3Handler:
             self.bucket = self.resource.Bucket(self.bucket_name)
 
 
-    def upload_file(self, path:str, key:str, cache_time=600, content_type=None):
+    def upload_file(self, path:str, key:str, cache_time=600, content_type=None, immutable=False) -> bool:
         """
         Upload file to S3 storage. Similar to the s3.upload_file, however, that
         does not work nicely with moto, whereas this function does.
+
+        The upload is skipped if the object already has the same contents (its ETag is their MD5)
+            and the same cache time, so that an identical rebuild doesn't change the object
+            (and make the CDN fetch it again).
         :param string path: file to upload
         :param string key: name of the object in the bucket
+        :param bool immutable: the contents at the key will never change (so caches needn't revalidate)
+        :return: False if the upload was skipped
         """
-        from lib.general_tools.file_utils import get_mime_type
+        from lib.general_tools.file_utils import get_mime_type, get_file_md5
         assert 'http' not in key.lower()
 
+        cache_control = f"max-age={cache_time}{', immutable' if immutable else ''}"
+        existing_object = self.get_object_head(key)
+        if existing_object is not None \
+        and existing_object.get('ETag', '').strip('"') == get_file_md5(path) \
+        and existing_object.get('CacheControl') == cache_control:
+            return False
+
         with open(path, 'rb') as f:
             binary = f.read()
         if content_type is None:
@@ -60,6 +74,43 @@ class S3Handler:
             Key=key,
             Body=binary,
             ContentType=content_type,
-            CacheControl=f'max-age={cache_time}'
+            CacheControl=cache_control
+        )
+        return True
+
+
+    def copy_file(self, source_key:str, key:str, cache_time=600) -> bool:
+        """
+        Copy an object within the bucket (without downloading it) but with its own cache time.
+
+        Like upload_file, the copy is skipped if the object already has the same contents and cache time.
+        :return: False if the copy was skipped
+        """
+        cache_control = f'max-age={cache_time}'
+        source_object = self.client.head_object(Bucket=self.bucket_name, Key=source_key)
+        existing_object = self.get_object_head(key)
+        if existing_object is not None \
+        and existing_object.get('ETag') == source_object['ETag'] \
+        and existing_object.get('CacheControl') == cache_control:
+            return False
+
+        self.client.copy_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            CopySource={'Bucket': self.bucket_name, 'Key': source_key},
+            MetadataDirective='REPLACE',
+            ContentType=source_object['ContentType'],
+            CacheControl=cache_control
         )
+        return True
+
+
+    def get_object_head(self, key:str):
+        """
+        Returns the object's metadata (from a HEAD request) or None if there isn't one.
+        """
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError:
+            return None
 # end of S3Handler class
@@ -0,0 +1,161 @@
+"""
+Durable checkpoints of how far a PDF build got,
+    so that a retried (or requeued) job can carry on from the last stage that completed
+    rather than repeating the download, parse and (multi-minute) typesetting,
+    e.g., when only the S3 upload or the PDF_details.json write failed.
+
+Each job key gets its own folder holding checkpoint.json
+    and copies of the files needed to resume (the source zip, the TeX file, the PDF).
+Checkpoints expire after a few hours so stale ones never get reused (or fill the disk).
+"""
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from time import time
+
+from lib.general_tools.file_utils import remove_tree
+
+
+
+CHECKPOINT_DIRPATH = os.getenv('OBS_CHECKPOINT_DIR', '/tmp/obs-pdf-checkpoints/')
+CHECKPOINT_TTL_SECONDS = int(os.getenv('OBS_CHECKPOINT_TTL_SECONDS', str(6 * 60 * 60)))
+CHECKPOINT_FILENAME = 'checkpoint.json'
+
+# In the order that a build does them
+CHECKPOINT_STAGES = ('fetched', 'parsed', 'tex', 'pdf', 'uploaded')
+
+
+
+class BuildCheckpoints:
+    """
+    The checkpoints for one job key (e.g., the job identifier which includes the commit hash).
+
+    The fingerprint should change if anything else that affects the output changes
+        (e.g., the PDF options or the version of this code),
+        in which case the old checkpoints are ignored.
+    """
+    def __init__(self, job_key:str, fingerprint:str='', checkpoint_dirpath:str=CHECKPOINT_DIRPATH,
+                    ttl_seconds:int=CHECKPOINT_TTL_SECONDS) -> None:
+        self.job_key = job_key
+        self.fingerprint = fingerprint
+        self.ttl_seconds = ttl_seconds
+        key_hash = hashlib.sha256(f'{job_key}|{fingerprint}'.encode('utf-8')).hexdigest()[:12]
+        safe_key = re.sub(r'[^\w.-]+', '_', job_key)[:100]
+        self.dirpath = os.path.join(checkpoint_dirpath, f'{safe_key}--{key_hash}')
+        self.checkpoint_filepath = os.path.join(self.dirpath, CHECKPOINT_FILENAME)
+        self.created_at:Optional[float] = None
+        self.stages:Dict[str,Dict[str,Any]] = self.load()
+
+
+    def load(self) -> Dict[str,Dict[str,Any]]:
+        """
+        Returns the recorded stages that are still usable (or an empty dict).
+        """
+        try:
+            with open(self.checkpoint_filepath, 'rt', encoding='utf-8') as checkpoint_file:
+                checkpoint_dict = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return {}
+        if checkpoint_dict.get('job_key') != self.job_key or checkpoint_dict.get('fingerprint') != self.fingerprint \
+        or time() - checkpoint_dict.get('created_at', 0) > self.ttl_seconds:
+            self.clear()
+            return {}
+        self.created_at = checkpoint_dict['created_at']
+        return {stage:stage_dict for stage, stage_dict in checkpoint_dict.get('stages', {}).items()
+                if all(os.path.isfile(self.get_artifact_filepath(filename))
+                       for filename in stage_dict.get('artifacts', []))}
+    # end of BuildCheckpoints.load function
+
+
+    def save(self) -> None:
+        """
+        Writes checkpoint.json (via a temporary file so that it's never half-written).
+        """
+        os.makedirs(self.dirpath, exist_ok=True)
+        if self.created_at is None:
+            self.created_at = time()
+        file_descriptor, temp_filepath = tempfile.mkstemp(dir=self.dirpath, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wt', encoding='utf-8') as temp_file:
+            json.dump({'job_key': self.job_key, 'fingerprint': self.fingerprint,
+                       'created_at': self.created_at, 'stages': self.stages}, temp_file, indent=2)
+        os.replace(temp_filepath, self.checkpoint_filepath)
+    # end of BuildCheckpoints.save function
+
+
+    def get_artifact_filepath(self, filename:str) -> str:
+        return os.path.join(self.dirpath, filename)
+
+
+    def get(self, stage:str) -> Optional[Dict[str,Any]]:
+        """
+        Returns the data recorded with the stage (or None if it hasn't been reached).
+        """
+        assert stage in CHECKPOINT_STAGES
+        stage_dict = self.stages.get(stage)
+        return None if stage_dict is None else stage_dict.get('data', {})
+
+
+    def get_last_stage(self) -> Optional[str]:
+        completed_stages = [stage for stage in CHECKPOINT_STAGES if stage in self.stages]
+        return completed_stages[-1] if completed_stages else None
+
+
+    def record(self, stage:str, data:Optional[Dict[str,Any]]=None, artifact_filepaths:Optional[List[str]]=None) -> None:
+        """
+        Records that the stage has completed,
+            keeping copies of the given files (hard-linked if possible) for resuming from here.
+
+        Any later stages that were recorded before are dropped
+            (since they came from different earlier results).
+        """
+        assert stage in CHECKPOINT_STAGES
+        os.makedirs(self.dirpath, exist_ok=True)
+        artifact_filenames = []
+        for artifact_filepath in artifact_filepaths or []:
+            artifact_filename = os.path.basename(artifact_filepath)
+            checkpoint_filepath = self.get_artifact_filepath(artifact_filename)
+            if os.path.abspath(artifact_filepath) != os.path.abspath(checkpoint_filepath):
+                if os.path.exists(checkpoint_filepath):
+                    os.remove(checkpoint_filepath)
+                try:
+                    os.link(artifact_filepath, checkpoint_filepath)
+                except OSError: # e.g., a different file system
+                    shutil.copy2(artifact_filepath, checkpoint_filepath)
+            artifact_filenames.append(artifact_filename)
+        for later_stage in CHECKPOINT_STAGES[CHECKPOINT_STAGES.index(stage)+1:]:
+            self.stages.pop(later_stage, None)
+        self.stages[stage] = {'recorded_at': time(), 'data': data or {}, 'artifacts': artifact_filenames}
+        self.save()
+    # end of BuildCheckpoints.record function
+
+
+    def clear(self) -> None:
+        """
+        Removes all of the checkpoints (e.g., once the job has completely finished).
+        """
+        self.stages = {}
+        self.created_at = None
+        remove_tree(self.dirpath)
+# end of BuildCheckpoints class
+
+
+
+def expire_stale_checkpoints(checkpoint_dirpath:str=CHECKPOINT_DIRPATH, ttl_seconds:int=CHECKPOINT_TTL_SECONDS) -> int:
+    """
+    Removes the checkpoint folders that haven't been touched for longer than the TTL.
+
+    Returns the number removed.
+    """
+    if not os.path.isdir(checkpoint_dirpath):
+        return 0
+    num_removed = 0
+    for entry in os.scandir(checkpoint_dirpath):
+        if entry.is_dir() and time() - entry.stat().st_mtime > ttl_seconds:
+            remove_tree(entry.path)
+            num_removed += 1
+    return num_removed
+# end of expire_stale_checkpoints function
@@ -0,0 +1,108 @@
+"""
+Reading and writing the PDF_details.json build log
+    that's kept on the CDN for each repo.
+"""
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from urllib.error import HTTPError
+
+from lib.general_tools.file_utils import write_file
+from lib.general_tools.url_utils import get_url
+
+
+
+# The following will be recording in the build log (JSON) file
+MY_NAME = 'ConTeXt OBS PDF creator'
+MY_VERSION_STRING = '1.02' # Mostly to determine PDF fixes
+MY_NAME_VERSION_STRING = f"{MY_NAME} v{MY_VERSION_STRING}"
+
+CDN_BUCKET_NAME = 'cdn.door43.org'
+AWS_REGION_NAME = 'us-west-2'
+BUILD_LOG_FILENAME = 'PDF_details.json'
+# Where the CDN bucket can be read over HTTP (can be changed for local testing)
+CDN_DOWNLOAD_BASE_URL = os.getenv('CDN_DOWNLOAD_BASE_URL', 'https://s3-us-west-2.amazonaws.com')
+
+
+
+def get_build_log_key(repo_owner_username:str, repo_name:str) -> str:
+    return f'u/{repo_owner_username}/{repo_name}/{BUILD_LOG_FILENAME}'
+
+
+def get_build_log_url(prefix:str, repo_owner_username:str, repo_name:str) -> str:
+    base_download_url = f'{CDN_DOWNLOAD_BASE_URL}/{prefix}{CDN_BUCKET_NAME}'
+    return f'{base_download_url}/{get_build_log_key(repo_owner_username, repo_name)}'
+
+
+def load_build_log(prefix:str, repo_owner_username:str, repo_name:str) -> Dict[str,Any]:
+    """
+    Returns the existing build log for the repo (or an empty dict if there isn't one).
+    """
+    json_url = get_build_log_url(prefix, repo_owner_username, repo_name)
+    logging.info(f"Checking for JSON build log at {json_url}…")
+    try:
+        PDF_log_dict = json.loads(get_url(json_url))
+    except HTTPError as e:
+        logging.info(f"No existing build log to read: {e}")
+        PDF_log_dict = {}
+    except Exception as e:
+        logging.error(f"Error when trying to read build log: {e}")
+        PDF_log_dict = {}
+    return PDF_log_dict
+
+
+def get_build_fingerprint(options:Optional[Dict[str,Any]], variants:List[Dict[str,Any]]) -> str:
+    """
+    Returns a short hash of everything (apart from the source) that affects the PDFs that a build makes:
+        the options, the (full) variant settings from get_pdf_variants(), and this version of the PDF creator.
+    """
+    fingerprint_json = json.dumps({'options': options or {}, 'variants': variants, 'version': MY_VERSION_STRING},
+                                  sort_keys=True)
+    return hashlib.sha256(fingerprint_json.encode('utf-8')).hexdigest()[:16]
+# end of get_build_fingerprint function
+
+
+def get_reusable_build(PDF_log_dict:Dict[str,Any], tag_or_branch_name:str,
+                        commit_hash:Optional[str]=None, build_fingerprint:Optional[str]=None) -> Optional[Dict[str,Any]]:
+    """
+    Returns the build log entry for the tag/branch
+        if it successfully built a PDF with this version of the PDF creator
+        (and from the given commit with the given build fingerprint, if they're given --
+            either commit hash can be an abbreviated one).
+
+    (Pushes to the repo trigger a new build via the webhook,
+        so a successful entry is for the latest commit that we know about.)
+    """
+    entry = PDF_log_dict.get(tag_or_branch_name)
+    if entry and entry.get('status') == 'success' and str(entry.get('PDF_url', '')).startswith('https://') \
+    and entry.get('PDF_creator_version') == MY_VERSION_STRING \
+    and (commit_hash is None or (entry.get('commit_hash')
+                                and (commit_hash.startswith(entry['commit_hash']) or entry['commit_hash'].startswith(commit_hash)))) \
+    and (build_fingerprint is None or entry.get('build_fingerprint') == build_fingerprint):
+        return entry
+    return None
+# end of get_reusable_build function
+
+
+def save_build_log(prefix:str, repo_owner_username:str, repo_name:str, PDF_log_dict:Dict[str,Any],
+                    aws_access_key_id:str, aws_secret_access_key:str) -> None:
+    """
+    Uploads the (new/updated) build log for the repo.
+    """
+    # Use a unique file in case other jobs are saving their logs at the same time
+    file_descriptor, log_filepath = tempfile.mkstemp(prefix='PDF_details--', suffix='.json')
+    os.close(file_descriptor)
+    try:
+        write_file(log_filepath, PDF_log_dict)
+        logging.info(f"Saving JSON build log to {get_build_log_url(prefix, repo_owner_username, repo_name)} …")
+        from lib.aws_tools.s3_handler import S3Handler # boto3 is slow to import (and loading doesn't need it)
+        cdn_s3_handler = S3Handler(bucket_name=f'{prefix}{CDN_BUCKET_NAME}',
+                                    aws_access_key_id=aws_access_key_id,
+                                    aws_secret_access_key=aws_secret_access_key,
+                                    aws_region_name=AWS_REGION_NAME)
+        cdn_s3_handler.upload_file(log_filepath, get_build_log_key(repo_owner_username, repo_name), cache_time=2)
+    finally:
+        os.remove(log_filepath)
@@ -0,0 +1,108 @@
+"""
+Tracking how far a PDF build has got.
+
+While ConTeXt is running, the \\message{FIGURE: <lang>-<fid>} markers
+    that OBSTexExport puts in front of every frame
+    are counted against the total number of frames.
+ConTeXt normally needs more than one run (pass) through the document,
+    so the overall percentage is only an estimate.
+"""
+from typing import Any, Callable, Dict, Optional
+import re
+from datetime import datetime
+
+
+
+FIGURE_MESSAGE_RE = re.compile(r'FIGURE: (\S+)')
+# e.g., 'mtx-context     | run 2: luatex --fmt="cont-en" …'
+CONTEXT_RUN_RE = re.compile(r'^mtx-context\s+\|\s+run (\d+):')
+EXPECTED_CONTEXT_RUNS = 2 # Usually enough for the table of contents and references to settle
+
+# The overall percentage at the start of each stage
+STAGE_START_PERCENTAGES = {
+    'queued': 0,
+    'downloading': 1,
+    'parsing': 5,
+    'generating TeX': 8,
+    'typesetting': 10,
+    'optimizing': 93,
+    'uploading': 95,
+    'finished': 100,
+    }
+TYPESETTING_PERCENTAGE_SPAN = STAGE_START_PERCENTAGES['optimizing'] - STAGE_START_PERCENTAGES['typesetting']
+
+
+
+class BuildProgress:
+    """
+    Keeps the current stage (and typesetting progress)
+        and passes a dict of it to the optional callback whenever it changes.
+    """
+    def __init__(self, callback:Optional[Callable[[Dict[str,Any]],None]]=None) -> None:
+        self.callback = callback
+        self.stage = 'queued'
+        self.context_run = 0
+        self.figures_done = 0
+        self.total_figures = 0
+        self.last_figure:Optional[str] = None
+
+
+    def set_stage(self, stage:str) -> None:
+        assert stage in STAGE_START_PERCENTAGES
+        self.stage = stage
+        self.report()
+
+
+    def start_typesetting(self, total_figures:int) -> None:
+        self.total_figures = total_figures
+        self.context_run = 0
+        self.figures_done = 0
+        self.set_stage('typesetting')
+
+
+    def context_line(self, line:str) -> None:
+        """
+        Called with each line of ConTeXt output.
+        """
+        match = CONTEXT_RUN_RE.match(line)
+        if match:
+            self.context_run = int(match.group(1))
+            self.figures_done = 0
+            self.report()
+            return
+        match = FIGURE_MESSAGE_RE.search(line)
+        if match:
+            self.figures_done += 1
+            self.last_figure = match.group(1)
+            self.report()
+
+
+    @property
+    def percent(self) -> int:
+        percent = STAGE_START_PERCENTAGES[self.stage]
+        if self.stage == 'typesetting' and self.total_figures:
+            run_fraction = min(self.figures_done / self.total_figures, 1)
+            num_runs = max(EXPECTED_CONTEXT_RUNS, self.context_run)
+            completed_runs = max(self.context_run - 1, 0)
+            percent += TYPESETTING_PERCENTAGE_SPAN * (completed_runs + run_fraction) / num_runs
+        return int(percent)
+
+
+    def to_dict(self) -> Dict[str,Any]:
+        progress_dict = {'stage': self.stage, 'percent': self.percent,
+                         'updated_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+        if self.stage == 'typesetting':
+            progress_dict.update({'context_run': self.context_run,
+                                  'figures_done': self.figures_done,
+                                  'total_figures': self.total_figures,
+                                  'last_figure': self.last_figure})
+        return progress_dict
+
+
+    def report(self) -> None:
+        if self.callback is not None:
+            try:
+                self.callback(self.to_dict())
+            except Exception as e: # Progress reporting must never break a build
+                print(f"Ignoring exception in progress callback: {e}")
+# end of BuildProgress class
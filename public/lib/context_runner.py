@@ -0,0 +1,206 @@
+"""
+Running the ConTeXt command line as a cancellable child process.
+
+ConTeXt (plus mtxrun and the shell that starts them) is run in its own process group
+    so that the whole group can be stopped if the build is no longer wanted,
+    e.g., because a newer commit for the same branch has arrived,
+    or as soon as a fatal error shows up in the output.
+
+The (very verbose) output is streamed line by line into a size-limited log file
+    rather than being collected in memory.
+"""
+from typing import Callable, List, Optional
+import os
+import re
+import signal
+import subprocess
+import threading
+
+
+
+CANCEL_CHECK_INTERVAL_SECONDS = 10 # How often the watchdog calls the cancel check
+TERMINATE_GRACE_SECONDS = 5 # How long to wait after SIGTERM before using SIGKILL
+OUT_LOG_MAX_BYTES = 10_000_000 # context.out is then moved to context.out.1 (and a new one started)
+MAX_ERR_LINES = 100
+
+TEX_ERROR_RE = re.compile(r'^tex error')
+# e.g., 'figures         > figure 'en-obs-01-01.jpg' not found'
+MISSING_FIGURE_RE = re.compile(r'^(?:figures|graphics)\s+>.*\bnot found\b')
+
+# Where the noto fonts can be found (and the mtxrun command to load them so ConTeXt can find them)
+CONTEXT_FONTS_COMMAND = 'export OSFONTDIR="/usr/share/fonts"'
+FONT_RELOAD_COMMAND = 'mtxrun --script fonts --reload'
+CONTEXT_TRACKERS = ('afm.loading', 'fonts.missing', 'fonts.warnings', 'fonts.names',
+                    'fonts.specifications', 'fonts.scaling', 'system.dump')
+
+
+
+class BuildCancelledError(Exception):
+    """
+    Raised when a ConTeXt run was stopped because the build was no longer wanted.
+    """
+    pass
+
+
+
+class ContextRun:
+    """
+    The result of running ConTeXt.
+    """
+    def __init__(self) -> None:
+        self.return_code:Optional[int] = None
+        self.err_lines:List[str] = [] # The 'tex error' (and missing figure) lines
+        self.fatal_line:Optional[str] = None # Set if we stopped ConTeXt early because of this line
+        self.num_lines = 0
+
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.return_code or self.err_lines)
+
+
+
+class RotatingLogWriter:
+    """
+    Writes lines to a log file, moving it to <filepath>.1 whenever it reaches max_bytes,
+        so that a runaway job can't fill up the disk.
+    """
+    def __init__(self, filepath:str, max_bytes:int=OUT_LOG_MAX_BYTES) -> None:
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.file = open(filepath, 'wt', encoding='utf-8')
+
+
+    def write_line(self, line:str) -> None:
+        line_bytes = len(line.encode('utf-8')) + 1
+        if self.num_bytes and self.num_bytes + line_bytes > self.max_bytes:
+            self.file.close()
+            os.replace(self.filepath, f'{self.filepath}.1')
+            self.file = open(self.filepath, 'wt', encoding='utf-8')
+            self.num_bytes = 0
+        self.file.write(f'{line}\n')
+        self.num_bytes += line_bytes
+
+
+    def close(self) -> None:
+        self.file.close()
+
+
+
+def get_typeset_command(tex_filepath:str, trailer_id:Optional[str]=None) -> str:
+    """
+    Returns the ConTeXt command line that typesets the TeX file into a PDF (in the same folder)
+        once the fonts have been loaded.
+
+    If a trailer_id is given, it's used as the PDF document ID and the run dates are left out
+        (so that the same TeX file always gives the same PDF).
+    """
+    deterministic_options = f' --nodates --trailerid={trailer_id}' if trailer_id else ''
+    return f'context --paranoid --nonstopmode --trackers={",".join(CONTEXT_TRACKERS)}{deterministic_options} "{tex_filepath}"'
+# end of get_typeset_command function
+
+
+def classify_line(line:str) -> Optional[str]:
+    """
+    Returns 'tex-error' or 'missing-figure' for lines that mean the PDF is going to be bad,
+        otherwise None.
+    """
+    if TEX_ERROR_RE.match(line):
+        return 'tex-error'
+    if MISSING_FIGURE_RE.match(line):
+        return 'missing-figure'
+    return None
+# end of classify_line function
+
+
+def terminate_process_group(process:subprocess.Popen, grace_seconds:float=TERMINATE_GRACE_SECONDS) -> None:
+    """
+    Asks the process group to terminate, then kills it if it's still running after grace_seconds.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return # Already finished
+    try:
+        process.wait(timeout=grace_seconds)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+# end of terminate_process_group function
+
+
+def run_context(cmd:str, cwd:str, out_log_filepath:str, cancel_check:Optional[Callable[[],bool]]=None,
+                check_interval:float=CANCEL_CHECK_INTERVAL_SECONDS, abort_on_fatal:bool=True,
+                line_callback:Optional[Callable[[str],None]]=None) -> ContextRun:
+    """
+    Runs the shell command (with stderr sent to stdout),
+        writing the non-blank output lines to out_log_filepath as they arrive.
+
+    If abort_on_fatal is set, the process group is terminated
+        as soon as a 'tex error' or missing figure line is seen.
+
+    If cancel_check is given, a watchdog thread calls it every check_interval seconds
+        and terminates the process group if it returns True,
+        in which case BuildCancelledError is raised.
+
+    If line_callback is given, it's called with each non-blank output line (e.g., to track progress).
+
+    Returns a ContextRun (check its failed property).
+    """
+    context_run = ContextRun()
+    process = subprocess.Popen(cmd, shell=True, cwd=cwd, start_new_session=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    finished_event = threading.Event()
+    cancelled_event = threading.Event()
+
+    def watchdog() -> None:
+        while not finished_event.wait(check_interval):
+            try:
+                should_cancel = cancel_check()
+            except Exception as e: # Never let a broken check kill a good build
+                print(f"Ignoring exception in ConTeXt cancel check: {e}")
+                continue
+            if should_cancel:
+                cancelled_event.set()
+                terminate_process_group(process)
+                return
+
+    watchdog_thread = None
+    if cancel_check is not None:
+        watchdog_thread = threading.Thread(target=watchdog, name='ConTeXt-watchdog', daemon=True)
+        watchdog_thread.start()
+    out_log = RotatingLogWriter(out_log_filepath)
+    try:
+        for line_bytes in process.stdout:
+            line = line_bytes.decode('utf-8', 'backslashreplace').rstrip()
+            if not line:
+                continue # ConTeXt outputs lots of blank lines
+            context_run.num_lines += 1
+            out_log.write_line(line)
+            if line_callback is not None:
+                line_callback(line)
+            if classify_line(line) is not None:
+                if len(context_run.err_lines) < MAX_ERR_LINES:
+                    context_run.err_lines.append(line)
+                if abort_on_fatal and context_run.fatal_line is None:
+                    context_run.fatal_line = line
+                    terminate_process_group(process)
+                    # Keep reading so that any remaining buffered output still gets logged
+        context_run.return_code = process.wait()
+    except BaseException:
+        terminate_process_group(process) # Don't leave ConTeXt running behind us
+        raise
+    finally:
+        process.stdout.close()
+        out_log.close()
+        finished_event.set()
+        if watchdog_thread is not None:
+            watchdog_thread.join()
+
+    if cancelled_event.is_set():
+        raise BuildCancelledError(f"ConTeXt run was cancelled (exit code {context_run.return_code})")
+    return context_run
+# end of run_context function
@@ -1,5 +1,6 @@
 from typing import Dict, Optional, Any
 import codecs
+import hashlib
 import json
 import os
 import zipfile
@@ -117,6 +118,18 @@ def get_mime_type(path):
     return mime_type
 
 
+def get_file_md5(path:str) -> str:
+    """
+    Returns the MD5 hex digest of the file's contents
+        (which is also the S3 ETag of an object uploaded in one part).
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
 def copy_tree(src, dst, symlinks=False, ignore=None):
     """
     Recursively copy a directory and all subdirectories. Parameters same as shutil.copytree
@@ -1,6 +1,7 @@
 from typing import Callable
 from contextlib import closing
 import json
+import os
 import shutil
 import ssl
 import sys
@@ -10,6 +11,9 @@ import logging
 from time import sleep
 
 
+CATALOG_URL = os.getenv('DOOR43_CATALOG_URL', 'https://api.door43.org/v3/catalog.json') # Can be changed for local testing
+
+
 def get_url(url:str, catch_exception:bool=False):
     """
     :param str|unicode url: URL to open
@@ -126,8 +130,7 @@ def get_catalog() -> list:
     """
     Returns the api v3 catalog
     """
-    url = 'https://api.door43.org/v3/catalog.json'
-    return json.loads(get_url(url))
+    return json.loads(get_url(CATALOG_URL))
 
 
 def join_url_parts(*args):
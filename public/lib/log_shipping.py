@@ -0,0 +1,346 @@
+"""
+Shipping our log messages to AWS CloudWatch (or a stand-in sink) in batches
+    from one background thread, so that logging never waits on the network.
+
+A LogShipper keeps at most max_queued_events messages in memory
+    (dropping the oldest -- or the newest -- if it gets behind, and saying so in the log),
+    sends them every few seconds (or sooner if a batch fills up),
+    and sends everything left when it's closed (including at exit).
+
+rq runs each job in a forked work horse (which exits with os._exit, so no atexit),
+    so the preloading worker (obs_worker.py) keeps the LogShipper in its own (long-lived) process
+    and gives the work horses a LogForwarder which just passes each message on to it over a socket.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import atexit
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from collections import deque
+from time import time
+
+
+MAX_QUEUED_EVENTS = int(os.getenv('LOG_SHIPPING_MAX_QUEUED_EVENTS', '10000'))
+FLUSH_INTERVAL_SECONDS = float(os.getenv('LOG_SHIPPING_FLUSH_INTERVAL_SECONDS', '5'))
+CLOSE_TIMEOUT_SECONDS = 10
+
+# CloudWatch Logs PutLogEvents limits
+MAX_BATCH_EVENTS = 10_000
+MAX_BATCH_BYTES = 1_048_576
+EVENT_OVERHEAD_BYTES = 26
+MAX_EVENT_BYTES = 256 * 1024 - EVENT_OVERHEAD_BYTES
+MAX_BATCH_SPAN_MILLISECONDS = 24 * 60 * 60 * 1000
+
+MAX_FORWARDED_BYTES = 32 * 1024 # Per datagram (longer messages get split)
+
+# (log_group, stream_name, timestamp_milliseconds, message)
+LogEvent = Tuple[str,str,int,str]
+
+
+
+def split_message(message:str, max_bytes:int) -> List[str]:
+    """
+    Returns the message in parts that each fit into max_bytes (of UTF-8).
+    """
+    message_bytes = message.encode('utf-8')
+    if len(message_bytes) <= max_bytes:
+        return [message]
+    parts = []
+    while message_bytes:
+        part = message_bytes[:max_bytes].decode('utf-8', errors='ignore') # Don't split a character
+        parts.append(part)
+        message_bytes = message_bytes[len(part.encode('utf-8')):]
+    return parts
+# end of split_message function
+
+
+
+class MemoryLogSink:
+    """
+    A stand-in for CloudWatch (for tests and the load test)
+        that just keeps the messages.
+    """
+    def __init__(self) -> None:
+        self.events:Dict[Tuple[str,str],List[Dict[str,Any]]] = {}
+        self.num_batches = 0
+
+    def put_events(self, log_group:str, stream_name:str, events:List[Dict[str,Any]]) -> None:
+        self.events.setdefault((log_group, stream_name), []).extend(events)
+        self.num_batches += 1
+
+    def get_messages(self, log_group:str, stream_name:str) -> List[str]:
+        return [event['message'] for event in self.events.get((log_group, stream_name), [])]
+# end of MemoryLogSink class
+
+
+
+class CloudWatchLogSink:
+    """
+    Sends batches to AWS CloudWatch Logs, creating the log group and stream if they don't exist yet.
+    """
+    def __init__(self, aws_access_key_id:str, aws_secret_access_key:str, aws_region_name:str) -> None:
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.aws_region_name = aws_region_name
+        self.client = None # Made (in the shipping thread) when first needed
+
+
+    def put_events(self, log_group:str, stream_name:str, events:List[Dict[str,Any]]) -> None:
+        if self.client is None:
+            from boto3 import Session # Slow to import
+            self.client = Session(aws_access_key_id=self.aws_access_key_id,
+                                  aws_secret_access_key=self.aws_secret_access_key,
+                                  region_name=self.aws_region_name).client('logs')
+        try:
+            self.client.put_log_events(logGroupName=log_group, logStreamName=stream_name, logEvents=events)
+        except self.client.exceptions.ResourceNotFoundException:
+            for create_function, kwargs in ((self.client.create_log_group, {'logGroupName': log_group}),
+                    (self.client.create_log_stream, {'logGroupName': log_group, 'logStreamName': stream_name})):
+                try:
+                    create_function(**kwargs)
+                except self.client.exceptions.ResourceAlreadyExistsException:
+                    pass
+            self.client.put_log_events(logGroupName=log_group, logStreamName=stream_name, logEvents=events)
+    # end of CloudWatchLogSink.put_events function
+# end of CloudWatchLogSink class
+
+
+
+class LogShipper:
+    """
+    Queues log messages (without blocking) and sends them to the sink in batches from a background thread.
+    """
+    def __init__(self, sink:Any, max_queued_events:int=MAX_QUEUED_EVENTS,
+                    flush_interval_seconds:float=FLUSH_INTERVAL_SECONDS, drop_oldest:bool=True) -> None:
+        self.sink = sink
+        self.max_queued_events = max_queued_events
+        self.flush_interval_seconds = flush_interval_seconds
+        self.drop_oldest = drop_oldest
+        self.queued_events:deque = deque()
+        self.num_dropped:Dict[Tuple[str,str],int] = {} # Since the last batch (by log group and stream)
+        self.total_dropped = self.total_shipped = self.total_failed = 0
+        self.condition = threading.Condition()
+        self.num_queued = self.num_sent = 0 # Counts of events for flush() to wait on
+        self.flush_requested = self.closing = False
+        self.thread = threading.Thread(target=self.run, name='LogShipper', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+
+    def ship(self, log_group:str, stream_name:str, message:str, timestamp_milliseconds:Optional[int]=None) -> None:
+        """
+        Queues the message for sending (never blocks on the network).
+        """
+        if timestamp_milliseconds is None:
+            timestamp_milliseconds = int(time() * 1000)
+        with self.condition:
+            for message_part in split_message(message, MAX_EVENT_BYTES):
+                if len(self.queued_events) >= self.max_queued_events:
+                    if not self.drop_oldest:
+                        self.count_dropped(log_group, stream_name)
+                        continue
+                    self.count_dropped(*self.queued_events.popleft()[:2])
+                    self.num_sent += 1 # So that flush() doesn't wait for it
+                self.queued_events.append((log_group, stream_name, timestamp_milliseconds, message_part))
+                self.num_queued += 1
+            if len(self.queued_events) >= MAX_BATCH_EVENTS:
+                self.condition.notify_all()
+    # end of LogShipper.ship function
+
+
+    def count_dropped(self, log_group:str, stream_name:str, num_dropped:int=1) -> None:
+        # Only called with the condition lock held
+        self.num_dropped[(log_group, stream_name)] = self.num_dropped.get((log_group, stream_name), 0) + num_dropped
+        self.total_dropped += num_dropped
+
+
+    def flush(self, timeout:Optional[float]=None) -> bool:
+        """
+        Waits until everything queued so far has been sent (or timeout seconds).
+
+        Returns False if it timed out.
+        """
+        with self.condition:
+            target_num_sent = self.num_queued
+            self.flush_requested = True
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.num_sent >= target_num_sent or not self.thread.is_alive(),
+                                           timeout=timeout)
+    # end of LogShipper.flush function
+
+
+    def close(self, timeout:Optional[float]=CLOSE_TIMEOUT_SECONDS) -> None:
+        """
+        Sends everything that's left and stops the thread.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+    # end of LogShipper.close function
+
+
+    def run(self) -> None:
+        """
+        The background thread: sends the queued events
+            every flush_interval_seconds, or when a batch is full, a flush is requested or we're closing.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.flush_requested or self.closing
+                                                    or len(self.queued_events) >= MAX_BATCH_EVENTS,
+                                        timeout=self.flush_interval_seconds)
+                events, self.queued_events = list(self.queued_events), deque()
+                num_dropped, self.num_dropped = self.num_dropped, {}
+                self.flush_requested = False
+                closing = self.closing
+            for (log_group, stream_name), num_dropped_here in num_dropped.items():
+                events.append((log_group, stream_name, int(time() * 1000),
+                               f"(The log shipper dropped {num_dropped_here:,} message(s) here because it couldn't keep up)"))
+            self.send(events)
+            with self.condition:
+                self.num_sent += len(events) - len(num_dropped) # The extra (dropped) messages weren't counted
+                self.condition.notify_all()
+                if closing and not self.queued_events:
+                    return
+    # end of LogShipper.run function
+
+
+    def send(self, events:List[LogEvent]) -> None:
+        """
+        Sends the events to the sink in batches that fit into the CloudWatch limits.
+
+        Batches that fail are just counted (and mentioned on stderr) -- logging mustn't break the jobs.
+        """
+        events_by_stream:Dict[Tuple[str,str],List[Dict[str,Any]]] = {}
+        for log_group, stream_name, timestamp_milliseconds, message in events:
+            events_by_stream.setdefault((log_group, stream_name), []).append({'timestamp': timestamp_milliseconds,
+                                                                                'message': message})
+        for (log_group, stream_name), stream_events in events_by_stream.items():
+            stream_events.sort(key=lambda event: event['timestamp']) # CloudWatch needs them in order
+            batch:List[Dict[str,Any]] = []
+            batch_bytes = 0
+            for event in stream_events + [None]: # None to send the last batch
+                if event is not None:
+                    event_bytes = len(event['message'].encode('utf-8')) + EVENT_OVERHEAD_BYTES
+                if batch and (event is None or len(batch) >= MAX_BATCH_EVENTS
+                              or batch_bytes + event_bytes > MAX_BATCH_BYTES
+                              or event['timestamp'] - batch[0]['timestamp'] >= MAX_BATCH_SPAN_MILLISECONDS):
+                    try:
+                        self.sink.put_events(log_group, stream_name, batch)
+                        self.total_shipped += len(batch)
+                    except Exception as e:
+                        self.total_failed += len(batch)
+                        print(f"Unable to ship {len(batch)} log event(s) to {log_group}/{stream_name}: {e}", file=sys.stderr)
+                    batch, batch_bytes = [], 0
+                if event is not None:
+                    batch.append(event)
+                    batch_bytes += event_bytes
+    # end of LogShipper.send function
+# end of LogShipper class
+
+
+
+class LogForwarder:
+    """
+    Passes messages from forked processes to a LogShipper in the process that made this
+        (over a Unix datagram socket, so each message arrives whole).
+
+    Sending never blocks: if the socket buffer is full the message is dropped (and counted).
+    """
+    def __init__(self, shipper:LogShipper) -> None:
+        self.shipper = shipper
+        self.receive_socket, self.send_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.send_socket.setblocking(False)
+        self.num_dropped = 0 # In this process (passed on with the next message that gets through)
+        self.last_log_stream:Optional[Tuple[str,str]] = None # Where to count any malformed messages
+        self.thread = threading.Thread(target=self.run, name='LogForwarder', daemon=True)
+        self.thread.start()
+
+
+    def ship(self, log_group:str, stream_name:str, message:str, timestamp_milliseconds:Optional[int]=None) -> None:
+        if timestamp_milliseconds is None:
+            timestamp_milliseconds = int(time() * 1000)
+        for message_part in split_message(message, MAX_FORWARDED_BYTES):
+            datagram = json.dumps([log_group, stream_name, timestamp_milliseconds, message_part, self.num_dropped],
+                                  ensure_ascii=False)
+            try:
+                self.send_socket.send(datagram.encode('utf-8'))
+                self.num_dropped = 0
+            except OSError: # e.g., BlockingIOError if the shipping process is behind
+                self.num_dropped += 1
+    # end of LogForwarder.ship function
+
+
+    def flush(self, timeout:Optional[float]=None) -> bool:
+        return True # It's up to the shipping process now
+
+
+    def receive(self, block:bool=True) -> bool:
+        """
+        Passes one message on to the shipper.
+
+        Returns False if there wasn't one (when not blocking).
+        """
+        try:
+            datagram = self.receive_socket.recv(MAX_FORWARDED_BYTES * 4, 0 if block else socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return False
+        try:
+            log_group, stream_name, timestamp_milliseconds, message, num_dropped = json.loads(datagram.decode('utf-8'))
+        except (ValueError, TypeError): # Not one of ours, so it's dropped (but we keep on receiving)
+            with self.shipper.condition:
+                if self.last_log_stream is None:
+                    self.shipper.total_dropped += 1
+                else:
+                    self.shipper.count_dropped(*self.last_log_stream)
+            return True
+        self.last_log_stream = log_group, stream_name
+        if num_dropped:
+            with self.shipper.condition:
+                self.shipper.count_dropped(log_group, stream_name, num_dropped)
+        self.shipper.ship(log_group, stream_name, message, timestamp_milliseconds)
+        return True
+    # end of LogForwarder.receive function
+
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.receive()
+            except OSError: # The socket was closed
+                return
+
+
+    def close(self, timeout:Optional[float]=CLOSE_TIMEOUT_SECONDS) -> None:
+        """
+        Passes on anything still in the socket, then closes the shipper (which sends everything).
+        """
+        while self.receive(block=False):
+            pass
+        self.shipper.close(timeout)
+    # end of LogForwarder.close function
+# end of LogForwarder class
+
+
+
+class LogShippingHandler(logging.Handler):
+    """
+    A logging handler that ships each record to one log group and stream.
+    """
+    def __init__(self, shipper:Any, log_group:str, stream_name:str, level:int=logging.NOTSET) -> None:
+        super().__init__(level)
+        self.shipper = shipper
+        self.log_group = log_group
+        self.stream_name = stream_name
+
+    def emit(self, record:logging.LogRecord) -> None:
+        try:
+            self.shipper.ship(self.log_group, self.stream_name, self.format(record), int(record.created * 1000))
+        except Exception:
+            self.handleError(record)
+# end of LogShippingHandler class
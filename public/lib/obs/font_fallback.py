@@ -0,0 +1,177 @@
+"""
+Works out the font fallback file for typesetting an OBS,
+    generating one (from the ranges in the existing noto-<lang>.tex files)
+    for languages that don't have their own.
+
+Generated files are cached by the set of fonts that they use,
+    in a cache folder outside of the application tree
+    (each worker container has its own /tmp).
+"""
+from typing import Dict, List, Set, Tuple
+from functools import lru_cache
+import glob
+import hashlib
+import os
+import re
+import unicodedata
+
+from lib.general_tools.app_utils import get_resources_dir
+from lib.general_tools.file_utils import make_dir
+from lib.obs.obs_classes import OBS
+from lib.obs.glyph_coverage import get_obs_texts, needs_glyph, parse_fallback_line, \
+                                    get_font_coverage, find_uncovered_characters, choose_fallback_file
+
+
+
+FONT_CACHE_DIRPATH = os.getenv('OBS_FONT_CACHE_DIR', '/tmp/obs-font-cache/')
+UNUSED_FALLBACK_FILENAMES = ('noto-all.tex',) # Too experimental to harvest ranges from
+
+font_feature_line_re = re.compile(r'^\s*\\definefontfeature\s*\[([^\]]+)\]')
+features_option_re = re.compile(r'features=([A-Za-z]+)')
+
+
+
+class FallbackFont:
+    """
+    The \\definefallbackfamily lines for one font taken from an existing noto-<lang>.tex file,
+        along with any font features that those lines use.
+    """
+
+    def __init__(self, source_filename:str, font_name:str) -> None:
+        self.source_filename = source_filename
+        self.font_name = font_name
+        self.ranges:List[Tuple[int,int]] = []
+        self.lines:List[str] = []
+        self.feature_lines:List[str] = []
+
+
+    def covers(self, codepoint:int) -> bool:
+        return any(first <= codepoint <= last for first, last in self.ranges)
+
+
+    @property
+    def key(self) -> str:
+        return f'{self.source_filename}:{self.font_name}'
+# end of FallbackFont class
+
+
+@lru_cache()
+def get_fallback_fonts() -> List[FallbackFont]:
+    """
+    Harvests the fallback fonts (and their ranges) from the existing noto-<lang>.tex files.
+
+    Loaded once per process.
+    """
+    fallback_fonts = []
+    for filepath in sorted(glob.glob(os.path.join(get_resources_dir(), 'tex', 'noto-*.tex'))):
+        filename = os.path.basename(filepath)
+        if filename in UNUSED_FALLBACK_FILENAMES:
+            continue
+        with open(filepath, 'rt', encoding='utf-8') as tex_file:
+            lines = tex_file.read().splitlines()
+        feature_lines = {}
+        for line in lines:
+            match = font_feature_line_re.match(line)
+            if match:
+                feature_lines[match.group(1).strip()] = line.strip()
+        fonts_by_name:Dict[str,FallbackFont] = {}
+        for line in lines:
+            parsed = parse_fallback_line(line)
+            if not parsed or not parsed[1]:
+                continue
+            font_name, ranges = parsed
+            if font_name not in fonts_by_name:
+                fonts_by_name[font_name] = FallbackFont(filename, font_name)
+            fallback_font = fonts_by_name[font_name]
+            fallback_font.ranges.extend(r for r in ranges if r not in fallback_font.ranges)
+            fallback_font.lines.append(line.strip())
+            for feature_name in features_option_re.findall(line):
+                if feature_name in feature_lines and feature_lines[feature_name] not in fallback_font.feature_lines:
+                    fallback_font.feature_lines.append(feature_lines[feature_name])
+        fallback_fonts.extend(fonts_by_name.values())
+    return fallback_fonts
+# end of get_fallback_fonts function
+
+
+def get_script_name(char:str) -> str:
+    """
+    Returns the (approximate) Unicode script name for a character, e.g., 'ETHIOPIC'.
+    """
+    return unicodedata.name(char, 'UNKNOWN').split(' ')[0]
+
+
+def detect_scripts(obs_obj:OBS) -> Dict[str,Set[int]]:
+    """
+    Finds the characters that the main Noto fonts can't typeset.
+
+    Returns a dict of script names to the set of codepoints used from that script.
+    """
+    base_coverage = get_font_coverage(None)
+    scripts:Dict[str,Set[int]] = {}
+    for _location, text in get_obs_texts(obs_obj):
+        for char in set(text):
+            if needs_glyph(char) and not base_coverage.covers(ord(char)):
+                scripts.setdefault(get_script_name(char), set()).add(ord(char))
+    return scripts
+
+
+def generate_fallback_file(fallback_fonts:List[FallbackFont], cache_dirpath:str=FONT_CACHE_DIRPATH) -> str:
+    """
+    Writes a fallback file for the given fonts (unless it's already cached).
+
+    Returns the filepath.
+    """
+    fallback_fonts = sorted(fallback_fonts, key=lambda f: f.key)
+    keys = [fallback_font.key for fallback_font in fallback_fonts]
+    key_hash = hashlib.md5('\n'.join(keys).encode('utf-8')).hexdigest()[:12]
+    filepath = os.path.join(cache_dirpath, f'noto-generated-{key_hash}.tex')
+    if os.path.isfile(filepath):
+        return filepath
+
+    output_lines = [f"% Generated by obs-pdf from: {', '.join(keys) if keys else 'nothing -- no fallbacks needed'}"]
+    for fallback_font in fallback_fonts:
+        output_lines.extend(line for line in fallback_font.feature_lines if line not in output_lines)
+    for fallback_font in fallback_fonts:
+        output_lines.extend(fallback_font.lines)
+    make_dir(cache_dirpath)
+    # Write then rename so that concurrent builds never see a partial file
+    tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmp_filepath, 'wt', encoding='utf-8') as tex_file:
+        tex_file.write('\n'.join(output_lines) + '\n')
+    os.replace(tmp_filepath, filepath)
+    return filepath
+# end of generate_fallback_file function
+
+
+def resolve_font_fallback(obs_obj:OBS, cache_dirpath:str=FONT_CACHE_DIRPATH) -> Tuple[str,Dict[str,List[str]],List[str]]:
+    """
+    Uses the language's own noto-<lang>.tex file if it covers the text,
+        else generates (or reuses) a file for the scripts actually used,
+        else chooses the best of the existing files.
+
+    Returns the filepath, any uncovered characters (see find_uncovered_characters),
+        and the names of the scripts detected.
+    """
+    own_filepath = os.path.join(get_resources_dir(), 'tex', f'noto-{obs_obj.language_id}.tex')
+    scripts = detect_scripts(obs_obj)
+    script_names = sorted(scripts)
+    if os.path.isfile(own_filepath) \
+    and not find_uncovered_characters(obs_obj, get_font_coverage(own_filepath)):
+        return own_filepath, {}, script_names
+
+    needed_fonts:List[FallbackFont] = []
+    for script_name in script_names:
+        for codepoint in sorted(scripts[script_name]):
+            if any(fallback_font.covers(codepoint) for fallback_font in needed_fonts):
+                continue
+            fallback_font = next((f for f in get_fallback_fonts() if f.covers(codepoint)), None)
+            if fallback_font is not None:
+                needed_fonts.append(fallback_font)
+    generated_filepath = generate_fallback_file(needed_fonts, cache_dirpath)
+    uncovered = find_uncovered_characters(obs_obj, get_font_coverage(generated_filepath))
+    if not uncovered:
+        return generated_filepath, uncovered, script_names
+
+    filepath, uncovered = choose_fallback_file(obs_obj)
+    return filepath, uncovered, script_names
+# end of resolve_font_fallback function
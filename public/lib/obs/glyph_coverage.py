@@ -0,0 +1,248 @@
+"""
+Checks which characters of the OBS text are covered by the Noto fonts
+    before we spend minutes in ConTeXt producing a PDF full of missing glyphs.
+
+If a glyph index built by resources/tex/index-noto-glyphs.ksh
+    (CreateGlyphLists then CreateTempIndex, i.e., lines like '0x0041 NotoSans-Regular.ttf NotoSerif-Regular.ttf')
+    is available, it's used to check the actual glyphs in each font.
+Otherwise, we assume that each font covers the ranges that it's declared for
+    (which is only approximate, so uncovered characters are then just a warning).
+"""
+from typing import Dict, List, Optional, Set, Tuple
+from bisect import bisect_right
+from functools import lru_cache
+import glob
+import os
+import re
+import unicodedata
+
+from lib.general_tools.app_utils import get_resources_dir
+from lib.obs.obs_classes import OBS
+
+
+
+GLYPH_INDEX_FILEPATH = os.getenv('OBS_GLYPH_INDEX', '/opt/obs/noto-glyph-index.txt')
+BASE_FONT_NAMES = ('NotoSans', 'NotoSerif') # As used by main_template.tex
+
+# Approximately what NotoSans/NotoSerif themselves cover (when we have no glyph index)
+BASE_FONT_RANGES = ((0x0020, 0x007E), (0x00A0, 0x036F), (0x0370, 0x03FF), (0x0400, 0x052F),
+                    (0x1AB0, 0x1AFF), (0x1C80, 0x1C8F), (0x1D00, 0x1DFF), (0x1E00, 0x1FFF),
+                    (0x2000, 0x20CF), (0x2100, 0x214F), (0x2150, 0x218F), (0x2190, 0x21FF),
+                    (0x2200, 0x22FF), (0x25A0, 0x25FF), (0x2C60, 0x2C7F),
+                    (0x2DE0, 0x2DFF), (0x2E00, 0x2E7F), (0xA640, 0xA69F), (0xA720, 0xA7FF),
+                    (0xAB30, 0xAB6F), (0xFB00, 0xFB06), (0xFE20, 0xFE2F), (0xFFFC, 0xFFFD))
+# ConTeXt also accepts some range names instead of numbers
+NAMED_RANGES = {
+    'arabic': ((0x0600, 0x06FF), (0x0750, 0x077F), (0x08A0, 0x08FF), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF)),
+    }
+# Unicode categories that don't need a glyph, e.g., controls, zero-width joiners, and spaces
+IGNORED_CATEGORIES = ('Cc', 'Cf', 'Zs', 'Zl', 'Zp')
+
+fallback_line_re = re.compile(r'^\s*\\definefallbackfamily\s*\[[^\]]*\]\s*\[[^\]]*\]\s*\[([^\]]*)\]\s*\[([^\]]*)\]')
+hex_range_re = re.compile(r'^(?:0[xX])?([0-9a-fA-F]+)(?:-(?:0[xX])?([0-9a-fA-F]+))?$')
+
+
+
+def normalise_font_name(font_name:str) -> str:
+    """
+    Converts 'Noto Sans Ethiopic' or 'NotoSansEthiopic-Regular.ttf' to 'NotoSansEthiopic'.
+    """
+    font_name = font_name.strip()
+    if font_name.endswith(('.ttf','.otf')):
+        font_name = os.path.splitext(font_name)[0]
+    return font_name.split('-')[0].replace(' ', '')
+
+
+def parse_fallback_line(line:str) -> Optional[Tuple[str,List[Tuple[int,int]]]]:
+    """
+    Parses a \\definefallbackfamily line.
+
+    Returns the font name and a list of (first_codepoint, last_codepoint) ranges,
+        or None if it's not a fallback line.
+    """
+    match = fallback_line_re.match(line)
+    if not match:
+        return None
+    ranges = []
+    in_range = False
+    for option in match.group(2).split(','):
+        option = option.strip()
+        if option.startswith('range='):
+            option, in_range = option[len('range='):], True
+        elif '=' in option:
+            in_range = False
+        if not in_range:
+            continue
+        if option.lower() in NAMED_RANGES:
+            ranges.extend(NAMED_RANGES[option.lower()])
+            continue
+        range_match = hex_range_re.match(option)
+        if range_match:
+            first = int(range_match.group(1), 16)
+            last = int(range_match.group(2), 16) if range_match.group(2) else first
+            ranges.append((first, last))
+    return normalise_font_name(match.group(1)), ranges
+# end of parse_fallback_line function
+
+
+def parse_fallback_file(tex_filepath:str) -> List[Tuple[str,int,int]]:
+    """
+    Reads the \\definefallbackfamily lines from a noto-<lang>.tex file.
+
+    Returns a list of (font_name, first_codepoint, last_codepoint) tuples.
+    """
+    results = []
+    with open(tex_filepath, 'rt', encoding='utf-8') as tex_file:
+        for line in tex_file:
+            parsed = parse_fallback_line(line)
+            if parsed:
+                font_name, ranges = parsed
+                results.extend((font_name, first, last) for first, last in ranges)
+    return results
+# end of parse_fallback_file function
+
+
+@lru_cache()
+def get_glyph_index(index_filepath:str=GLYPH_INDEX_FILEPATH) -> Optional[Dict[str,Set[int]]]:
+    """
+    Loads the prebuilt glyph index (once per worker process).
+
+    Returns a dict of font names to the set of codepoints that the font has glyphs for,
+        or None if there's no index available.
+    """
+    if not os.path.isfile(index_filepath):
+        return None
+    glyph_index:Dict[str,Set[int]] = {}
+    with open(index_filepath, 'rt', encoding='utf-8') as index_file:
+        for line in index_file:
+            bits = line.split()
+            if len(bits) < 2:
+                continue
+            codepoint = int(bits[0], 16)
+            for font_file_name in bits[1:]:
+                glyph_index.setdefault(normalise_font_name(font_file_name), set()).add(codepoint)
+    return glyph_index
+# end of get_glyph_index function
+
+
+def has_glyph_index() -> bool:
+    """
+    Returns True if the coverage checks use the actual glyphs in the fonts
+        (rather than just the declared ranges).
+    """
+    return get_glyph_index() is not None
+
+
+
+class FontCoverage:
+    """
+    The characters that can be typeset using the main Noto fonts plus (optionally) one fallback file.
+    """
+
+    def __init__(self, fallback_filepath:Optional[str], glyph_index:Optional[Dict[str,Set[int]]]=None) -> None:
+        self.fallback_filepath = fallback_filepath
+        self.glyph_index = glyph_index
+        self.fallbacks = sorted(parse_fallback_file(fallback_filepath), key=lambda f: f[1]) \
+                            if fallback_filepath else []
+        self.fallback_starts = [first for _font_name, first, _last in self.fallbacks]
+        if glyph_index is None:
+            self.base_codepoints = None
+        else:
+            self.base_codepoints = set()
+            for font_name in BASE_FONT_NAMES:
+                self.base_codepoints.update(glyph_index.get(font_name, ()))
+
+
+    def font_has_glyph(self, font_name:str, codepoint:int) -> bool:
+        if self.glyph_index is None or font_name not in self.glyph_index:
+            return True # Have to assume that it's declared correctly
+        return codepoint in self.glyph_index[font_name]
+
+
+    def covers(self, codepoint:int) -> bool:
+        if self.base_codepoints is None:
+            if any(first <= codepoint <= last for first, last in BASE_FONT_RANGES):
+                return True
+        elif codepoint in self.base_codepoints:
+            return True
+        # Ranges can overlap so check all the ones that start before this codepoint
+        for font_name, first, last in self.fallbacks[:bisect_right(self.fallback_starts, codepoint)]:
+            if first <= codepoint <= last and self.font_has_glyph(font_name, codepoint):
+                return True
+        return False
+# end of FontCoverage class
+
+
+@lru_cache(maxsize=64)
+def get_font_coverage(fallback_filepath:Optional[str]) -> FontCoverage:
+    return FontCoverage(fallback_filepath, get_glyph_index())
+
+
+def get_obs_texts(obs_obj:OBS) -> List[Tuple[str,str]]:
+    """
+    Returns a list of (location, text) tuples for all of the text that gets typeset.
+    """
+    texts = [('title', obs_obj.title), ('front-matter', obs_obj.front_matter), ('back-matter', obs_obj.back_matter)]
+    for chapter in obs_obj.chapters:
+        texts.append((f"{chapter['number']}-title", chapter['title']))
+        texts.append((f"{chapter['number']}-ref", chapter['ref']))
+        texts.extend((frame['id'], frame['text']) for frame in chapter['frames'])
+    return texts
+
+
+def needs_glyph(char:str) -> bool:
+    return unicodedata.category(char) not in IGNORED_CATEGORIES
+
+
+def find_uncovered_characters(obs_obj:OBS, coverage:FontCoverage) -> Dict[str,List[str]]:
+    """
+    Returns a dict of locations (e.g., frame ids) to lists of uncovered codepoints, e.g., 'U+1234'.
+    """
+    checked:Dict[str,bool] = {} # Each character only needs checking once
+    uncovered:Dict[str,List[str]] = {}
+    for location, text in get_obs_texts(obs_obj):
+        for char in sorted(set(text)):
+            if char not in checked:
+                checked[char] = not needs_glyph(char) or coverage.covers(ord(char))
+            if not checked[char]:
+                uncovered.setdefault(location, []).append(f'U+{ord(char):04X}')
+    return uncovered
+# end of find_uncovered_characters function
+
+
+def get_fallback_filepaths(language_id:str) -> List[str]:
+    """
+    Returns the existing noto-*.tex files in the order that we prefer them,
+        i.e., the one for the given language, then the default en one,
+            and the big (slow) noto-all.tex one last.
+    """
+    tex_dirpath = os.path.join(get_resources_dir(), 'tex')
+    preferred_filepaths = [os.path.join(tex_dirpath, f'noto-{language_id}.tex'),
+                           os.path.join(tex_dirpath, 'noto-en.tex')]
+    last_filepath = os.path.join(tex_dirpath, 'noto-all.tex')
+    filepaths = [filepath for filepath in preferred_filepaths if os.path.isfile(filepath)]
+    filepaths.extend(filepath for filepath in sorted(glob.glob(os.path.join(tex_dirpath, 'noto-*.tex')))
+                                if filepath not in filepaths and filepath != last_filepath)
+    if os.path.isfile(last_filepath):
+        filepaths.append(last_filepath)
+    return filepaths
+
+
+def choose_fallback_file(obs_obj:OBS) -> Tuple[str,Dict[str,List[str]]]:
+    """
+    Finds a fallback file that covers all of the characters used in the OBS text,
+        preferring the one for the OBS language.
+
+    Returns the filepath and the uncovered characters
+        (which will be empty unless no file covers everything,
+            in which case the file with the fewest problem locations is returned).
+    """
+    best_filepath, best_uncovered = None, None
+    for filepath in get_fallback_filepaths(obs_obj.language_id):
+        uncovered = find_uncovered_characters(obs_obj, get_font_coverage(filepath))
+        if not uncovered:
+            return filepath, uncovered
+        if best_uncovered is None or len(uncovered) < len(best_uncovered):
+            best_filepath, best_uncovered = filepath, uncovered
+    return best_filepath, best_uncovered
+# end of choose_fallback_file function
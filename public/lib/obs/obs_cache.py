@@ -0,0 +1,103 @@
+"""
+A cache of parsed OBS chapters, keyed on a hash of the chapter markdown,
+    so that rebuilding the same content (e.g., another output variant, a retry or a batch run)
+    can skip the markdown parsing entirely.
+
+The chapters are stored in their compact tuple form (see OBSChapter.to_tuple)
+    as one small JSON file per set of chapters.
+"""
+from typing import List, Optional, Tuple
+import hashlib
+import json
+import os
+import tempfile
+
+from lib.obs import chapters_and_frames
+from lib.obs.obs_classes import OBSChapter
+from lib.obs.obs_source import OBSSource
+
+
+
+PARSE_CACHE_DIRPATH = os.getenv('OBS_PARSE_CACHE_DIR', '/tmp/obs-parse-cache/')
+CACHE_FORMAT_VERSION = 1 # Change this whenever the parsing or the stored form changes
+
+
+
+def get_chapters_key(source:OBSSource) -> Optional[str]:
+    """
+    Returns a hash of the (raw) chapter files
+        or None if any of them are missing (in which case there's nothing worth caching).
+    """
+    hasher = hashlib.sha256(f'{CACHE_FORMAT_VERSION}|{OBSChapter.frame_re.pattern}'.encode('utf-8'))
+    for story_num in range(1, len(chapters_and_frames.frame_counts)+1):
+        relative_path = source.chapter_path(story_num)
+        if not source.exists(relative_path):
+            return None
+        chapter_bytes = source.read_bytes(relative_path)
+        hasher.update(f'|{relative_path}|{len(chapter_bytes)}|'.encode('utf-8'))
+        hasher.update(chapter_bytes)
+    return hasher.hexdigest()
+# end of get_chapters_key function
+
+
+def get_cache_filepath(key:str, cache_dirpath:str=PARSE_CACHE_DIRPATH) -> str:
+    return os.path.join(cache_dirpath, f'chapters-{key}.json')
+
+
+def load_cached_chapters(key:str, cache_dirpath:str=PARSE_CACHE_DIRPATH) -> Optional[List[OBSChapter]]:
+    """
+    Returns the chapters or None if they're not (validly) in the cache.
+    """
+    try:
+        with open(get_cache_filepath(key, cache_dirpath), 'rt', encoding='utf-8') as cache_file:
+            format_version, chapter_tuples = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if format_version != CACHE_FORMAT_VERSION:
+        return None
+    return [OBSChapter.from_tuple(chapter_tuple) for chapter_tuple in chapter_tuples]
+# end of load_cached_chapters function
+
+
+def save_chapters(key:str, chapters:List[OBSChapter], cache_dirpath:str=PARSE_CACHE_DIRPATH) -> str:
+    """
+    Writes the chapters into the cache
+        (via a temporary file so that other processes never see a partial file).
+
+    Returns the cache filepath.
+    """
+    os.makedirs(cache_dirpath, exist_ok=True)
+    cache_filepath = get_cache_filepath(key, cache_dirpath)
+    file_descriptor, temp_filepath = tempfile.mkstemp(dir=cache_dirpath, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wt', encoding='utf-8') as temp_file:
+            json.dump([CACHE_FORMAT_VERSION, [chapter.to_tuple() for chapter in chapters]], temp_file,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_filepath, cache_filepath)
+    except Exception:
+        os.remove(temp_filepath)
+        raise
+    return cache_filepath
+# end of save_chapters function
+
+
+def load_chapters(source:OBSSource, cache_dirpath:str=PARSE_CACHE_DIRPATH) -> Tuple[List[OBSChapter],bool]:
+    """
+    Returns the chapters (in chapter order) from the cache if they're there,
+        else parses them from the source (and saves them in the cache).
+
+    Also returns True if they came from the cache.
+    """
+    key = get_chapters_key(source)
+    if key is not None:
+        cached_chapters = load_cached_chapters(key, cache_dirpath)
+        if cached_chapters is not None:
+            return cached_chapters, True
+    chapters = source.load_chapters()
+    if key is not None:
+        try:
+            save_chapters(key, chapters, cache_dirpath)
+        except OSError as e: # The cache is only an optimisation
+            print(f"Unable to save the parsed chapters to the cache: {e}")
+    return chapters, False
+# end of load_chapters function
@@ -1,6 +1,7 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 import os
+import sys
 from json import JSONEncoder
 
 import regex as re
@@ -56,25 +57,70 @@ class OBSStatus:
 
 
 
+class OBSFrame:
+    """
+    One frame (picture and text) of a chapter.
+
+    The id (e.g., '01-01') is interned since the same ids turn up in every language,
+        and the img URL is only made from the id when it's asked for.
+    Can still be used like the dict that it replaced, e.g., frame['text'].
+    """
+    __slots__ = ('id', 'text')
+    img_url_template = 'https://cdn.door43.org/obs/jpg/360px/obs-en-{0}.jpg'
+
+    def __init__(self, frame_id:str, text:str) -> None:
+        self.id = sys.intern(frame_id)
+        self.text = text
+
+
+    @property
+    def img(self) -> str:
+        return OBSFrame.img_url_template.format(self.id)
+
+
+    def __getitem__(self, item:str):
+        return getattr(self, item)
+
+
+    def __contains__(self, item:str) -> bool:
+        return item in ('id', 'img', 'text')
+
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, OBSFrame) and self.id == other.id and self.text == other.text
+
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.id!r}, {self.text[:20]!r}…)'
+
+
+    def to_dict(self) -> Dict[str,str]:
+        return {'id': self.id, 'img': self.img, 'text': self.text}
+# end of OBSFrame class
+
+
+
 class OBSChapter:
+    __slots__ = ('frames', 'number', 'ref', 'title')
 
     title_re = re.compile(r'^\s*#(.*?)#*\n')
     ref_re = re.compile(r'\n(_*.*?_*)\n*$')
     frame_re = re.compile(r'!\[OBS Image\].*?obs-en-(\d\d)-(\d\d)\.jpg.*?\)\n(.+?)(?=!\[|$)', re.DOTALL)
-    img_url_template = 'https://cdn.door43.org/obs/jpg/360px/obs-en-{0}.jpg'
 
 
-    def __init__(self, json_obj=None) -> None:
+    def __init__(self, json_obj:Optional[Dict[str,Any]]=None) -> None:
         """
-        Class constructor. Optionally accepts an object for initialization.
-        :param object json_obj: The name of a file to deserialize into a OBSStatus object
+        Class constructor. Optionally accepts a dict (as made by to_dict) for initialization.
         """
         # deserialize
         if json_obj:
-            self.__dict__:dict = json_obj
+            self.frames:List[OBSFrame] = [OBSFrame(frame['id'], frame['text']) for frame in json_obj.get('frames', [])]
+            self.number = json_obj.get('number', '')
+            self.ref = json_obj.get('ref', '')
+            self.title = json_obj.get('title', '')
 
         else:
-            self.frames:List[dict] = []
+            self.frames = []
             self.number = ''
             self.ref = ''
             self.title = ''
@@ -102,41 +148,58 @@ class OBSChapter:
         # get the expected number of frames for this chapter
         expected_frame_count = chapters_and_frames.frame_counts[chapter_index]
 
+        frames_by_id = {frame.id:frame for frame in self.frames}
         for x in range(1, expected_frame_count + 1):
 
             # frame id is formatted like '01-01'
             frame_id = f'{self.number.zfill(2)}-{str(x).zfill(2)}'
 
             # get the next frame
-            frame = next((f for f in self.frames if f['id'] == frame_id), None)  # type: dict
+            frame = frames_by_id.get(frame_id)
             if not frame:
                 msg = f"Frame not found: {frame_id}"
                 print(msg)
                 errors.append(msg)
-            else:
-                # check the frame img and  values
-                if 'img' not in frame or not frame['img']:
-                    msg = f'Attribute "img" is missing for frame {frame_id}'
-                    print(msg)
-                    errors.append(msg)
-
-                if 'text' not in frame or not frame['text']:
-                    msg = f'Attribute "text" is missing for frame {frame_id}'
-                    print(msg)
-                    errors.append(msg)
+            elif not frame.text:
+                msg = f'Attribute "text" is missing for frame {frame_id}'
+                print(msg)
+                errors.append(msg)
 
         return errors
 
 
     def __getitem__(self, item):
-        if item in self.__dict__:
-            return self.__dict__[item]
+        return getattr(self, item, None)
+
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, OBSChapter) and self.to_tuple() == other.to_tuple()
 
 
     def __str__(self):
         return self.__class__.__name__ + ' ' + self.number
 
 
+    def to_dict(self) -> Dict[str,Any]:
+        return {'number': self.number, 'title': self.title, 'ref': self.ref,
+                'frames': [frame.to_dict() for frame in self.frames]}
+
+
+    def to_tuple(self) -> Tuple[str,str,str,List[Tuple[str,str]]]:
+        """
+        A compact (JSON-able) form without any of the repeated keys or image URLs -- see from_tuple().
+        """
+        return self.number, self.title, self.ref, [(frame.id, frame.text) for frame in self.frames]
+
+
+    @staticmethod
+    def from_tuple(chapter_tuple) -> 'OBSChapter':
+        return_val = OBSChapter()
+        return_val.number, return_val.title, return_val.ref, frame_tuples = chapter_tuple
+        return_val.frames = [OBSFrame(frame_id, text) for frame_id, text in frame_tuples]
+        return return_val
+
+
     @staticmethod
     def from_markdown(markdown: str, chapter_number: int) -> 'OBSChapter':
         """
@@ -154,19 +217,19 @@ class OBSChapter:
 
 
         # Title: the first non-blank line is title if it starts with '#'
-        title_match = OBSChapter.title_re.search(markdown)
+        title_match = OBSChapter.title_re.search(markdown, concurrent=True)
         if title_match:
             return_val.title = title_match.group(1).strip()
             markdown = markdown.replace(title_match.group(0), str(''), 1)
 
         # Ref
-        ref_match = OBSChapter.ref_re.search(markdown)
+        ref_match = OBSChapter.ref_re.search(markdown, concurrent=True)
         if ref_match:
             return_val.ref = ref_match.group(1).strip()
             markdown = markdown.replace(ref_match.group(0), str(''), 1)
 
         # Frames
-        for frame_match in OBSChapter.frame_re.finditer(markdown):
+        for frame_match in OBSChapter.frame_re.finditer(markdown, concurrent=True): # Releases the GIL for threaded loading
             # 1: chapter number
             # 2: frame number
             # 3: frame text
@@ -174,54 +237,56 @@ class OBSChapter:
             if int(frame_match.group(1)) != chapter_number:
                 raise Exception(f"Expected chapter {chapter_number} but found '{frame_match.group(1)}'.")
 
-            frame_id = f'{frame_match.group(1)}-{frame_match.group(2)}'
-            frame = {'id': frame_id,
-                     'img': OBSChapter.img_url_template.format(frame_id),
-                     'text': frame_match.group(3).strip()
-                    }
-            return_val.frames.append(frame)
+            return_val.frames.append(OBSFrame(f'{frame_match.group(1)}-{frame_match.group(2)}',
+                                              frame_match.group(3).strip()))
 
         return return_val
 
 
 
 class OBS:
+    __slots__ = ('chapters', 'date_modified', 'language_direction', 'language_id', 'language_name',
+                 'title', 'publisher', 'version', 'status', 'front_matter', 'back_matter',
+                 'description', 'extended_description')
 
     def __init__(self, file_name=None):
         """
         Class constructor. Optionally accepts the name of a file to deserialize.
         :param str file_name: The name of a file to deserialize into a OBS object
         """
+        self.chapters:List[OBSChapter] = []
+        self.date_modified = datetime.today().strftime('%Y%m%d')
+        self.language_direction = 'ltr'
+        self.language_id = ''
+        self.language_name = ''
+        self.title = ''
+        self.publisher = ''
+        # self.checking_level = ''
+        self.version = ''
+        self.status = ''
+        self.front_matter = ''
+        self.back_matter = ''
+        self.description:Optional[str] = None
+        self.extended_description:Optional[str] = None
+
         # Deserialize
         if file_name:
             if os.path.isfile(file_name):
-                self.__dict__ = load_json_object(file_name)
+                self.update_from_dict(load_json_object(file_name))
             else:
                 raise IOError(f"The file '{file_name}' was not found.")
-        else:
-            self.app_words = dict(cancel='Cancel',
-                                  chapters='Chapters',
-                                  languages='Languages',
-                                  next_chapter='Next Chapter',
-                                  ok='OK',
-                                  remove_locally='Remove Locally',
-                                  remove_this_string='Remove this language from offline storage. You will need an '
-                                                     'internet connection to view it in the future.',
-                                  save_locally='Save Locally',
-                                  save_this_string='Save this language locally for offline use.',
-                                  select_a_language='Select a Language')
-            self.chapters = []
-            self.date_modified = datetime.today().strftime('%Y%m%d')
-            self.language_direction = 'ltr'
-            self.language_id = ''
-            self.language_name = ''
-            self.title = ''
-            self.publisher = ''
-            # self.checking_level = ''
-            self.version = ''
-            self.status = ''
-            self.front_matter = ''
-            self.back_matter = ''
+
+
+    def update_from_dict(self, obs_dict:Dict[str,Any]) -> None:
+        for name, value in obs_dict.items():
+            if name == 'chapters':
+                value = [OBSChapter(chapter) for chapter in value]
+            if name in OBS.__slots__: # e.g., old files can have app_words
+                setattr(self, name, value)
+
+
+    def to_dict(self) -> Dict[str,Any]:
+        return {name:getattr(self, name) for name in OBS.__slots__}
 
 
     def verify_all(self):
@@ -246,6 +311,8 @@ class OBS:
 
 class OBSEncoder(JSONEncoder):
     def default(self, o):
+        if hasattr(o, 'to_dict'):
+            return o.to_dict()
         return o.__dict__
 
 
@@ -0,0 +1,146 @@
+from typing import Dict, List, FrozenSet, Tuple
+from functools import lru_cache
+import os
+
+from lib.obs import chapters_and_frames
+from lib.obs.obs_classes import OBSChapter
+from lib.obs.obs_source import OBSSource
+from lib.obs.obs_tex_export import OBS_IMAGE_FOLDER_PATH
+
+
+
+REQUIRED_MATTER_PATHS = ('content/front/title.md', 'content/front/intro.md', 'content/back/intro.md')
+REQUIRED_MANIFEST_KEYS = ('version', 'publisher')
+REQUIRED_LANGUAGE_KEYS = ('identifier', 'title', 'direction')
+# Opening and closing markup that should be balanced (else the tags end up in the PDF as they are)
+PAIRED_TAGS = (('<red>','</red>'), ('<blue>','</blue>'), ('<green>','</green>'),
+               ('<sub>','</sub>'), ('<sup>','</sup>'), ('<del>','</del>'))
+
+
+
+@lru_cache()
+def get_available_image_names(image_folder_path:str) -> FrozenSet[str]:
+    """
+    Returns the set of image filenames (loaded once per process).
+    """
+    if not os.path.isdir(image_folder_path):
+        return frozenset()
+    return frozenset(os.listdir(image_folder_path))
+
+
+def get_markup_errors(text:str) -> List[str]:
+    """
+    Checks the markdown text for problems that break the TeX output
+        (braces are passed through to ConTeXt as they are).
+
+    Returns a list of problem descriptions.
+    """
+    problems = []
+    if text.count('{') != text.count('}'):
+        problems.append("Unbalanced braces")
+    return problems
+
+
+def get_markup_warnings(text:str) -> List[str]:
+    """
+    Checks the markdown text for markup that might not come out as intended
+        (these are only rough counts, e.g., bold text can continue onto the next line).
+
+    Returns a list of problem descriptions.
+    """
+    problems = []
+    for open_tag, close_tag in PAIRED_TAGS:
+        if text.count(open_tag) != text.count(close_tag):
+            problems.append(f"Unbalanced {open_tag} markup")
+    if text.count('**') % 2:
+        problems.append("Unmatched ** emphasis")
+    if text.count('[') != text.count(']'):
+        problems.append("Unbalanced square brackets")
+    return problems
+
+
+def preflight_check(source:OBSSource,
+                        image_folder_path:str=OBS_IMAGE_FOLDER_PATH) -> Tuple[List[Dict[str,str]],List[Dict[str,str]]]:
+    """
+    Checks the manifest, the front and back matter, chapter and frame completeness,
+        image availability, and markup sanity
+        without doing any typesetting.
+
+    Returns a list of errors (problems that stop the PDF being built)
+        and a list of warnings (problems that might spoil the PDF),
+        each one being a dict with 'code', 'location', and 'message' entries.
+    """
+    errors:List[Dict[str,str]] = []
+    warnings:List[Dict[str,str]] = []
+
+    def add_error(code:str, location:str, message:str) -> None:
+        errors.append({'code':code, 'location':location, 'message':message})
+
+    def add_warning(code:str, location:str, message:str) -> None:
+        warnings.append({'code':code, 'location':location, 'message':message})
+
+    # Manifest
+    if not source.exists('manifest.yaml'):
+        add_error('missing-manifest', 'manifest.yaml', "Did not find manifest.yaml in the resource container")
+    else:
+        try:
+            dublin_core = source.load_yaml('manifest.yaml')['dublin_core']
+            for key in REQUIRED_MANIFEST_KEYS:
+                if not dublin_core.get(key):
+                    add_error('bad-manifest', 'manifest.yaml', f"Missing dublin_core '{key}' field")
+            for key in REQUIRED_LANGUAGE_KEYS:
+                if not dublin_core['language'].get(key):
+                    add_error('bad-manifest', 'manifest.yaml', f"Missing dublin_core language '{key}' field")
+        except Exception as e:
+            add_error('bad-manifest', 'manifest.yaml', f"Unable to read manifest: {e}")
+
+    # Front and back matter
+    for relative_path in REQUIRED_MATTER_PATHS:
+        if not source.exists(relative_path):
+            add_error('missing-file', relative_path, f"Did not find {relative_path} in the resource container")
+        else:
+            matter_text = source.read_text(relative_path)
+            for problem in get_markup_errors(matter_text):
+                add_error('bad-markup', relative_path, problem)
+            for problem in get_markup_warnings(matter_text):
+                add_warning('suspect-markup', relative_path, problem)
+
+    # Chapters and frames
+    available_image_names = get_available_image_names(image_folder_path)
+    if not available_image_names:
+        add_warning('missing-images', image_folder_path, "No OBS images are available for typesetting")
+    for story_num, expected_frame_count in enumerate(chapters_and_frames.frame_counts, start=1):
+        relative_path = OBSSource.chapter_path(story_num)
+        if not source.exists(relative_path):
+            add_error('missing-chapter', relative_path, f"Did not find chapter {story_num} in the resource container")
+            continue
+        try:
+            obs_chapter = OBSChapter.from_markdown(source.read_text(relative_path), story_num)
+        except Exception as e:
+            add_error('bad-chapter', relative_path, f"Unable to parse chapter: {e}")
+            continue
+
+        if not obs_chapter.title:
+            add_error('missing-title', relative_path, "Title not found")
+        if not obs_chapter.ref:
+            add_error('missing-ref', relative_path, "Ref not found")
+
+        frames_by_id = {frame['id']:frame for frame in obs_chapter.frames}
+        expected_frame_ids = [f'{obs_chapter.number}-{str(x).zfill(2)}' for x in range(1, expected_frame_count + 1)]
+        for frame_id in expected_frame_ids:
+            if frame_id not in frames_by_id:
+                add_error('missing-frame', frame_id, f"Frame not found: {frame_id}")
+            elif not frames_by_id[frame_id]['text']:
+                add_error('missing-text', frame_id, f"Text is missing for frame {frame_id}")
+        for frame_id, frame in frames_by_id.items():
+            if frame_id not in expected_frame_ids:
+                add_error('unexpected-frame', frame_id, f"Unexpected frame: {frame_id}")
+            if available_image_names and f'obs-en-{frame_id}.jpg' not in available_image_names:
+                add_warning('missing-image', frame_id, f"No image available for frame {frame_id}")
+            for problem in get_markup_errors(frame['text']):
+                add_error('bad-markup', frame_id, problem)
+            for problem in get_markup_warnings(frame['text']):
+                add_warning('suspect-markup', frame_id, problem)
+
+    return errors, warnings
+# end of preflight_check function
@@ -0,0 +1,241 @@
+from typing import List, Optional
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import mmap
+import os
+import struct
+import zipfile
+
+import yaml
+
+from lib.obs import chapters_and_frames
+from lib.obs.obs_classes import OBSChapter, OBSError
+
+
+
+MAX_PARSE_WORKERS = 4 # Threads used to decode and parse the chapter files
+ZIP_EXTENDED_TIMESTAMP_ID = 0x5455 # The 'UT' extra field, which has the (UTC) Unix modification time
+
+
+
+class OBSSource(ABC):
+    """
+    Somewhere that we can read the files of an OBS resource container from,
+        e.g., a downloaded zip archive or an (already extracted) directory.
+
+    All paths are relative to the resource container root,
+        i.e., the folder that contains manifest.yaml.
+    """
+
+    def __enter__(self):
+        return self
+
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+    def close(self) -> None:
+        pass
+
+
+    @abstractmethod
+    def exists(self, relative_path:str) -> bool:
+        pass
+
+
+    @abstractmethod
+    def read_bytes(self, relative_path:str) -> bytes:
+        pass
+
+
+    def get_modified_time(self) -> Optional[datetime]:
+        """
+        Returns when the newest file was last changed (or None if that's not known).
+        """
+        return None
+
+
+    def read_text(self, relative_path:str) -> str:
+        """
+        Decodes the file (dropping any BOM) and converts Windows line endings.
+        """
+        content = self.read_bytes(relative_path).decode('utf-8-sig')
+        if '\r' in content: # Saves making a copy for the usual case
+            content = content.replace('\r\n', '\n')
+        return content
+
+
+    def load_yaml(self, relative_path:str):
+        return yaml.safe_load(self.read_text(relative_path))
+
+
+    @staticmethod
+    def chapter_path(story_num:int) -> str:
+        return f'content/{str(story_num).zfill(2)}.md'
+
+
+    def missing_chapters(self) -> List[int]:
+        """
+        Returns a list of the chapter numbers that have no content file.
+        """
+        return [story_num for story_num in range(1, len(chapters_and_frames.frame_counts)+1)
+                if not self.exists(self.chapter_path(story_num))]
+
+
+    def load_chapter(self, story_num:int) -> OBSChapter:
+        obs_chapter = OBSChapter.from_markdown(self.read_text(self.chapter_path(story_num)), story_num)
+
+        # sort the frames by id
+        obs_chapter.frames.sort(key=lambda f: f.id)
+        return obs_chapter
+
+
+    def load_chapters(self, max_workers:int=MAX_PARSE_WORKERS) -> List[OBSChapter]:
+        """
+        Decodes and parses all of the chapter files concurrently.
+
+        Returns the chapters in chapter order.
+        """
+        story_nums = range(1, len(chapters_and_frames.frame_counts)+1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.load_chapter, story_nums))
+# end of OBSSource class
+
+
+
+class DirectoryOBSSource(OBSSource):
+    """
+    Reads an OBS resource container from a folder on disk, e.g., a local mirror.
+    """
+
+    def __init__(self, dirpath:str) -> None:
+        self.dirpath = dirpath
+
+
+    def exists(self, relative_path:str) -> bool:
+        return os.path.isfile(os.path.join(self.dirpath, relative_path))
+
+
+    def read_bytes(self, relative_path:str) -> bytes:
+        with open(os.path.join(self.dirpath, relative_path), 'rb') as in_file:
+            return in_file.read()
+
+
+    def get_modified_time(self) -> Optional[datetime]:
+        modified_times = [os.path.getmtime(os.path.join(folder_path, filename))
+                          for folder_path, _folder_names, filenames in os.walk(self.dirpath) for filename in filenames]
+        return datetime.utcfromtimestamp(max(modified_times)) if modified_times else None
+# end of DirectoryOBSSource class
+
+
+
+class _SeekableMmap(mmap.mmap):
+    """
+    zipfile wants a seekable() method which mmap doesn't have before Python 3.13.
+    """
+    def seekable(self) -> bool:
+        return True
+
+
+
+class ZipOBSSource(OBSSource):
+    """
+    Reads the members of a (memory-mapped) zip archive directly,
+        so nothing ever needs to be extracted to disk.
+
+    The archives from DCS (and the Catalog) have everything inside a top-level folder
+        (e.g., 'en_obs/') so we find the folder containing manifest.yaml
+        unless a root is given.
+
+    Raises OBSError if the file is empty or isn't a zip archive.
+    """
+
+    def __init__(self, zip_filepath:str, root:Optional[str]=None) -> None:
+        self.zip_filepath = zip_filepath
+        self._zip = None
+        self._file = open(zip_filepath, 'rb')
+        if not os.fstat(self._file.fileno()).st_size: # mmap can't map an empty file
+            self._file.close()
+            raise OBSError(f"Source zip file {zip_filepath} is empty")
+        self._mmap = _SeekableMmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._zip = zipfile.ZipFile(self._mmap)
+        except zipfile.BadZipFile as e:
+            self._mmap.close()
+            self._file.close()
+            raise OBSError(f"Source file {zip_filepath} isn't a zip archive: {e}")
+        self._names = set(self._zip.namelist())
+        self.root = self.find_root() if root is None else root
+
+
+    def find_root(self) -> str:
+        manifest_names = [name for name in self._names
+                            if name == 'manifest.yaml' or name.endswith('/manifest.yaml')]
+        if manifest_names:
+            return min(manifest_names, key=len)[:-len('manifest.yaml')]
+        top_level_names = {name.split('/')[0] for name in self._names}
+        if len(top_level_names) == 1:
+            return f'{top_level_names.pop()}/'
+        return ''
+
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+            self._mmap.close()
+            self._file.close()
+            self._zip = None
+
+
+    def exists(self, relative_path:str) -> bool:
+        return f'{self.root}{relative_path}' in self._names
+
+
+    def read_bytes(self, relative_path:str) -> bytes:
+        return self._zip.read(f'{self.root}{relative_path}')
+
+
+    def get_modified_time(self) -> Optional[datetime]:
+        """
+        The archives from DCS (made by git archive) give every file the time of the commit.
+
+        That's taken (as UTC) from the extended timestamp field that git adds,
+            else from the zip (DOS) time, which has no timezone so it's assumed to be UTC.
+        """
+        date_times = []
+        for zip_info in self._zip.infolist():
+            if zip_info.filename.startswith(self.root) and not zip_info.is_dir():
+                unix_time = get_zip_extended_mtime(zip_info.extra)
+                date_times.append(zip_info.date_time if unix_time is None
+                                    else datetime.utcfromtimestamp(unix_time).timetuple()[:6])
+        return datetime(*max(date_times)) if date_times else None
+# end of ZipOBSSource class
+
+
+
+def get_zip_extended_mtime(extra:bytes) -> Optional[int]:
+    """
+    Returns the Unix modification time from the zip member's extended timestamp field
+        (or None if it doesn't have one).
+    """
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from('<HH', extra, offset)
+        data = extra[offset+4:offset+4+data_size]
+        if header_id == ZIP_EXTENDED_TIMESTAMP_ID and len(data) >= 5 and data[0] & 1: # Has the modification time
+            return struct.unpack_from('<i', data, 1)[0]
+        offset += 4 + data_size
+    return None
+
+
+
+def open_obs_source(path:str) -> OBSSource:
+    """
+    Returns the appropriate source for a zip file or a folder.
+    """
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        return ZipOBSSource(path)
+    return DirectoryOBSSource(path)
@@ -6,6 +6,7 @@ import sys
 from string import Template
 import logging
 import datetime
+from functools import lru_cache
 
 # PyPI imports
 import regex as re
@@ -14,11 +15,43 @@ from lib.general_tools.app_utils import get_resources_dir
 from lib.general_tools.file_utils import write_file
 from lib.general_tools.url_utils import join_url_parts
 from lib.obs.obs_classes import OBS
+from lib.story_pdfs import CHAPTER_REFERENCE_PREFIX, CHAPTER_END_REFERENCE_SUFFIX
 
 
 
 UW_OBS_LOGO_PATH = '/opt/obs/png/uW_OBS_Logo.png'
-OBS_IMAGE_FOLDER_PATH = '/opt/obs/jpg/360px/'
+OBS_IMAGE_FOLDER_PATH = os.getenv('OBS_IMAGE_FOLDER', '/opt/obs/jpg/360px/') # Can be changed for local testing
+
+
+
+@lru_cache(maxsize=None)
+def read_template_file(filepath:str) -> str:
+    """
+    Returns the contents of a TeX template/snippet file
+        (only read from disk once per process, since they don't change).
+    """
+    with codecs.open(filepath, 'r', encoding='utf-8-sig') as in_file:
+        return in_file.read()
+# end of read_template_file function
+
+
+
+class LazyPattern:
+    """
+    A class-level regex that's only compiled the first time it's used
+        (so that importing this module doesn't compile them all).
+    """
+    __slots__ = ('pattern', 'compiled_pattern')
+
+    def __init__(self, pattern:str) -> None:
+        self.pattern = pattern
+        self.compiled_pattern = None
+
+    def __get__(self, instance, owner):
+        if self.compiled_pattern is None:
+            self.compiled_pattern = re.compile(self.pattern)
+        return self.compiled_pattern
+# end of LazyPattern class
 
 
 
@@ -36,90 +69,102 @@ class OBSTexExport:
     clickableTextLink_re = r'{\\underbar{{\\goto{\1}[url(\2)]}}}'
 
     # Docuwiki markdown patterns
-    matchRemoveDummyTokenPattern = re.compile(r'===!!!===')
-    matchSingleTokenPattern = re.compile(r'^\s*(\S+)\s*$')
-    matchSectionPattern = re.compile(r'==+\s*(.*?)\s*==+')
+    matchRemoveDummyTokenPattern = LazyPattern(r'===!!!===')
+    matchSingleTokenPattern = LazyPattern(r'^\s*(\S+)\s*$')
+    matchSectionPattern = LazyPattern(r'==+\s*(.*?)\s*==+')
 
     # Character emphasis
-    matchTripleAsteriskPairs = re.compile(r'[*][*][*]\s*(.*?)\s*[*][*][*]')
-    matchTripleUnderlinePairs = re.compile(r'[_][_][_]\s*(.*?)\s*[_][_][_]')
-    matchDoubleAsteriskPairs = re.compile(r'(?=[^*]*)[*][*]\s*(.*?)\s*[*][*](?=[^*]*)')
-    matchDoubleUnderlinePairs = re.compile(r'(?=[^_]*)[_][_]\s*(.*?)\s*[_][_](?=[^_]*)')
-    matchSingleAsteriskPairs = re.compile(r'(?=[^*]*)[*]\s*(.*?)\s*[*](?=[^*]*)')
-    matchSingleUnderlinePairs = re.compile(r'(?=[^_]*)[_]\s*(.*?)\s*[_](?=[^_]*)')
+    matchTripleAsteriskPairs = LazyPattern(r'[*][*][*]\s*(.*?)\s*[*][*][*]')
+    matchTripleUnderlinePairs = LazyPattern(r'[_][_][_]\s*(.*?)\s*[_][_][_]')
+    matchDoubleAsteriskPairs = LazyPattern(r'(?=[^*]*)[*][*]\s*(.*?)\s*[*][*](?=[^*]*)')
+    matchDoubleUnderlinePairs = LazyPattern(r'(?=[^_]*)[_][_]\s*(.*?)\s*[_][_](?=[^_]*)')
+    matchSingleAsteriskPairs = LazyPattern(r'(?=[^*]*)[*]\s*(.*?)\s*[*](?=[^*]*)')
+    matchSingleUnderlinePairs = LazyPattern(r'(?=[^_]*)[_]\s*(.*?)\s*[_](?=[^_]*)')
     # matchItalicPattern = re.compile(r'(?:\A|[^:])//\s*(.*?)\s*//')
     # markdownItalic_re = re.compile(r'(\A|\s+)[_]\s*(.*?)\s*[_](\Z|\s+)')
     # markdownBold_re = re.compile(r'(\A|\s+)[_][_]\s*(.*?)\s*[_][_](\Z|\s+)')
     # matchDoubleUnderlinePairs = re.compile(r'[^_]*__\s*(.*?)\s*__[^_]*')
     # matchSingleUnderlinePairs = re.compile(r'[^_]*_\s*(.*?)\s*_[^_]*')
 
-    matchMonoPattern = re.compile(r'[\'][\']\s*(.*?)\s*[\'][\']')
-    matchRedPattern = re.compile(r'<red>\s*(.*?)\s*</red>')
-    matchMagentaPattern = re.compile(r'<mag[enta]*>\s*(.*?)\s*</mag[enta]*>')
-    matchBluePattern = re.compile(r'<blue>\s*(.*?)\s*</blue>')
-    matchGreenPattern = re.compile(r'<green>\s*(.*?)\s*</green>')
-    matchHeadingFourLevelPattern = re.compile(r'(\A|[^=])====+\s*(.*?)\s*===+?([^=]|\Z)')
-    matchHeadingThreeLevelPattern = re.compile(r'(\A|[^=])===+\s*(.*?)\s*==+?([^=]|\Z)')
-    matchHeadingTwoLevelPattern = re.compile(r'(\A|[^=])==+\s*(.*?)\s*==+?([^=]|\Z)')
-    matchHeadingOneLevelPattern = re.compile(r'(\A|[^=])=+\s*(.*?)\s*=+?([^=]|\Z)')
+    matchMonoPattern = LazyPattern(r'[\'][\']\s*(.*?)\s*[\'][\']')
+    matchRedPattern = LazyPattern(r'<red>\s*(.*?)\s*</red>')
+    matchMagentaPattern = LazyPattern(r'<mag[enta]*>\s*(.*?)\s*</mag[enta]*>')
+    matchBluePattern = LazyPattern(r'<blue>\s*(.*?)\s*</blue>')
+    matchGreenPattern = LazyPattern(r'<green>\s*(.*?)\s*</green>')
+    matchHeadingFourLevelPattern = LazyPattern(r'(\A|[^=])====+\s*(.*?)\s*===+?([^=]|\Z)')
+    matchHeadingThreeLevelPattern = LazyPattern(r'(\A|[^=])===+\s*(.*?)\s*==+?([^=]|\Z)')
+    matchHeadingTwoLevelPattern = LazyPattern(r'(\A|[^=])==+\s*(.*?)\s*==+?([^=]|\Z)')
+    matchHeadingOneLevelPattern = LazyPattern(r'(\A|[^=])=+\s*(.*?)\s*=+?([^=]|\Z)')
 
     # Markdown heading patterns
-    markdownH1_re = re.compile(r'^(\s*)#\s*([^#]+[^\s])(\s*#)*([^#]|\Z)')
-    markdownH2_re = re.compile(r'^(\s*)##\s*([^#]+[^\s])(\s*##)*([^#]|\Z)')
-    markdownH3_re = re.compile(r'^(\s*)###\s*([^#]+[^\s])(\s*###)*([^#]|\Z)')
-    markdownH4_re = re.compile(r'^(\s*)####\s*([^#]+[^\s])(\s*####)*([^#]|\Z)')
+    markdownH1_re = LazyPattern(r'^(\s*)#\s*([^#]+[^\s])(\s*#)*([^#]|\Z)')
+    markdownH2_re = LazyPattern(r'^(\s*)##\s*([^#]+[^\s])(\s*##)*([^#]|\Z)')
+    markdownH3_re = LazyPattern(r'^(\s*)###\s*([^#]+[^\s])(\s*###)*([^#]|\Z)')
+    markdownH4_re = LazyPattern(r'^(\s*)####\s*([^#]+[^\s])(\s*####)*([^#]|\Z)')
 
-    markdownTextURL_re = re.compile(r'\[(.+?)\]\(((?:https://|http://)(?:[^\[\])]+))\)')
-    markdownLongTextURL_re = re.compile(r'\[(.+?)\]\(((?:https://|http://)(?:[^\[\])]{41,}))\)')
-    markdownURL_re = re.compile(r'(?<!([\[(]))https*://[^\s>]+')
+    markdownTextURL_re = LazyPattern(r'\[(.+?)\]\(((?:https://|http://)(?:[^\[\])]+))\)')
+    markdownLongTextURL_re = LazyPattern(r'\[(.+?)\]\(((?:https://|http://)(?:[^\[\])]{41,}))\)')
+    markdownURL_re = LazyPattern(r'(?<!([\[(]))https*://[^\s>]+')
 
-    matchSubScriptPattern = re.compile(r'<sub>\s*(.*?)\s*</sub>')
-    matchSuperScriptPattern = re.compile(r'<sup>\s*(.*?)\s*</sup>')
-    matchStrikeOutPattern = re.compile(r'<del>\s*(.*?)\s*</del>')
+    matchSubScriptPattern = LazyPattern(r'<sub>\s*(.*?)\s*</sub>')
+    matchSuperScriptPattern = LazyPattern(r'<sup>\s*(.*?)\s*</sup>')
+    matchStrikeOutPattern = LazyPattern(r'<del>\s*(.*?)\s*</del>')
 
-    matchPipePattern = re.compile(r'(\|)')
+    matchPipePattern = LazyPattern(r'(\|)')
     # DocuWiki markup patterns applied only to front and back matter
-    matchBulletPattern = re.compile(r'^\s*[*]\s+(.*)$')
+    matchBulletPattern = LazyPattern(r'^\s*[*]\s+(.*)$')
     # Miscellaneous markup patterns
-    matchTitleLogoPattern = re.compile(r'===TITLE\.LOGO===') # TITLE.LOGO
-    matchFrontMatterAboutPattern = re.compile(r'===FRONT\.MATTER\.ABOUT===') # FRONT.MATTER.ABOUT
-    matchFrontMatterlicensePattern = re.compile(r'===FRONT\.MATTER\.LICENSE===') # FRONT.MATTER.LICENSE
-    matchChaptersPattern = re.compile(r'===CHAPTERS===')
-    matchBackMatterPattern = re.compile(r'===BACK\.MATTER===') # BACK.MATTER
-    matchMiscPattern = re.compile(r'<<<[\[]([^<>=]+)[\]]>>>')
+    matchTitleLogoPattern = LazyPattern(r'===TITLE\.LOGO===') # TITLE.LOGO
+    matchFrontMatterAboutPattern = LazyPattern(r'===FRONT\.MATTER\.ABOUT===') # FRONT.MATTER.ABOUT
+    matchFrontMatterlicensePattern = LazyPattern(r'===FRONT\.MATTER\.LICENSE===') # FRONT.MATTER.LICENSE
+    matchChaptersPattern = LazyPattern(r'===CHAPTERS===')
+    matchBackMatterPattern = LazyPattern(r'===BACK\.MATTER===') # BACK.MATTER
+    matchMiscPattern = LazyPattern(r'<<<[\[]([^<>=]+)[\]]>>>')
+    matchPaperSizePattern = LazyPattern(r'(?m)^\\setuppapersize \[[^\]]*\]\[[^\]]*\]')
     # Other patterns
     NBSP = '~'  # non-breaking 1-en space
     NBKN = '\\,\\,\\,'  # Three kerns in a row, non-breaking space
     NBHY = '\u2012'  # non-breaking hyphen
-    matchColonSemicolonNotAfterDigits = re.compile(r'([^\d\s])\s*([:;])\s*([^\s])')
-    matchCommaBetweenDigits = re.compile(r'(\d)\s*([,])\s*(\d)')
-    matchHyphen = re.compile(r'[-\u2010\u2012\u2013\uFE63]')
-    matchHyphenEM = re.compile(r'[\u2014\uFE58]')
-    matchAlphaNumSpaceThenNumber = re.compile(r'(\w)\s+(\d)')
+    matchColonSemicolonNotAfterDigits = LazyPattern(r'([^\d\s])\s*([:;])\s*([^\s])')
+    matchCommaBetweenDigits = LazyPattern(r'(\d)\s*([,])\s*(\d)')
+    matchHyphen = LazyPattern(r'[-\u2010\u2012\u2013\uFE63]')
+    matchHyphenEM = LazyPattern(r'[\u2014\uFE58]')
+    matchAlphaNumSpaceThenNumber = LazyPattern(r'(\w)\s+(\d)')
     # matchAlphaNum = re.compile(r'[A-Za-z0-9]')
-    matchSignificantTex = re.compile(r'[A-Za-z0-9\\{}\[\]]')
-    matchBlankLinePattern = re.compile(r'^\s*$')
+    matchSignificantTex = LazyPattern(r'[A-Za-z0-9\\{}\[\]]')
+    matchBlankLinePattern = LazyPattern(r'^\s*$')
 
-    matchOrdinalBookSpaces = re.compile(r'([123](|\.|\p{L}]{1,3}))\s')
-    matchChapterVersePattern = re.compile(r'\s+(\d+:\d+)')
+    matchOrdinalBookSpaces = LazyPattern(r'([123](|\.|\p{L}]{1,3}))\s')
+    matchChapterVersePattern = LazyPattern(r'\s+(\d+:\d+)')
 
     # endregion
 
 
-    def __init__(self, obs_obj:OBS, out_path:str, max_chapters:int, img_res:str, options:Optional[Dict[str,str]]=None) -> None:
+    def __init__(self, obs_obj:OBS, out_path:str, max_chapters:int, img_res:str, options:Optional[Dict[str,str]]=None,
+                        font_fallback_filepath:Optional[str]=None, paper_size:str='Trade',
+                        created_date:Optional[datetime.date]=None) -> None:
         """
 
         options is a optional dict of PDF options. Currently supported:
             suppress_created_from_line
             suppress_extended_description
+
+        font_fallback_filepath is the noto-<lang>.tex type file to use
+            (defaults to the one for the OBS language).
+
+        paper_size is Trade (defined in main_template.tex) or a ConTeXt paper size like A5.
+
+        created_date is the date for the "PDF created" line (defaults to today).
         """
         self.options = options
+        self.font_fallback_filepath = font_fallback_filepath
         self.language_id = obs_obj.language_id
         self.language_name = obs_obj.language_name
         self.language_direction = obs_obj.language_direction
         self.out_path = out_path
         self.max_chapters = max_chapters
         self.img_res = img_res
+        self.created_date = created_date or datetime.date.today()
         self.description, self.extended_description = obs_obj.description, obs_obj.extended_description
         self.title = obs_obj.title
         self.publisher = obs_obj.publisher
@@ -128,7 +173,8 @@ class OBSTexExport:
         self.body_json = {'chapters': obs_obj.chapters,
                           'language_id': self.language_id,
                           'language_direction': self.language_direction,
-                          'toctitle': self.title}
+                          'toctitle': self.title,
+                          'papersize': paper_size}
 
         self.num_items = 0
 
@@ -154,6 +200,9 @@ class OBSTexExport:
             self.body_json['botspace'] = '28pt'  # nice for en,fr,es
         if 'fontface' not in self.body_json.keys():
             self.body_json['fontface'] = 'noto'
+        if 'fontfallback' not in self.body_json.keys():
+            self.body_json['fontfallback'] = self.font_fallback_filepath \
+                or os.path.join(OBSTexExport.snippets_dirpath, f"{self.body_json['fontface']}-{self.language_id}.tex")
 
         # this is for production but does not seem to work for Russian
         if 'fontstyle' not in self.body_json.keys():
@@ -224,8 +273,7 @@ class OBSTexExport:
         if not os.path.isdir(OBSTexExport.snippets_dirpath):
             raise IOError(f"Path not found: {OBSTexExport.snippets_dirpath}")
 
-        with codecs.open(os.path.join(OBSTexExport.snippets_dirpath, entry_name), 'r', encoding='utf-8-sig') as in_file:
-            each = in_file.readlines()
+        each = read_template_file(os.path.join(OBSTexExport.snippets_dirpath, entry_name)).splitlines(keepends=True)
 
         each = each[1:]  # Skip the first line which is the utf-8 coding repeated
         return_val = ''.join(each)
@@ -241,8 +289,28 @@ class OBSTexExport:
         return return_val
 
 
-    def get_title(self, text):
-        return f"    \\startmakeup\\textdir {'TRT' if self.language_direction=='rtl' else 'TLT'}\\section{{{text}}}\\stopmakeup"
+    def get_title(self, text, reference:str=''):
+        """
+        The reference (if given) lets us find the page where the section starts afterwards (see lib/story_pdfs.py).
+        """
+        reference_bit = f'[{reference}]' if reference else ''
+        return f"    \\startmakeup\\textdir {'TRT' if self.language_direction=='rtl' else 'TLT'}\\section{reference_bit}{{{text}}}\\stopmakeup"
+
+
+    @staticmethod
+    def get_image_folderpath(res:str) -> str:
+        return join_url_parts(OBSTexExport.api_url_jpg, res) + '/'
+
+
+    @staticmethod
+    def get_variant_tex(tex:str, from_image_folderpath:str, to_image_folderpath:str, paper_size:str) -> str:
+        """
+        Returns the TeX (from get_tex) using a different folder of pictures and paper size
+            so that other variants of the PDF don't need it all exported again.
+        """
+        if to_image_folderpath != from_image_folderpath:
+            tex = tex.replace(from_image_folderpath, to_image_folderpath)
+        return OBSTexExport.matchPaperSizePattern.sub(lambda _match: f'\\setuppapersize [{paper_size}][{paper_size}]', tex)
 
 
     @staticmethod
@@ -469,7 +537,8 @@ class OBSTexExport:
             past_max_chapters = (max_chapters > 0) and (ix_chp >= max_chapters)
             if past_max_chapters:
                 break
-            output.append(self.get_title(chp['title']))
+            chapter_reference = f"{CHAPTER_REFERENCE_PREFIX}{str(chp['number']).zfill(2)}"
+            output.append(self.get_title(chp['title'], chapter_reference))
             chapter_frames = chp['frames']
             n_frame = len(chapter_frames)
             ref_text_only = OBSTexExport.do_not_break_before_chapter_verse(chp['ref'])
@@ -523,6 +592,7 @@ class OBSTexExport:
                     output.append(OBSTexExport.end_of_physical_page(spaces4))
                     output.append(spaces4 + '\\page[yes]')
             output.append(self.get_ref(place_ref_template, ref_text_only))
+            output.append(f'{spaces4}{spaces4}\\pagereference[{chapter_reference}{CHAPTER_END_REFERENCE_SUFFIX}]') # On its last page
             output.append(OBSTexExport.end_of_physical_page(spaces4))
             output.append(spaces4 + '\\page[yes]')
         return '\n'.join(output)
@@ -533,12 +603,16 @@ class OBSTexExport:
         """
         Create the TeX file in self.outpath.
         """
+        write_file(self.out_path, self.get_tex())
+    # end of create_tex_file()
 
-        relative_path_re = re.compile(r'([{ ])obs/tex/')
 
-        remember_out = sys.stdout
+    def get_tex(self) -> str:
+        """
+        Returns the contents for the TeX file.
+        """
 
-        sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+        relative_path_re = re.compile(r'([{ ])obs/tex/')
 
         # Parse the front and back matter
         front_matter = self.export_matter(self.front_matter, test=False)
@@ -559,7 +633,7 @@ class OBSTexExport:
         suppress_created_from_line = self.options and 'suppress_created_from_line' in self.options and self.options['suppress_created_from_line']
         if not suppress_created_from_line: # Add created date (and commit_hash)
             # TODO: Do these strings need to be translated???
-            output_front_license += f"\n\nPDF created {datetime.date.today()} from {self.description}."
+            output_front_license += f"\n\nPDF created {self.created_date} from {self.description}."
             suppress_extended_description = self.options and 'suppress_extended_description' in self.options and self.options['suppress_extended_description']
             if self.extended_description and not suppress_extended_description: # Add an extra small line with more details like the commit hash
                 output_front_license += f"\n    \\tfxx{{(From {self.extended_description}.)}}"
@@ -578,8 +652,7 @@ class OBSTexExport:
             print("Failed to get TeX template.")
             sys.exit(1)
 
-        with codecs.open(tex_template_filepath, 'r', encoding='utf-8-sig') as in_file:
-            template = in_file.read()
+        template = read_template_file(tex_template_filepath)
 
         # replace relative path to fonts with absolute
         template = relative_path_re.sub(r'\1{0}/'.format(OBSTexExport.snippets_dirpath), template)
@@ -604,8 +677,5 @@ class OBSTexExport:
                         = OBSTexExport.matchMiscPattern.subn(self.another_replace, single_line,
                                                          OBSTexExport.MATCH_ALL)
                 outlist.append(single_line)
-        full_output = '\n'.join(outlist)
-        write_file(self.out_path, full_output)
-
-        sys.stdout = remember_out
-    # end of create_tex_file()
+        return '\n'.join(outlist)
+    # end of get_tex()
@@ -1,31 +1,117 @@
 #!/usr/bin/python3
 
-from typing import Dict, List, Tuple, Union, Optional
-import codecs
+from typing import Any, Callable, Dict, List, Tuple, Union, Optional, TYPE_CHECKING
+import calendar
 import datetime
-import re
-import shutil
-import subprocess
+import json
 import time
 import os
-from os.path import isfile, isdir, getsize
+import shutil
+from os.path import isfile, getsize
+import tempfile
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from lib.general_tools.app_utils import get_output_dir, get_resources_dir
-from lib.general_tools.file_utils import make_dir, unzip, load_yaml_object, read_file, write_file, remove_tree
+from lib.general_tools.app_utils import get_output_dir
+from lib.general_tools.file_utils import make_dir, read_file, write_file, remove_tree, get_file_md5
 from lib.general_tools.url_utils import get_catalog, download_file
-from lib.aws_tools.s3_handler import S3Handler
+from lib.build_checkpoints import BuildCheckpoints
+from lib.build_log import get_build_fingerprint
+from lib.build_progress import BuildProgress
+from lib.pdf_optimizer import optimize_pdf
+from lib.story_pdfs import get_chapter_page_ranges, make_story_pdfs
+from lib.pdf_variants import get_pdf_variants, prepare_image_folder, ORIGINAL_IMG_RES, DEFAULT_VARIANT_NAME
+from lib.context_runner import run_context, BuildCancelledError, \
+                                CONTEXT_FONTS_COMMAND, FONT_RELOAD_COMMAND, get_typeset_command
+
+from lib.obs import chapters_and_frames
+from lib.obs.obs_classes import OBSChapter, OBS, OBSEncoder, OBSError
+from lib.obs.obs_cache import load_chapters as load_cached_obs_chapters
+from lib.obs.font_fallback import resolve_font_fallback
+from lib.obs.glyph_coverage import has_glyph_index
+from lib.obs.obs_preflight import preflight_check
+from lib.obs.obs_source import OBSSource, ZipOBSSource
 
-from lib.obs.obs_classes import OBSChapter, OBS, OBSError
-from lib.obs.obs_tex_export import OBSTexExport
+if TYPE_CHECKING: # boto3 is slow to import so it's only imported once a build needs it
+    from lib.aws_tools.s3_handler import S3Handler
 
 
 
 AWS_REGION_NAME = 'us-west-2'
 CDN_BUCKET_NAME = 'cdn.door43.org'
+MIN_PDF_FILESIZE = 1_000_000 # Should be MB not just KB (it's smaller if pictures are missing)
 OLD_CDN_FOLDER = 'obs/auto_PDFs' # Folder inside the CDN bucket
 # OLD_CDN_FOLDER = 'tx/job/auto_PDFs' # Folder inside the CDN bucket -- this one has 1-DAY AUTODELETE
-DOOR43_SITE_URL = 'https://git.door43.org'
+DOOR43_SITE_URL = os.getenv('DOOR43_SITE_URL', 'https://git.door43.org') # Can be changed for local testing
+# Optionally pin the dates and document IDs in the PDFs to the source (commit) time
+#   so that rebuilding the same source gives the same PDF (which then doesn't need uploading again)
+DETERMINISTIC_BUILDS = os.getenv('OBS_DETERMINISTIC_BUILDS', '0') != '0'
+# The PDFs are uploaded under keys that include (the start of) their MD5 so they can be cached forever,
+#   and a small JSON pointer for each repo spec names the current ones
+CONTENT_HASH_LENGTH = 16
+IMMUTABLE_CACHE_SECONDS = 365 * 24 * 60 * 60
+POINTER_CACHE_SECONDS = int(os.getenv('PDF_POINTER_CACHE_SECONDS', '60'))
+
+
+
+def find_catalog_source_url(catalog:dict, lang_code:str) -> str:
+    """
+    Returns the URL of the zipped markdown OBS for the language from the Door43 Catalog.
+
+    Raises ValueError if there isn't exactly one.
+    """
+    langs = [l for l in catalog['languages'] if l['identifier'] == lang_code]  # type: dict
+
+    if not langs:
+        raise ValueError(f'Did not find "{lang_code}" in the catalog.')
+
+    if len(langs) > 1:
+        raise ValueError(f'Found more than one entry for "{lang_code}" in the catalog.')
+
+    lang_info = langs[0]  # type: dict
+
+    # 1. Get the zip file from the API
+    resources = [r for r in lang_info['resources'] if r['identifier'] == 'obs']  # type: dict
+
+    if not resources:
+        raise ValueError(f'Did not find an entry for "{lang_code}" OBS in the catalog.')
+
+    if len(resources) > 1:
+        raise ValueError(f'Found more than one entry for "{lang_code}" OBS in the catalog.')
+
+    resource = resources[0]  # type: dict
+
+    found_sources = []
+
+    for project in resource['projects']:
+        if project['formats']:
+            urls = [f['url'] for f in project['formats']
+                    if 'application/zip' in f['format'] and 'text/markdown' in f['format']]
+
+            if len(urls) > 1:
+                raise ValueError(f'Found more than one zipped markdown entry for "{lang_code}" OBS in the catalog.')
+
+            if len(urls) == 1:
+                found_sources.append(urls[0])
+
+    if not found_sources:
+        raise ValueError(f'Did not find any zipped markdown entries for "{lang_code}" OBS in the catalog.')
+
+    if len(found_sources) > 1:
+        raise ValueError(f'Found more than one zipped markdown entry for "{lang_code}" OBS in the catalog.')
+
+    return found_sources[0]
+# end of find_catalog_source_url function
+
+
+def get_catalog_obs_lang_codes(catalog:dict) -> List[str]:
+    """
+    Returns the language codes of all the OBS resources in the Door43 Catalog.
+    """
+    return [lang_info['identifier'] for lang_info in catalog['languages']
+            if any(resource['identifier'] == 'obs' for resource in lang_info['resources'])]
+# end of get_catalog_obs_lang_codes function
 
 
 
@@ -33,8 +119,14 @@ class PdfFromDcs:
     """
     Called from Flask after accepting payload.
     """
-
-    def __init__(self, prefix:str, parameter_type:str, parameter:Union[str,Tuple[str,str,str],Tuple[str,str,str,str]], options:Optional[Dict[str,str]]=None) -> None:
+    reload_fonts = True # A long-lived (preloading) process can do it once for all of its builds instead
+
+    def __init__(self, prefix:str, parameter_type:str, parameter:Union[str,Tuple[str,str,str],Tuple[str,str,str,str]], options:Optional[Dict[str,str]]=None,
+                        cancel_check:Optional[Callable[[],bool]]=None,
+                        progress_callback:Optional[Callable[[Dict[str,Any]],None]]=None,
+                        catalog:Optional[dict]=None, cdn_s3_handler:Optional['S3Handler']=None,
+                        isolated:bool=False, checkpoint_key:Optional[str]=None,
+                        variants:Optional[List[Union[str,Dict[str,Any]]]]=None) -> None:
         """
         prefix is '' or 'dev-'
 
@@ -50,6 +142,26 @@ class PdfFromDcs:
         options is a optional dict of PDF options. Currently supported:
             suppress_created_from
             suppress_extended_description
+
+        cancel_check is an optional function that's called every few seconds while ConTeXt is running
+            and that returns True if the build is no longer wanted (BuildCancelledError is then raised).
+
+        progress_callback is an optional function that's given a BuildProgress dict
+            whenever the build moves on (which can be many times a second while ConTeXt is running).
+
+        catalog and cdn_s3_handler can be given to save fetching the Door43 Catalog
+            or making a new S3 connection for every build (e.g., in a batch).
+
+        If isolated is set, other builds can run at the same time (e.g., in a batch):
+            left-over files aren't cleaned up and the logs go in the build's own temporary folder.
+
+        If checkpoint_key is given (e.g., the job identifier) and the parameter includes the commit hash,
+            each completed stage is checkpointed so that a retry with the same key
+            can carry on from the last one (rather than starting again from the download).
+            (Without a commit hash, a retry might need newer content, so it always starts again.)
+
+        variants is an optional list of the PDFs to make (see lib/pdf_variants.py) -- just 'print' by default.
+            The first one is the main PDF, and ValueError is raised if they're not valid.
         """
         assert prefix in ('','dev-')
         assert parameter_type in ('Catalog_lang_code','Door43_repo','username_repoName_spec')
@@ -59,11 +171,35 @@ class PdfFromDcs:
         self.parameter_type = parameter_type
         self.parameter = parameter
         self.options = options
+        self.variants = get_pdf_variants(variants)
+        self.cancel_check = cancel_check
+        self.progress = BuildProgress(callback=progress_callback)
+        self.catalog = catalog
+        self.cdn_s3_handler = cdn_s3_handler
+        self.isolated = isolated
+        self.build_fingerprint = get_build_fingerprint(options, self.variants)
+        self.checkpoints:Optional[BuildCheckpoints] = None
+        if checkpoint_key and parameter_type == 'username_repoName_spec' and len(parameter) == 4:
+            self.checkpoints = BuildCheckpoints(checkpoint_key, fingerprint=self.build_fingerprint)
 
         self.output_msgs = ''
-        self.output_msg_filepath = '/tmp/last_output_msgs.txt'
+        self.output_msg_lock = threading.Lock() # The variants are typeset in their own threads
+        self.output_msg_filepath:Optional[str] = '/tmp/last_output_msgs.txt'
+        if self.isolated: # Don't write to the shared file -- it's set below once we have our own folder
+            self.output_msg_filepath = None
 
         self.prefixed_bucket_name = f'{self.prefix}{CDN_BUCKET_NAME}'
+        self.source:Optional[OBSSource] = None
+        self.source_zip_url:Optional[str] = None
+        self.preflight_warnings:List[Dict[str,str]] = []
+        self.source_date:Optional[datetime.datetime] = None # Only set for deterministic builds
+        self.font_fallback_filepath:Optional[str] = None
+        self.pdf_optimization:Optional[Dict[str,Any]] = None # For the main PDF
+        self.pdf_variants:Dict[str,Dict[str,Any]] = {} # The settings and results for each variant
+        self.chapter_page_ranges:Dict[str,Tuple[int,int]] = {} # Of the main PDF (from ConTeXt)
+        self.story_pdfs_url:Optional[str] = None # The JSON index of the separate story PDFs
+        self.pdf_pointer_url:Optional[str] = None # The JSON that names the current PDFs
+        self.was_typeset = False # Set once ConTeXt has been run (rather than resuming from a checkpoint)
 
         self.output_msg(f"{datetime.datetime.now()} => Starting up with type={parameter_type} and parameter(s)={parameter}…\n")
         self.lang_code = self.given_repo_spec = self.commit_hash = None
@@ -100,6 +236,11 @@ class PdfFromDcs:
             self.output_msg(err_msg)
             raise TypeError
         self.tmp_download_dirpath = f"/tmp/obs-to-pdf/{self.filename_bit}--{int(time.time())}/"
+        if self.isolated: # Must be unique even for the same repo in the same second
+            make_dir('/tmp/obs-to-pdf/')
+            self.tmp_download_dirpath = tempfile.mkdtemp(prefix=f'{self.filename_bit}--{int(time.time())}--', dir='/tmp/obs-to-pdf/') + '/'
+            self.output_msg_filepath = os.path.join(self.tmp_download_dirpath, 'output_msgs.txt')
+        self.log_dirpath = self.tmp_download_dirpath if self.isolated else get_output_dir()
 
         # AWS credentials -- get the secret ones from environment variables
         try:
@@ -119,7 +260,8 @@ class PdfFromDcs:
 
     # noinspection PyUnusedLocal
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        pass
+        if self.source is not None:
+            self.source.close()
 
 
     def output_msg(self, msg:str) -> None:
@@ -127,130 +269,140 @@ class PdfFromDcs:
         Outputs/Saves a message for debugging and/or showing status
         """
         print(msg)
-        self.output_msgs += msg
-        write_file(self.output_msg_filepath, self.output_msgs)
+        with self.output_msg_lock:
+            self.output_msgs += msg
+            if self.output_msg_filepath:
+                write_file(self.output_msg_filepath, self.output_msgs)
 
 
-    def run(self) -> str:
+    def fetch_source(self) -> OBSSource:
         """
         Clean up left-over files from any previous runs.
         If a language code is given,
             download the uW Catalog and find the requested language.
         Or if a repo user/repo_name is given,
             skip that.
-        Download the correct OBS zipped data.
-            Unzip and check the OBS data.
-        Call PdfFromDcs.create_and_upload_pdf function to make the PDF
+        Download the correct OBS zipped data (only once per PdfFromDcs object).
+
+        Returns the source for reading the OBS files.
         """
-        self.output_msg(f"{datetime.datetime.now()} => Starting OBS PDF processing for {self.description}…\n")
+        if self.source is not None: # We already have it
+            return self.source
 
         # Clean up left-over files from any previous runs
-        self.cleanup_files()
+        if not self.isolated: # Other builds might be using them
+            self.cleanup_files()
 
-        # Initialize some variables
-        today = ''.join(str(datetime.date.today()).rsplit(str('-'))[0:3])  # str(datetime.date.today())
         # self.download_dir = '/tmp/obs-to-pdf/{0}-{1}'.format(self.lang_code, int(time.time()))
         make_dir(self.tmp_download_dirpath)
 
+        fetched_checkpoint = self.get_checkpoint('fetched')
+        if fetched_checkpoint is not None:
+            self.source_zip_url = fetched_checkpoint.get('source_url')
+            self.output_msg(f"{datetime.datetime.now()} => Resuming with the source zip from the {self.checkpoints.get_last_stage()!r} checkpoint…\n")
+            self.source = ZipOBSSource(self.checkpoints.get_artifact_filepath('obs.zip'))
+            self.source_date = self.source.get_modified_time() if DETERMINISTIC_BUILDS else None
+            return self.source
+
         if self.parameter_type == 'Catalog_lang_code':
-            # Get the catalog
-            self.output_msg(f"{datetime.datetime.now()} => Downloading the Door43 Catalog…\n")
-            catalog = get_catalog()
+            # Get the catalog (unless we were given one)
+            if self.catalog is None:
+                self.output_msg(f"{datetime.datetime.now()} => Downloading the Door43 Catalog…\n")
+                self.catalog = get_catalog()
 
             # Find the language we need
-            langs = [l for l in catalog['languages'] if l['identifier'] == self.lang_code]  # type: dict
-
-            if not langs:
-                err_msg = f'Did not find "{self.lang_code}" in the catalog.'
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ValueError(err_msg)
-
-            if len(langs) > 1:
-                err_msg = f'Found more than one entry for "{self.lang_code}" in the catalog.'
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ValueError(err_msg)
-
-            lang_info = langs[0]  # type: dict
-
-            # 1. Get the zip file from the API
-            resources = [r for r in lang_info['resources'] if r['identifier'] == 'obs']  # type: dict
-
-            if not resources:
-                err_msg = f'Did not find an entry for "{self.lang_code}" OBS in the catalog.'
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ValueError(err_msg)
-
-            if len(resources) > 1:
-                err_msg = f'Found more than one entry for "{self.lang_code}" OBS in the catalog.'
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ValueError(err_msg)
-
-            resource = resources[0]  # type: dict
-
-            found_sources = []
-
-            for project in resource['projects']:
-                if project['formats']:
-                    urls = [f['url'] for f in project['formats']
-                            if 'application/zip' in f['format'] and 'text/markdown' in f['format']]
-
-                    if len(urls) > 1:
-                        err_msg = f'Found more than one zipped markdown entry for "{self.lang_code}" OBS in the catalog.'
-                        self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                        raise ValueError(err_msg)
-
-                    if len(urls) == 1:
-                        found_sources.append(urls[0])
-
-            if not found_sources:
-                err_msg = f'Did not find any zipped markdown entries for "{self.lang_code}" OBS in the catalog.'
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ValueError(err_msg)
-
-            if len(found_sources) > 1:
-                err_msg = f'Found more than one zipped markdown entry for "{self.lang_code}" OBS in the catalog.'
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ValueError(err_msg)
-
-            source_zip_url = found_sources[0]
-            tmp_source_dirpath = os.path.join(self.tmp_download_dirpath, f'{self.lang_code.lower()}_obs/')
+            try:
+                source_zip_url = find_catalog_source_url(self.catalog, self.lang_code)
+            except ValueError as e:
+                self.output_msg(f"{datetime.datetime.now()} ERROR: {e}\n")
+                raise e
 
         elif self.parameter_type == 'Door43_repo':
             source_zip_url = f'{DOOR43_SITE_URL}/{self.given_repo_spec}/archive/master.zip'
-            tmp_source_dirpath = os.path.join(self.tmp_download_dirpath, self.repo_name.lower())
 
         elif self.parameter_type == 'username_repoName_spec':
             source_zip_url = f'{DOOR43_SITE_URL}/{self.username}/{self.repo_name}/archive/{self.repo_spec}.zip'
-            tmp_source_dirpath = os.path.join(self.tmp_download_dirpath, self.repo_name.lower())
 
 
-        # 2. Download source zip, then unzip
+        # 2. Download source zip -- we read straight from the archive so no need to unzip it
+        self.source_zip_url = source_zip_url
         self.output_msg(f"{datetime.datetime.now()} => Downloading '{source_zip_url}'…\n")
+        self.progress.set_stage('downloading')
         downloaded_zip_tmp_filepath = f'{self.tmp_download_dirpath}/obs.zip'
         download_file(source_zip_url, downloaded_zip_tmp_filepath)
-        unzip(downloaded_zip_tmp_filepath, self.tmp_download_dirpath)
+        self.source = ZipOBSSource(downloaded_zip_tmp_filepath)
+        self.source_date = self.source.get_modified_time() if DETERMINISTIC_BUILDS else None
+        if self.source_date is not None:
+            self.output_msg(f"{datetime.datetime.now()} => Using the source time {self.source_date} for the PDF dates and IDs…\n")
+        self.record_checkpoint('fetched', {'source_url': source_zip_url}, [downloaded_zip_tmp_filepath])
+        return self.source
+    # end of PdfFromDcs.fetch_source()
+
+
+    def preflight(self) -> List[Dict[str,str]]:
+        """
+        Does quick checks of the downloaded source
+            so that we can reject broken repos before spending minutes in ConTeXt.
+
+        Returns a (hopefully empty) list of error dicts
+            (any warnings are left in self.preflight_warnings).
+        """
+        source = self.fetch_source()
+        self.output_msg(f"{datetime.datetime.now()} => Running preflight checks on {self.description}…\n")
+        start_time = time.time()
+        errors, self.preflight_warnings = preflight_check(source)
+        elapsed_milliseconds = round((time.time() - start_time) * 1000)
+        if self.preflight_warnings:
+            self.output_msg(f"{datetime.datetime.now()} WARNING: Preflight checks found {len(self.preflight_warnings):,} possible problem(s): {self.preflight_warnings[:10]}\n")
+        if errors:
+            self.output_msg(f"{datetime.datetime.now()} ERROR: Preflight checks found {len(errors):,} problem(s) in {elapsed_milliseconds:,}ms: {errors[:10]}\n")
+        else:
+            self.output_msg(f"{datetime.datetime.now()} => Preflight checks passed in {elapsed_milliseconds:,}ms.\n")
+        return errors
+    # end of PdfFromDcs.preflight()
+
+
+    def run(self) -> str:
+        """
+        Fetch the source (if we haven't already).
+        Check the OBS data (read directly from the zip file).
+        Call PdfFromDcs.create_and_upload_pdf function to make the PDF
+        """
+        self.output_msg(f"{datetime.datetime.now()} => Starting OBS PDF processing for {self.description}…\n")
+        self.fetch_source()
+
+        if self.get_checkpoint('parsed') is not None: # No need to check and parse it all again
+            return self.create_and_upload_pdf(self.load_checkpointed_obs())
+
+        # Initialize some variables
+        today = ''.join(str(datetime.date.today()).rsplit(str('-'))[0:3])  # str(datetime.date.today())
 
         # 3. Check for valid repository structure
-        manifest_filepath = os.path.join(tmp_source_dirpath, 'manifest.yaml')
-        if not isfile(manifest_filepath):
-            err_msg = f"Did not find manifest.yaml in the resource container at {manifest_filepath}"
+        if not self.source.exists('manifest.yaml'):
+            err_msg = f"Did not find manifest.yaml in the resource container at {self.source_zip_url}"
             self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
             raise FileNotFoundError(err_msg)
 
-        content_dirpath = os.path.join(tmp_source_dirpath, 'content/')
-        if not isdir(content_dirpath):
+        missing_chapters = self.source.missing_chapters()
+        if len(missing_chapters) == len(chapters_and_frames.frame_counts):
             err_msg = "Did not find the content directory in the resource container"
             self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
             raise NotADirectoryError(err_msg)
+        if missing_chapters:
+            err_msg = f"Missing chapter file(s) in the resource container: {', '.join(str(n).zfill(2) for n in missing_chapters)}"
+            self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
+            raise OBSError(err_msg)
+
+        self.progress.set_stage('parsing')
 
         # 4. Read the manifest (status, version, localized name, etc)
         self.output_msg(f"{datetime.datetime.now()} => Reading the {self.description} manifest…\n")
-        manifest = load_yaml_object(manifest_filepath)
+        manifest = self.source.load_yaml('manifest.yaml')
 
         # 5. Initialize OBS objects
         self.output_msg(f"{datetime.datetime.now()} => Initializing the OBS object…\n")
         obs_obj = OBS()
-        obs_obj.date_modified = today
+        obs_obj.date_modified = today if self.source_date is None else self.source_date.strftime('%Y%m%d')
         obs_obj.language_id = manifest['dublin_core']['language']['identifier']
         obs_obj.language_name = manifest['dublin_core']['language']['title']
         obs_obj.language_direction = manifest['dublin_core']['language']['direction']
@@ -260,8 +412,8 @@ class PdfFromDcs:
 
         # 6. Import the chapter data
         self.output_msg(f"{datetime.datetime.now()} => Reading the {self.description} chapter files…\n")
-        obs_obj.chapters = self.load_obs_chapters(content_dirpath)
-        obs_obj.chapters.sort(key=lambda c: int(c['number']))
+        obs_obj.chapters = self.load_obs_chapters(self.source)
+        obs_obj.chapters.sort(key=lambda c: int(c.number))
 
         self.output_msg(f"{datetime.datetime.now()} => Verifying the chapter data…\n")
         if not obs_obj.verify_all():
@@ -271,26 +423,41 @@ class PdfFromDcs:
 
         # 7. Front and back matter
         self.output_msg(f"{datetime.datetime.now()} => Reading the front and back matter…\n")
-        title_filepath = os.path.join(content_dirpath, 'front', 'title.md')
-        if not isfile(title_filepath):
+        if not self.source.exists('content/front/title.md'):
             err_msg = "Did not find the title file in the resource container"
             self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
             raise OBSError(err_msg)
-        obs_obj.title = read_file(title_filepath)
+        obs_obj.title = self.source.read_text('content/front/title.md')
 
-        front_filepath = os.path.join(content_dirpath, 'front', 'intro.md')
-        if not isfile(front_filepath):
+        if not self.source.exists('content/front/intro.md'):
             err_msg = "Did not find the front/intro.md file in the resource container"
             self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
             raise OBSError(err_msg)
-        obs_obj.front_matter = self.remove_trailing_hashes(read_file(front_filepath), 'front-matter')
+        obs_obj.front_matter = self.remove_trailing_hashes(self.source.read_text('content/front/intro.md'), 'front-matter')
 
-        back_filepath = os.path.join(content_dirpath, 'back', 'intro.md')
-        if not isfile(back_filepath):
+        if not self.source.exists('content/back/intro.md'):
             err_msg = "Did not find the back/intro.md file in the resource container"
             self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
             raise OBSError(err_msg)
-        obs_obj.back_matter = self.remove_trailing_hashes(read_file(back_filepath), 'back-matter')
+        obs_obj.back_matter = self.remove_trailing_hashes(self.source.read_text('content/back/intro.md'), 'back-matter')
+
+        # 8. Make sure that the fonts have all of the characters (rather than finding out after ConTeXt)
+        self.output_msg(f"{datetime.datetime.now()} => Checking font coverage of the {self.description} text…\n")
+        self.font_fallback_filepath, uncovered_characters, script_names = resolve_font_fallback(obs_obj)
+        self.output_msg(f"    Scripts needing fallback fonts: {script_names}\n")
+        if uncovered_characters:
+            err_msg = f"No font fallback file covers all the characters: {uncovered_characters}"
+            if has_glyph_index():
+                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
+                raise OBSError(err_msg)
+            # Without the glyph index we only know the declared ranges so let ConTeXt try
+            self.output_msg(f"{datetime.datetime.now()} WARNING: {err_msg} (no glyph index to confirm it)\n")
+        self.output_msg(f"    Using font fallback file {self.font_fallback_filepath}\n")
+
+        if self.checkpoints is not None:
+            obs_json_filepath = os.path.join(self.tmp_download_dirpath, 'obs.json')
+            write_file(obs_json_filepath, json.dumps(obs_obj, cls=OBSEncoder, ensure_ascii=False))
+            self.record_checkpoint('parsed', {}, [obs_json_filepath])
 
         return self.create_and_upload_pdf(obs_obj) # Should return upload URL
     # end of PdfFromDcs.run()
@@ -300,10 +467,19 @@ class PdfFromDcs:
         """
         Called from PdfFromDcs.run() above.
 
-        Creates the PDF via ConTeXt and returns the full path to the finished file
+        Creates the PDF (and any other variants) via ConTeXt and uploads them
         :param obs_obj: OBS
-        :return: S3 uploaded URL
+        :return: S3 uploaded URL (of the main variant)
         """
+        uploaded_checkpoint = self.get_checkpoint('uploaded')
+        if uploaded_checkpoint is not None:
+            self.output_msg(f"{datetime.datetime.now()} => {self.description} PDF was already uploaded to {uploaded_checkpoint['url']}\n")
+            self.pdf_variants = uploaded_checkpoint.get('variants', {})
+            self.story_pdfs_url = uploaded_checkpoint.get('story_PDFs_url')
+            self.pdf_pointer_url = uploaded_checkpoint.get('pointer_url')
+            self.progress.set_stage('finished')
+            return uploaded_checkpoint['url']
+
         self.output_msg(f"{datetime.datetime.now()} => Beginning {self.description} PDF generation…\n")
 
         out_dirpath = os.path.join(self.tmp_download_dirpath, 'make_pdf/')
@@ -312,121 +488,428 @@ class PdfFromDcs:
         obs_language_id = obs_obj.language_id
         self.output_msg(f"    obs_language_id = '{obs_language_id}'\n")
 
-        have_exception = None
-        try:
-            # make sure the noto language file exists
-            noto_filepath = os.path.join(get_resources_dir(), 'tex', 'noto-{0}.tex'.format(obs_language_id))
-            if not isfile(noto_filepath):
-                shutil.copy2(os.path.join(get_resources_dir(), 'tex', 'noto-en.tex'), noto_filepath)
-
-            # generate a tex file
-            tex_filepath = os.path.join(out_dirpath, f'{obs_language_id}.tex')
-            self.output_msg(f"{datetime.datetime.now()} => Generating TeX file at {tex_filepath}…\n")
-            if isfile(tex_filepath):
-                os.remove(tex_filepath) # make sure it doesn't already exist
+        # Created PDF file is in out_dirpath
+        pdf_current_filepath = os.path.join(out_dirpath, f'{obs_language_id}.pdf')
+        variant_pdf_filepaths:Dict[str,str] = {} # For the variants other than the main one
 
-            with OBSTexExport(obs_obj=obs_obj, out_path=tex_filepath,
-                                        max_chapters=0, img_res='360px', options=self.options) as tex:
-                tex.create_tex_file()
-
-            # Run ConTeXt
-            self.output_msg(f"{datetime.datetime.now()} => Preparing to run ConTeXt…\n")
-
-            # noinspection PyTypeChecker
-            trackers = ','.join(['afm.loading', 'fonts.missing', 'fonts.warnings', 'fonts.names',
-                                 'fonts.specifications', 'fonts.scaling', 'system.dump'])
-
-            # This command line has 3 parts:
-            #   1. set the OSFONTDIR environment variable to the fonts directory where the noto fonts can be found
-            #   2. run `mtxrun` to load the noto fonts so ConTeXt can find them
-            #   3. run ConTeXt to generate the PDF
-            cmd = 'export OSFONTDIR="/usr/share/fonts"' \
-                  ' && mtxrun --script fonts --reload' \
-                  f' && context --paranoid --nonstopmode --trackers={trackers} "{tex_filepath}"'
-
-            # the output from the cmd will be dumped into these files
-            out_log = os.path.join(get_output_dir(), 'context.out')
-            if isfile(out_log):
-                os.unlink(out_log)
-
-            err_log_path = os.path.join(get_output_dir(), 'context.err')
-            if isfile(err_log_path):
-                os.unlink(err_log_path)
-
-            self.output_msg(f"{datetime.datetime.now()} => Running ConTeXt -- this may take several minutes…\n")
+        have_exception = None
+        pdf_checkpoint = self.get_checkpoint('pdf')
+        if pdf_checkpoint is not None:
+            pdf_current_filepath = self.checkpoints.get_artifact_filepath(os.path.basename(pdf_current_filepath))
+            self.pdf_optimization = pdf_checkpoint.get('optimization')
+            self.pdf_variants = pdf_checkpoint.get('variants', {})
+            self.chapter_page_ranges = {chapter_number: tuple(page_range)
+                                        for chapter_number, page_range in pdf_checkpoint.get('chapter_page_ranges', {}).items()}
+            variant_pdf_filepaths = {variant_name: self.checkpoints.get_artifact_filepath(pdf_filename)
+                                     for variant_name, pdf_filename in pdf_checkpoint.get('variant_PDFs', {}).items()}
+            self.output_msg(f"{datetime.datetime.now()} => Resuming with the PDF from the 'pdf' checkpoint…\n")
+        else:
             try:
-                std_out = subprocess.check_output(cmd, shell=True,
-                                                  stderr=subprocess.STDOUT, cwd=out_dirpath)
-                self.output_msg(f"{datetime.datetime.now()} => Getting ConTeXt output…\n")
-                std_out = re.sub(r'\n\n+', '\n', std_out.decode('utf-8', 'backslashreplace'), flags=re.MULTILINE)
-                write_file(out_log, std_out)
-
-                err_lines = re.findall(r'(^tex error.+)\n?', std_out, flags=re.MULTILINE)
-                if err_lines:
-                    write_file(err_log_path, '\n'.join(err_lines))
-                    err_msg = f"Error lines were generated by ConTeXt. See {err_log_path}."
-                    self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                    raise ChildProcessError(err_msg)
-
-            except subprocess.CalledProcessError as e:
-                self.output_msg(f"{datetime.datetime.now()} => ConTeXt process failed!\n")
-
-                # find the tex error lines
-                std_out = e.stdout.decode('utf-8', 'backslashreplace')
-                std_out = re.sub(r'\n\n+', '\n', std_out, flags=re.MULTILINE)
-                err_lines = re.findall(r'(^tex error.+)\n?', std_out, flags=re.MULTILINE)
-
-                write_file(out_log, std_out)
-                write_file(err_log_path, '\n'.join(err_lines))
-
-                err_msg = f"Errors were generated by ConTeXt. See {err_log_path}."
-                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
-                raise ChildProcessError(err_msg)
+                variant_pdf_filepaths = self.typeset_pdf(obs_obj, os.path.join(out_dirpath, f'{obs_language_id}.tex'))
+
+            except BuildCancelledError as e:
+                self.output_msg(f"{datetime.datetime.now()} => {e}\n")
+                raise e # Not a failure, so mustn't be suppressed and there's nothing to upload
+
+            except ChildProcessError as e:
+                raise e # There's no PDF to upload, and the caller reports the ConTeXt errors
+
+            except Exception as e:
+                err_msg = f"Exception in create_and_upload_pdf: {e}: {traceback.format_exc()}\n"
+                print(f"ERROR: {err_msg}")
+                self.output_msg(err_msg)
+                err_msg = f"Supressing exception\n"
+                self.output_msg(err_msg)
+                have_exception = e
+
+            finally:
+                self.output_msg(f"{datetime.datetime.now()} => Exiting ConTeXt PDF generation code…\n")
+                # with open(, 'wt') as log_output_file:
+                    # log_output_file.write(self.output)
+
+            if have_exception is not None: # There's no PDF to check or upload
+                self.progress.set_stage('finished')
+                return str(have_exception)
+            self.chapter_page_ranges = get_chapter_page_ranges(os.path.join(out_dirpath, f'{obs_language_id}.tuc'))
+            self.pdf_optimization = self.optimize_pdf(pdf_current_filepath)
+            self.pdf_variants[self.variants[0]['name']]['optimization'] = self.pdf_optimization
+            for variant_name, variant_pdf_filepath in variant_pdf_filepaths.items():
+                self.pdf_variants[variant_name]['optimization'] = self.optimize_pdf(variant_pdf_filepath)
 
-        except Exception as e:
-            err_msg = f"Exception in create_and_upload_pdf: {e}: {traceback.format_exc()}\n"
-            print(f"ERROR: {err_msg}")
-            self.output_msg(err_msg)
-            err_msg = f"Supressing exception\n"
-            self.output_msg(err_msg)
-            have_exception = e
-
-        finally:
-            self.output_msg(f"{datetime.datetime.now()} => Exiting ConTeXt PDF generation code…\n")
-            # with open(, 'wt') as log_output_file:
-                # log_output_file.write(self.output)
-
-        # Created PDF file is in out_dirpath
-        pdf_current_filepath = os.path.join(out_dirpath, f'{obs_language_id}.pdf')
         self.output_msg(f"{datetime.datetime.now()} => Finding PDF at {pdf_current_filepath}…\n")
 
-        # Check the PDF size (double-check that we succeeded -- fails if pictures are missing from file)
+        # Check the (final) PDF size (double-check that we succeeded -- fails if pictures are missing from file)
         PDF_filesize = getsize(pdf_current_filepath)
         self.output_msg(f"    PDF_filesize = {PDF_filesize:,} bytes\n")
-        if PDF_filesize < 1_000_000: # Should be MB not just KB
+        if PDF_filesize < MIN_PDF_FILESIZE:
             err_msg = f"Created PDF is too small: Only {PDF_filesize:,} bytes!\n"
             print(f"ERROR: {err_msg}")
             self.output_msg(err_msg)
             have_exception = err_msg
+        if self.variants[0]['name'] in self.pdf_variants:
+            self.pdf_variants[self.variants[0]['name']]['PDF_filesize'] = PDF_filesize
+        for variant_name, variant_pdf_filepath in list(variant_pdf_filepaths.items()):
+            variant_filesize = self.pdf_variants[variant_name]['PDF_filesize'] = getsize(variant_pdf_filepath)
+            if variant_filesize < MIN_PDF_FILESIZE:
+                err_msg = f"Created {variant_name!r} PDF variant is too small: Only {variant_filesize:,} bytes!"
+                self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
+                self.pdf_variants[variant_name].update({'status': 'error', 'message': err_msg})
+                del variant_pdf_filepaths[variant_name]
+        if have_exception is not None: # Don't replace the current PDF with a bad one
+            self.progress.set_stage('finished')
+            return str(have_exception)
+        self.record_checkpoint('pdf', {'PDF_filesize': PDF_filesize, 'optimization': self.pdf_optimization,
+                                       'variants': self.pdf_variants,
+                                       'chapter_page_ranges': self.chapter_page_ranges,
+                                       'variant_PDFs': {variant_name: os.path.basename(variant_pdf_filepath)
+                                            for variant_name, variant_pdf_filepath in variant_pdf_filepaths.items()}},
+                                [pdf_current_filepath, *variant_pdf_filepaths.values()])
 
         # Upload the PDF to our AWS S3 bucket
-        pdf_desired_name = f'{self.filename_bit}.pdf'
+        pdf_desired_name = self.get_pdf_filename(self.variants[0]['name'])
+        self.progress.set_stage('uploading')
         self.output_msg(f"{datetime.datetime.now()} => Uploading '{pdf_desired_name}' to S3 {self.prefixed_bucket_name}/{self.cdn_folder}…\n")
-        cdn_s3_handler = S3Handler(bucket_name=self.prefixed_bucket_name,
+        if self.cdn_s3_handler is None:
+            from lib.aws_tools.s3_handler import S3Handler
+        cdn_s3_handler = self.cdn_s3_handler or S3Handler(bucket_name=self.prefixed_bucket_name,
                                     aws_access_key_id=self.aws_access_key_id,
                                     aws_secret_access_key=self.aws_secret_access_key,
                                     aws_region_name=AWS_REGION_NAME)
-        s3_commit_key = f'{self.cdn_folder}/{pdf_desired_name}'
-        cdn_s3_handler.upload_file(pdf_current_filepath, s3_commit_key)
+        s3_commit_key = self.upload_immutable_file(cdn_s3_handler, pdf_current_filepath, self.cdn_folder, pdf_desired_name)
+        # The fixed key (as used before the content-addressed ones) keeps existing links working
+        cdn_s3_handler.copy_file(s3_commit_key, f'{self.cdn_folder}/{pdf_desired_name}')
+        pdf_url = f'https://{self.prefixed_bucket_name}/{s3_commit_key}'
+        for variant_name, variant_pdf_filepath in variant_pdf_filepaths.items():
+            self.output_msg(f"{datetime.datetime.now()} => Uploading the {variant_name!r} PDF variant to S3 {self.prefixed_bucket_name}/{self.cdn_folder}…\n")
+            variant_s3_key = self.upload_immutable_file(cdn_s3_handler, variant_pdf_filepath, self.cdn_folder,
+                                                        self.get_pdf_filename(variant_name))
+            self.pdf_variants[variant_name]['url'] = f'https://{self.prefixed_bucket_name}/{variant_s3_key}'
+        self.make_and_upload_story_pdfs(obs_obj, pdf_current_filepath, pdf_url, cdn_s3_handler)
+        self.pdf_variants[self.variants[0]['name']]['url'] = pdf_url
+        self.upload_pdf_pointer(cdn_s3_handler, s3_commit_key, PDF_filesize)
 
         # return pdf link
-        self.output_msg(f"Should be viewable at https://{self.prefixed_bucket_name}/{s3_commit_key}.\n")
-        if have_exception is None:
-            return f'https://{self.prefixed_bucket_name}/{s3_commit_key}'
-        return str(have_exception)
+        self.progress.set_stage('finished')
+        self.output_msg(f"Should be viewable at {pdf_url}.\n")
+        self.record_checkpoint('uploaded', {'url': pdf_url, 'variants': self.pdf_variants,
+                                            'story_PDFs_url': self.story_pdfs_url, 'pointer_url': self.pdf_pointer_url})
+        return pdf_url
     # end of PdfFromDcs.create_and_upload_pdf function
 
 
+    def upload_immutable_file(self, cdn_s3_handler:'S3Handler', filepath:str, folder:str, filename:str) -> str:
+        """
+        Uploads the file to <folder>/<content hash>/<filename> (so the contents at that key never change)
+            unless it's already there.
+
+        Returns the key.
+        """
+        s3_key = f'{folder}/{get_file_md5(filepath)[:CONTENT_HASH_LENGTH]}/{filename}'
+        if not cdn_s3_handler.upload_file(filepath, s3_key, cache_time=IMMUTABLE_CACHE_SECONDS, immutable=True):
+            self.output_msg(f"{datetime.datetime.now()} => Didn't upload '{filename}' again as it's unchanged.\n")
+        return s3_key
+    # end of PdfFromDcs.upload_immutable_file function
+
+
+    def upload_pdf_pointer(self, cdn_s3_handler:'S3Handler', pdf_s3_key:str, PDF_filesize:int) -> None:
+        """
+        Uploads the (short cache time) JSON that names the current PDFs for the repo spec
+            (the PDFs themselves have content-addressed keys).
+        """
+        pointer_s3_key = f'{self.cdn_folder}/{self.filename_bit}--current.json'
+        pointer_dict = {'PDF_url': f'https://{self.prefixed_bucket_name}/{pdf_s3_key}',
+                        'PDF_key': pdf_s3_key,
+                        'PDF_filesize': PDF_filesize,
+                        'commit_hash': self.commit_hash,
+                        'variants': {variant_name: variant_dict['url']
+                                     for variant_name, variant_dict in self.pdf_variants.items() if 'url' in variant_dict},
+                        'story_PDFs_url': self.story_pdfs_url}
+        pointer_filepath = os.path.join(self.tmp_download_dirpath, 'pointer.json')
+        write_file(pointer_filepath, pointer_dict, indent=2)
+        self.output_msg(f"{datetime.datetime.now()} => Uploading the PDF pointer to S3 {self.prefixed_bucket_name}/{pointer_s3_key}…\n")
+        cdn_s3_handler.upload_file(pointer_filepath, pointer_s3_key, cache_time=POINTER_CACHE_SECONDS)
+        self.pdf_pointer_url = f'https://{self.prefixed_bucket_name}/{pointer_s3_key}'
+    # end of PdfFromDcs.upload_pdf_pointer function
+
+
+    def make_and_upload_story_pdfs(self, obs_obj:OBS, pdf_filepath:str, pdf_url:str, cdn_s3_handler:'S3Handler') -> None:
+        """
+        Cuts the separate story PDFs out of the (main) PDF (see lib/story_pdfs.py)
+            and uploads them along with a JSON index of them.
+        """
+        story_pdf_filepaths, reason = make_story_pdfs(pdf_filepath, self.chapter_page_ranges,
+                                    os.path.join(os.path.dirname(pdf_filepath), 'stories'), f'{obs_obj.language_id}-',
+                                    deterministic=self.source_date is not None)
+        if reason:
+            self.output_msg(f"{datetime.datetime.now()} => Not making the separate story PDFs: {reason}\n")
+            return
+        stories_folder = f'{self.cdn_folder}/{self.filename_bit}--stories'
+        self.output_msg(f"{datetime.datetime.now()} => Uploading {len(story_pdf_filepaths)} story PDFs to S3 {self.prefixed_bucket_name}/{stories_folder}…\n")
+        chapter_titles = {str(chapter.number).zfill(2): chapter.title for chapter in obs_obj.chapters}
+        stories_index:Dict[str,Any] = {'PDF_url': pdf_url, 'stories': {}}
+        num_unchanged = 0
+        for chapter_number, story_pdf_filepath in story_pdf_filepaths.items():
+            story_s3_key = f'{stories_folder}/{get_file_md5(story_pdf_filepath)[:CONTENT_HASH_LENGTH]}/{chapter_number}.pdf'
+            if not cdn_s3_handler.upload_file(story_pdf_filepath, story_s3_key,
+                                              cache_time=IMMUTABLE_CACHE_SECONDS, immutable=True):
+                num_unchanged += 1
+            first_page, last_page = self.chapter_page_ranges[chapter_number]
+            stories_index['stories'][chapter_number] = {'title': chapter_titles.get(chapter_number, ''),
+                                                        'key': story_s3_key,
+                                                        'url': f'https://{self.prefixed_bucket_name}/{story_s3_key}',
+                                                        'pages': [first_page, last_page],
+                                                        'PDF_filesize': getsize(story_pdf_filepath)}
+        index_filepath = os.path.join(os.path.dirname(pdf_filepath), 'stories', 'index.json')
+        write_file(index_filepath, stories_index, indent=2)
+        cdn_s3_handler.upload_file(index_filepath, f'{stories_folder}.json', cache_time=POINTER_CACHE_SECONDS)
+        if num_unchanged:
+            self.output_msg(f"{datetime.datetime.now()} => Didn't upload {num_unchanged} of the story PDFs again as they're unchanged.\n")
+        self.story_pdfs_url = f'https://{self.prefixed_bucket_name}/{stories_folder}.json'
+    # end of PdfFromDcs.make_and_upload_story_pdfs function
+
+
+    def get_pdf_filename(self, variant_name:str) -> str:
+        """
+        Returns the upload name of the variant's PDF
+            (the 'print' one keeps the original name so that existing links still work).
+        """
+        if variant_name == DEFAULT_VARIANT_NAME:
+            return f'{self.filename_bit}.pdf'
+        return f'{self.filename_bit}--{variant_name}.pdf'
+
+
+    def prepare_variant_images(self) -> Dict[str,str]:
+        """
+        Sets up self.pdf_variants with the settings of each variant.
+
+        Returns the folder of pictures for each variant.
+        """
+        image_folderpaths = {}
+        for variant in self.variants:
+            self.pdf_variants[variant['name']] = {key:value for key, value in variant.items() if key != 'name'}
+            image_folderpaths[variant['name']], images_reason = prepare_image_folder(variant['img_res'], variant['jpeg_quality'])
+            if images_reason:
+                self.output_msg(f"{datetime.datetime.now()} => Using the original pictures for the {variant['name']!r} PDF variant: {images_reason}\n")
+                self.pdf_variants[variant['name']]['images_note'] = f"Used the original pictures: {images_reason}"
+        return image_folderpaths
+    # end of PdfFromDcs.prepare_variant_images function
+
+
+    def typeset_pdf(self, obs_obj:OBS, tex_filepath:str) -> Dict[str,str]:
+        """
+        Generates the TeX file for the main variant (unless it's checkpointed)
+            and the TeX files for any other variants from it (they only differ in the pictures and paper size),
+            and then runs ConTeXt for all of them at the same time to make each PDF next to its TeX file.
+
+        Returns the PDF file paths of the other variants that were made
+            (the ones that failed have the error in self.pdf_variants instead).
+
+        Raises ChildProcessError if ConTeXt fails for the main variant.
+        """
+        from lib.obs.obs_tex_export import OBSTexExport
+        out_dirpath = os.path.dirname(tex_filepath)
+        self.progress.set_stage('generating TeX')
+        image_folderpaths = self.prepare_variant_images()
+        main_variant = self.variants[0]
+        tex_checkpoint = self.get_checkpoint('tex')
+        if tex_checkpoint is not None:
+            self.output_msg(f"{datetime.datetime.now()} => Resuming with the TeX file from the 'tex' checkpoint…\n")
+            shutil.copyfile(self.checkpoints.get_artifact_filepath(os.path.basename(tex_filepath)), tex_filepath)
+            main_tex = read_file(tex_filepath)
+            main_image_folderpath = tex_checkpoint.get('image_folderpath', image_folderpaths[main_variant['name']])
+        else:
+            # generate a tex file
+            self.output_msg(f"{datetime.datetime.now()} => Generating TeX file at {tex_filepath}…\n")
+            if isfile(tex_filepath):
+                os.remove(tex_filepath) # make sure it doesn't already exist
+
+            main_image_folderpath = image_folderpaths[main_variant['name']]
+            with OBSTexExport(obs_obj=obs_obj, out_path=tex_filepath,
+                                        max_chapters=0, img_res=ORIGINAL_IMG_RES, options=self.options,
+                                        font_fallback_filepath=self.font_fallback_filepath,
+                                        paper_size=main_variant['paper_size'],
+                                        created_date=None if self.source_date is None else self.source_date.date()) as tex:
+                main_tex = OBSTexExport.get_variant_tex(tex.get_tex(), OBSTexExport.get_image_folderpath(ORIGINAL_IMG_RES),
+                                                        main_image_folderpath, main_variant['paper_size'])
+            write_file(tex_filepath, main_tex)
+            self.record_checkpoint('tex', {'image_folderpath': main_image_folderpath}, [tex_filepath])
+
+        variant_tex_filepaths = {} # For the variants other than the main one
+        for variant in self.variants[1:]:
+            variant_tex_filepath = os.path.join(out_dirpath, variant['name'],
+                            f"{os.path.splitext(os.path.basename(tex_filepath))[0]}--{variant['name']}.tex")
+            self.output_msg(f"{datetime.datetime.now()} => Generating the {variant['name']!r} PDF variant TeX file at {variant_tex_filepath}…\n")
+            write_file(variant_tex_filepath, OBSTexExport.get_variant_tex(main_tex, main_image_folderpath,
+                                                    image_folderpaths[variant['name']], variant['paper_size']))
+            variant_tex_filepaths[variant['name']] = variant_tex_filepath
+
+        # Run ConTeXt
+        self.output_msg(f"{datetime.datetime.now()} => Preparing to run ConTeXt…\n")
+        if self.cancel_check is not None and self.cancel_check():
+            raise BuildCancelledError("Build was cancelled before running ConTeXt")
+        if variant_tex_filepaths and self.reload_fonts: # Rather than in each of the ConTeXt processes at the same time
+            self.reload_context_fonts()
+
+        self.output_msg(f"{datetime.datetime.now()} => Running ConTeXt -- this may take several minutes…\n")
+        self.was_typeset = True
+        self.progress.start_typesetting(total_figures=sum(len(chapter['frames']) for chapter in obs_obj.chapters))
+        main_failed_event = threading.Event()
+        def variant_cancel_check() -> bool:
+            return main_failed_event.is_set() or (self.cancel_check is not None and self.cancel_check())
+        with ThreadPoolExecutor(max_workers=max(len(variant_tex_filepaths), 1)) as executor:
+            variant_futures = {variant_name: executor.submit(self.typeset_tex_file, variant_tex_filepath,
+                                                             f'context-{variant_name}', None, variant_cancel_check)
+                               for variant_name, variant_tex_filepath in variant_tex_filepaths.items()}
+            try: # The main variant (with the progress updates) is typeset in this thread
+                self.typeset_tex_file(tex_filepath, 'context', self.progress.context_line, self.cancel_check)
+            except BaseException:
+                main_failed_event.set() # So the others get stopped too
+                raise
+
+        variant_pdf_filepaths = {}
+        for variant_name, variant_future in variant_futures.items():
+            try:
+                variant_future.result()
+            except BuildCancelledError as e:
+                raise e
+            except Exception as e:
+                self.output_msg(f"{datetime.datetime.now()} ERROR: The {variant_name!r} PDF variant failed: {e}\n")
+                self.pdf_variants[variant_name].update({'status': 'error', 'message': str(e)})
+            else:
+                variant_pdf_filepaths[variant_name] = f'{os.path.splitext(variant_tex_filepaths[variant_name])[0]}.pdf'
+        return variant_pdf_filepaths
+    # end of PdfFromDcs.typeset_pdf function
+
+
+    def typeset_tex_file(self, tex_filepath:str, log_name:str='context',
+                            line_callback:Optional[Callable[[str],None]]=None,
+                            cancel_check:Optional[Callable[[],bool]]=None) -> None:
+        """
+        Runs ConTeXt to make the PDF next to the TeX file
+            (with the output in <log_name>.out and any errors in <log_name>.err).
+
+        Raises ChildProcessError if ConTeXt fails.
+        """
+        cmd = self.get_context_command(tex_filepath)
+
+        # the output from the cmd will be dumped into these files
+        out_log = os.path.join(self.log_dirpath, f'{log_name}.out')
+        if isfile(out_log):
+            os.unlink(out_log)
+
+        err_log_path = os.path.join(self.log_dirpath, f'{log_name}.err')
+        if isfile(err_log_path):
+            os.unlink(err_log_path)
+
+        context_run = run_context(cmd, cwd=os.path.dirname(tex_filepath), out_log_filepath=out_log,
+                                  cancel_check=cancel_check, line_callback=line_callback)
+        self.output_msg(f"{datetime.datetime.now()} => ConTeXt output {context_run.num_lines:,} lines to {out_log}\n")
+        if context_run.failed:
+            write_file(err_log_path, '\n'.join(context_run.err_lines))
+            if context_run.fatal_line is not None:
+                self.output_msg(f"{datetime.datetime.now()} => ConTeXt stopped early at: {context_run.fatal_line}\n")
+                err_msg = f"Errors were generated by ConTeXt (so it was stopped early). See {err_log_path}."
+            elif context_run.return_code:
+                self.output_msg(f"{datetime.datetime.now()} => ConTeXt process failed!\n")
+                err_msg = f"Errors were generated by ConTeXt. See {err_log_path}."
+            else:
+                err_msg = f"Error lines were generated by ConTeXt. See {err_log_path}."
+            self.output_msg(f"{datetime.datetime.now()} ERROR: {err_msg}\n")
+            raise ChildProcessError(err_msg)
+    # end of PdfFromDcs.typeset_tex_file function
+
+
+    def reload_context_fonts(self) -> None:
+        """
+        Loads the fonts for ConTeXt once for all of the variants
+            (if that fails, each ConTeXt process still does it).
+        """
+        import subprocess
+        from lib.preloading import reload_context_fonts
+        try:
+            reload_context_fonts()
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.output_msg(f"{datetime.datetime.now()} WARNING: Unable to load the ConTeXt fonts: {e}\n")
+            return
+        self.reload_fonts = False
+    # end of PdfFromDcs.reload_context_fonts function
+
+
+    def get_checkpoint(self, stage:str) -> Optional[Dict[str,Any]]:
+        """
+        Returns the data recorded at the stage's checkpoint
+            (or None if we're not checkpointing or haven't reached it).
+        """
+        return None if self.checkpoints is None else self.checkpoints.get(stage)
+
+
+    def record_checkpoint(self, stage:str, data:Dict[str,Any], artifact_filepaths:Optional[List[str]]=None) -> None:
+        """
+        Records the checkpoint (if we're checkpointing) --
+            failing to do so doesn't stop the build.
+        """
+        if self.checkpoints is None:
+            return
+        try:
+            self.checkpoints.record(stage, data, artifact_filepaths)
+        except OSError as e:
+            self.output_msg(f"{datetime.datetime.now()} WARNING: Unable to record the {stage!r} checkpoint: {e}\n")
+
+
+    def load_checkpointed_obs(self) -> OBS:
+        """
+        Returns the OBS object saved at the 'parsed' checkpoint
+            (and makes sure that we still have a font fallback file for it).
+        """
+        self.output_msg(f"{datetime.datetime.now()} => Resuming with the parsed {self.description} from the 'parsed' checkpoint…\n")
+        obs_obj = OBS(self.checkpoints.get_artifact_filepath('obs.json'))
+        self.font_fallback_filepath, uncovered_characters, _script_names = resolve_font_fallback(obs_obj)
+        if uncovered_characters and has_glyph_index(): # Shouldn't happen as it was checked before the checkpoint
+            raise OBSError(f"No font fallback file covers all the characters: {uncovered_characters}")
+        return obs_obj
+    # end of PdfFromDcs.load_checkpointed_obs function
+
+
+    def optimize_pdf(self, pdf_filepath:str) -> Dict[str,Any]:
+        """
+        Linearizes and compresses the PDF from ConTeXt in place (see lib/pdf_optimizer.py),
+            leaving it as it is if that can't be done.
+
+        Returns the optimization details.
+        """
+        self.progress.set_stage('optimizing')
+        optimized_filepath = f'{os.path.splitext(pdf_filepath)[0]}.optimized.pdf'
+        pdf_optimization = optimize_pdf(pdf_filepath, optimized_filepath, deterministic=self.source_date is not None)
+        if not pdf_optimization['optimized']:
+            self.output_msg(f"{datetime.datetime.now()} => Not optimizing {os.path.basename(pdf_filepath)}: {pdf_optimization['reason']}\n")
+            return pdf_optimization
+        self.output_msg(f"{datetime.datetime.now()} => Optimized {os.path.basename(pdf_filepath)} from {pdf_optimization['input_bytes']:,}"
+                        f" to {pdf_optimization['output_bytes']:,} bytes"
+                        f" ({pdf_optimization['saved_percent']}% smaller) in {pdf_optimization['seconds']}s\n")
+        os.replace(optimized_filepath, pdf_filepath)
+        return pdf_optimization
+    # end of PdfFromDcs.optimize_pdf function
+
+
+    def get_context_command(self, tex_filepath:str) -> str:
+        """
+        Returns the shell command line that typesets the TeX file into a PDF (in the same folder).
+        """
+        # This command line has 3 parts:
+        #   1. set the OSFONTDIR environment variable to the fonts directory where the noto fonts can be found
+        #   2. run `mtxrun` to load the noto fonts so ConTeXt can find them (unless that's already been done)
+        #   3. run ConTeXt to generate the PDF
+        #       (for a deterministic build, with the source time as the date and an ID made from the TeX file)
+        typeset_command = get_typeset_command(tex_filepath)
+        if self.source_date is not None:
+            typeset_command = f'export SOURCE_DATE_EPOCH={calendar.timegm(self.source_date.timetuple())} FORCE_SOURCE_DATE=1' \
+                              f' && {get_typeset_command(tex_filepath, trailer_id=get_file_md5(tex_filepath))}'
+        if not self.reload_fonts:
+            return f'{CONTEXT_FONTS_COMMAND} && {typeset_command}'
+        return f'{CONTEXT_FONTS_COMMAND} && {FONT_RELOAD_COMMAND} && {typeset_command}'
+    # end of PdfFromDcs.get_context_command function
+
+
     @staticmethod
     def remove_trailing_hashes(given_text: str, optional_description=None) -> str:
         """
@@ -456,23 +939,13 @@ class PdfFromDcs:
     # end of PdfFromDcs.cleanup_files() static function
 
 
-    @staticmethod
-    def load_obs_chapters(content_dir: str) -> List[OBSChapter]:
-        chapters = []  # type: List[OBSChapter]
-
-        for story_num in range(1, 51):
-            chapter_num = str(story_num).zfill(2)
-            story_file = os.path.join(content_dir, f'{chapter_num}.md')
-
-            # get the translated chapter text
-            with codecs.open(story_file, 'r', encoding='utf-8-sig') as in_file:
-                obs_chapter = OBSChapter.from_markdown(in_file.read(), story_num)  # type: OBSChapter
-
-            # sort the frames by id
-            obs_chapter.frames.sort(key=lambda f: f['id'])
-
-            # add this chapter to the OBS object
-            chapters.append(obs_chapter)
-
+    def load_obs_chapters(self, source:OBSSource) -> List[OBSChapter]:
+        """
+        Loads the 50 chapters from the parse cache if this content has been seen before,
+            else decodes and parses them (concurrently) straight from the source.
+        """
+        chapters, was_cached = load_cached_obs_chapters(source)
+        if was_cached:
+            self.output_msg("    Used the previously parsed chapters from the cache\n")
         return chapters
-    # end of PdfFromDcs.load_obs_chapters static function
+    # end of PdfFromDcs.load_obs_chapters function
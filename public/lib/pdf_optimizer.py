@@ -0,0 +1,93 @@
+"""
+Post-processing of the PDF that ConTeXt makes (with qpdf) before it's uploaded:
+    linearizing it (so that browsers can show the first page before the whole file has arrived),
+    packing the objects into compressed object streams,
+    and leaving out any resources that no page uses.
+
+ConTeXt already includes each (repeated) picture only once,
+    so there aren't duplicate images to remove.
+
+If qpdf isn't installed (or fails), the original PDF is used as it is.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+import shutil
+import subprocess
+from functools import lru_cache
+from time import time
+
+
+QPDF_COMMAND = os.getenv('QPDF_COMMAND', 'qpdf')
+QPDF_TIMEOUT_SECONDS = 300
+QPDF_WARNINGS_EXIT_CODE = 3 # The output file is still written
+
+
+
+@lru_cache(maxsize=None)
+def get_qpdf_version() -> Optional[Tuple[int,...]]:
+    """
+    Returns the installed qpdf version, e.g., (6, 0, 0) (or None if it's not installed).
+    """
+    if shutil.which(QPDF_COMMAND) is None:
+        return None
+    try:
+        version_output = subprocess.run([QPDF_COMMAND, '--version'], capture_output=True, text=True,
+                                        timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r'qpdf version (\d+)\.(\d+)(?:\.(\d+))?', version_output)
+    return tuple(int(part or 0) for part in match.groups()) if match else None
+# end of get_qpdf_version function
+
+
+def get_qpdf_arguments(qpdf_version:Tuple[int,...], deterministic:bool=False) -> List[str]:
+    """
+    Returns the qpdf options (the ones that the installed version has).
+
+    If deterministic is set, the PDF's document ID is made from its contents (rather than the time)
+        so that the same input always gives the same output.
+    """
+    arguments = ['--linearize', '--object-streams=generate']
+    if deterministic and qpdf_version >= (6, 0):
+        arguments.append('--deterministic-id')
+    if qpdf_version >= (8, 1):
+        arguments.append('--compress-streams=y')
+    else:
+        arguments.append('--stream-data=compress')
+    if qpdf_version >= (9, 1):
+        arguments.append('--remove-unreferenced-resources=yes')
+    return arguments
+# end of get_qpdf_arguments function
+
+
+def optimize_pdf(input_filepath:str, output_filepath:str, deterministic:bool=False) -> Dict[str,Any]:
+    """
+    Writes the optimized PDF to output_filepath (see get_qpdf_arguments for deterministic).
+
+    Returns a dict of the before and after sizes (and how long it took),
+        with 'optimized' False (and the 'reason') if the original should be used instead.
+    """
+    result:Dict[str,Any] = {'input_bytes': os.path.getsize(input_filepath), 'optimized': False}
+    qpdf_version = get_qpdf_version()
+    if qpdf_version is None:
+        result['reason'] = f"{QPDF_COMMAND} isn't installed"
+        return result
+    start_time = time()
+    try:
+        qpdf_run = subprocess.run([QPDF_COMMAND, *get_qpdf_arguments(qpdf_version, deterministic), input_filepath, output_filepath],
+                                  capture_output=True, text=True, timeout=QPDF_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError) as e:
+        result['reason'] = str(e)
+        return result
+    result['seconds'] = round(time() - start_time, 2)
+    if qpdf_run.returncode not in (0, QPDF_WARNINGS_EXIT_CODE) or not os.path.isfile(output_filepath):
+        result['reason'] = f"{QPDF_COMMAND} returned {qpdf_run.returncode}: {qpdf_run.stderr.strip()[:500]}"
+        return result
+    result.update({'optimized': True, 'output_bytes': os.path.getsize(output_filepath),
+                   'qpdf_version': '.'.join(str(part) for part in qpdf_version)})
+    result['saved_percent'] = round((1 - result['output_bytes'] / result['input_bytes']) * 100, 1)
+    if qpdf_run.returncode == QPDF_WARNINGS_EXIT_CODE:
+        result['warnings'] = qpdf_run.stderr.strip()[:500]
+    return result
+# end of optimize_pdf function
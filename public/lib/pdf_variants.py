@@ -0,0 +1,166 @@
+"""
+The different PDFs that one build can make
+    (they share the download, the parsed OBS and the generated TeX, and are typeset at the same time):
+    'print' is the original (the full-size pictures on the Trade paper size),
+    'screen' has more compressed pictures,
+    and 'lowband' has smaller, even more compressed pictures (for slow or expensive connections).
+
+A job's 'variants' list can give these names,
+    or dicts with a 'name' and any of the settings that are different from 'print':
+        img_res (e.g., '180px' -- no bigger than the original pictures),
+        jpeg_quality (1 to 95, or None to keep the original JPEG compression),
+        paper_size (one of PAPER_SIZES).
+
+The first one is the main PDF (the one in PDF_url).
+The 'print' PDF keeps the usual upload key, the others get their name added to it.
+
+Pictures other than the originals are made with ImageMagick (once per machine).
+Smaller pictures get a proportionally lower density (DPI) so that they're typeset at the same size.
+If that isn't installed (or fails), the original pictures are used instead.
+
+There's no font setting: ConTeXt (LuaTeX) always embeds subsets of the fonts.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from glob import glob
+
+from lib.general_tools.file_utils import remove_tree
+
+
+
+ORIGINAL_IMG_RES = '360px'
+ORIGINAL_IMAGE_FOLDER_PATH = os.getenv('OBS_IMAGE_FOLDER', '/opt/obs/jpg/360px/') # Can be changed for local testing
+VARIANT_IMAGE_DIRPATH = os.getenv('OBS_VARIANT_IMAGE_DIR', '/tmp/obs-variant-images/')
+MOGRIFY_COMMAND = os.getenv('MOGRIFY_COMMAND', 'mogrify')
+IDENTIFY_COMMAND = os.getenv('IDENTIFY_COMMAND', 'identify')
+MOGRIFY_TIMEOUT_SECONDS = 300
+
+PAPER_SIZES = ('Trade', 'A5', 'A4', 'letter') # Trade is defined in main_template.tex, the others by ConTeXt
+DEFAULT_VARIANT_SETTINGS = {'img_res': ORIGINAL_IMG_RES, 'jpeg_quality': None, 'paper_size': 'Trade'}
+PDF_VARIANTS = {
+    'print': DEFAULT_VARIANT_SETTINGS,
+    'screen': {'img_res': ORIGINAL_IMG_RES, 'jpeg_quality': 70, 'paper_size': 'Trade'},
+    'lowband': {'img_res': '180px', 'jpeg_quality': 50, 'paper_size': 'Trade'},
+    }
+DEFAULT_VARIANT_NAME = 'print'
+MAX_VARIANTS = 4 # Each one is a ConTeXt process running at the same time
+
+VARIANT_NAME_RE = re.compile(r'^[a-z0-9_]{1,20}$') # It goes into file names and upload keys
+IMG_RES_RE = re.compile(r'^(\d+)px$')
+IDENTIFY_OUTPUT_RE = re.compile(r'^(\d+) (\d+(?:\.\d+)?)') # Width then density (then its units)
+
+
+
+def get_pdf_variants(variant_specs:Optional[List[Union[str,Dict[str,Any]]]]=None) -> List[Dict[str,Any]]:
+    """
+    Returns a dict of the full settings (including the 'name') for each of the requested variants
+        (just 'print' if none are given).
+
+    Raises ValueError if they're not valid.
+    """
+    if not variant_specs:
+        variant_specs = [DEFAULT_VARIANT_NAME]
+    if not isinstance(variant_specs, list) or len(variant_specs) > MAX_VARIANTS:
+        raise ValueError(f"PDF variants must be a list of up to {MAX_VARIANTS}: {variant_specs!r}")
+
+    variants = []
+    for variant_spec in variant_specs:
+        if isinstance(variant_spec, str):
+            variant_spec = {'name': variant_spec}
+        if not isinstance(variant_spec, dict) or not isinstance(variant_spec.get('name'), str):
+            raise ValueError(f"PDF variant needs a name: {variant_spec!r}")
+        variant_name = variant_spec['name']
+        if not VARIANT_NAME_RE.match(variant_name):
+            raise ValueError(f"Bad PDF variant name: {variant_name!r}")
+        unknown_keys = set(variant_spec) - set(DEFAULT_VARIANT_SETTINGS) - {'name'}
+        if unknown_keys:
+            raise ValueError(f"Unknown {variant_name!r} PDF variant setting(s): {sorted(unknown_keys)}")
+        variant = {'name': variant_name, **PDF_VARIANTS.get(variant_name, DEFAULT_VARIANT_SETTINGS), **variant_spec}
+
+        img_res_match = IMG_RES_RE.match(str(variant['img_res']))
+        if not img_res_match or not 0 < int(img_res_match.group(1)) <= int(IMG_RES_RE.match(ORIGINAL_IMG_RES).group(1)):
+            raise ValueError(f"Bad {variant_name!r} PDF variant img_res: {variant['img_res']!r}")
+        if variant['jpeg_quality'] is not None \
+        and (type(variant['jpeg_quality']) is not int or not 1 <= variant['jpeg_quality'] <= 95):
+            raise ValueError(f"Bad {variant_name!r} PDF variant jpeg_quality: {variant['jpeg_quality']!r}")
+        if variant['paper_size'] not in PAPER_SIZES:
+            raise ValueError(f"Bad {variant_name!r} PDF variant paper_size: {variant['paper_size']!r}")
+        if any(existing_variant['name'] == variant_name for existing_variant in variants):
+            raise ValueError(f"PDF variant {variant_name!r} is given more than once")
+        variants.append(variant)
+    return variants
+# end of get_pdf_variants function
+
+
+def get_image_size(image_filepath:str) -> Tuple[int,float,str]:
+    """
+    Returns the width (in pixels), the horizontal density of the picture,
+        and the ImageMagick units for the density (PixelsPerInch if they're undefined,
+            as that's what both ImageMagick and ConTeXt then assume).
+
+    Raises ValueError if ImageMagick can't tell us.
+    """
+    try:
+        identify_run = subprocess.run([IDENTIFY_COMMAND, '-format', '%w %x %U', image_filepath],
+                                      capture_output=True, text=True, timeout=MOGRIFY_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise ValueError(f"Can't run {IDENTIFY_COMMAND}: {e}")
+    identify_match = IDENTIFY_OUTPUT_RE.match(identify_run.stdout.strip())
+    if identify_run.returncode or not identify_match or not float(identify_match.group(2)):
+        raise ValueError(f"{IDENTIFY_COMMAND} gave {identify_run.stdout.strip()!r} for {image_filepath}:"
+                         f" {identify_run.stderr.strip()[:500]}")
+    units = 'PixelsPerCentimeter' if 'PixelsPerCentimeter' in identify_run.stdout else 'PixelsPerInch'
+    return int(identify_match.group(1)), float(identify_match.group(2)), units
+# end of get_image_size function
+
+
+def prepare_image_folder(img_res:str, jpeg_quality:Optional[int]) -> Tuple[str,Optional[str]]:
+    """
+    Returns the folder of pictures for the settings (making them from the originals the first time)
+        and the reason if the original pictures have to be used instead (else None).
+    """
+    if img_res == ORIGINAL_IMG_RES and jpeg_quality is None:
+        return ORIGINAL_IMAGE_FOLDER_PATH, None
+    image_folderpath = os.path.join(VARIANT_IMAGE_DIRPATH, f"{img_res}-q{jpeg_quality or 'original'}/")
+    if os.path.isdir(image_folderpath): # Already made (maybe by another worker)
+        return image_folderpath, None
+    if shutil.which(MOGRIFY_COMMAND) is None:
+        return ORIGINAL_IMAGE_FOLDER_PATH, f"{MOGRIFY_COMMAND} isn't installed"
+    original_image_filepaths = sorted(glob(os.path.join(ORIGINAL_IMAGE_FOLDER_PATH, '*.jpg')))
+    if not original_image_filepaths:
+        return ORIGINAL_IMAGE_FOLDER_PATH, f"No pictures found in {ORIGINAL_IMAGE_FOLDER_PATH}"
+
+    # ConTeXt lays the pictures out by their density, so it has to go down with the width
+    #   (assuming that the originals, which are all one set, all have the same size and density)
+    img_width = int(IMG_RES_RE.match(img_res).group(1))
+    try:
+        original_width, original_density, density_units = get_image_size(original_image_filepaths[0])
+    except ValueError as e:
+        return ORIGINAL_IMAGE_FOLDER_PATH, str(e)
+
+    # Make them in a temporary folder first so that nothing ever uses a half-made set
+    os.makedirs(VARIANT_IMAGE_DIRPATH, exist_ok=True)
+    temp_dirpath = tempfile.mkdtemp(prefix='making-', dir=VARIANT_IMAGE_DIRPATH)
+    arguments = ['-path', temp_dirpath, '-strip', '-resize', f"{img_width}x",
+                 '-units', density_units, '-density', f"{original_density * img_width / original_width:g}"]
+    if jpeg_quality is not None:
+        arguments += ['-quality', str(jpeg_quality)]
+    try:
+        mogrify_run = subprocess.run([MOGRIFY_COMMAND, *arguments, *original_image_filepaths],
+                                     capture_output=True, text=True, timeout=MOGRIFY_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError) as e:
+        remove_tree(temp_dirpath)
+        return ORIGINAL_IMAGE_FOLDER_PATH, str(e)
+    if mogrify_run.returncode:
+        remove_tree(temp_dirpath)
+        return ORIGINAL_IMAGE_FOLDER_PATH, f"{MOGRIFY_COMMAND} returned {mogrify_run.returncode}: {mogrify_run.stderr.strip()[:500]}"
+    try:
+        os.rename(temp_dirpath, image_folderpath.rstrip('/'))
+    except OSError: # Another worker got there first
+        remove_tree(temp_dirpath)
+    return image_folderpath, None
+# end of prepare_image_folder function
@@ -0,0 +1,59 @@
+"""
+Loading the things that don't change between PDF builds
+    (so that a long-lived process, e.g., a batch or a preloading rq worker,
+        can do it once before forking rather than in every build).
+"""
+from typing import Callable, Dict
+import os
+import subprocess
+from time import time
+
+from lib.context_runner import CONTEXT_FONTS_COMMAND, FONT_RELOAD_COMMAND
+from lib.obs.font_fallback import get_fallback_fonts
+from lib.obs.glyph_coverage import get_glyph_index
+from lib.obs.obs_tex_export import OBSTexExport, read_template_file
+
+
+
+def preload_templates() -> None:
+    """
+    Reads all the TeX snippets and the main template into the (lru) cache.
+    """
+    for filename in os.listdir(OBSTexExport.snippets_dirpath):
+        if filename.endswith('.tex'):
+            read_template_file(os.path.join(OBSTexExport.snippets_dirpath, filename))
+# end of preload_templates function
+
+
+def preload_font_data() -> None:
+    """
+    Loads the glyph index and the fallback font ranges (used to choose the font fallback file).
+    """
+    get_glyph_index()
+    get_fallback_fonts()
+# end of preload_font_data function
+
+
+def reload_context_fonts() -> None:
+    """
+    Runs mtxrun once so that ConTeXt can find the noto fonts
+        (so that the builds don't each need to).
+    """
+    subprocess.run(f'{CONTEXT_FONTS_COMMAND} && {FONT_RELOAD_COMMAND}', shell=True, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+# end of reload_context_fonts function
+
+
+def run_timed(steps:Dict[str,Callable[[],None]]) -> Dict[str,float]:
+    """
+    Runs each of the steps (in order).
+
+    Returns a dict of step names to the seconds each took.
+    """
+    seconds:Dict[str,float] = {}
+    for step_name, step_function in steps.items():
+        start_time = time()
+        step_function()
+        seconds[step_name] = round(time() - start_time, 3)
+    return seconds
+# end of run_timed function
@@ -0,0 +1,54 @@
+"""
+A fast (Redis) copy of the latest PDF_details.json entry for each repo tag/branch,
+    so that webhook retries and duplicate deliveries for a commit that's already been built
+    (and the Flask front end's cached PDF lookups) don't need to fetch PDF_details.json from the CDN.
+
+PDF_details.json is still the record: an entry is only kept here after a successful build
+    (it's removed after any other outcome) and it expires after BUILD_STATUS_TTL_SECONDS.
+Redis errors just mean falling back to PDF_details.json.
+"""
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+
+
+BUILD_STATUS_TTL_SECONDS = int(os.getenv('BUILD_STATUS_TTL_SECONDS', str(7 * 24 * 60 * 60)))
+
+
+
+def get_build_status_key(prefix:str, repo_owner_username:str, repo_name:str, tag_or_branch_name:str) -> str:
+    return f'obs-pdf:build-status:{prefix}{repo_owner_username}/{repo_name}/{tag_or_branch_name}'
+
+
+def load_build_status(connection:Redis, prefix:str, repo_owner_username:str, repo_name:str,
+                        tag_or_branch_name:str) -> Optional[Dict[str,Any]]:
+    """
+    Returns the saved build log entry (or None if there isn't one).
+    """
+    try:
+        entry_json = connection.get(get_build_status_key(prefix, repo_owner_username, repo_name, tag_or_branch_name))
+    except RedisError as e:
+        logging.warning(f"Unable to load the build status from Redis: {e}")
+        return None
+    return None if entry_json is None else json.loads(entry_json)
+
+
+def save_build_status(connection:Redis, prefix:str, repo_owner_username:str, repo_name:str,
+                        tag_or_branch_name:str, entry:Dict[str,Any]) -> None:
+    """
+    Saves the build log entry if it's a success, else removes any saved one.
+    """
+    build_status_key = get_build_status_key(prefix, repo_owner_username, repo_name, tag_or_branch_name)
+    try:
+        if entry.get('status') == 'success':
+            connection.set(build_status_key, json.dumps(entry), ex=BUILD_STATUS_TTL_SECONDS)
+        else:
+            connection.delete(build_status_key)
+    except RedisError as e:
+        logging.warning(f"Unable to save the build status to Redis: {e}")
+# end of save_build_status function
@@ -0,0 +1,213 @@
+"""
+Coalescing of queued PDF jobs for the same owner/repo/branch.
+
+A burst of pushes to one branch only needs the PDF for the newest commit, so
+    at enqueue time, a job still waiting in the queue has its payload replaced by the newer one, and
+    at dequeue time, a job is skipped if a newer job for the same branch is waiting behind it
+        (optionally after being scheduled to start again once the branch has had no pushes for a quiet period
+            so that a burst can finish arriving), and
+    while ConTeXt is running, the build is cancelled if a newer job for the same branch gets queued.
+
+The owner/repo/branch of each queued job is kept in Redis (by job id) the first time it's seen
+    (including the jobs enqueued by tX Enqueue Job) so that looking for the jobs for a branch
+    only reads the queue's job ids and any new jobs, rather than every queued job each time.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import calendar
+from datetime import datetime, timedelta
+
+from redis import Redis
+from redis.exceptions import WatchError
+from rq import Queue
+from rq.job import Job
+from rq.registry import ScheduledJobRegistry, StartedJobRegistry
+from rq.utils import utcformat, utcparse
+
+
+
+JOB_FUNCTION_NAME = 'webhook.job'
+COALESCE_INDEX_TTL_SECONDS = 24 * 60 * 60 # Longer than any job waits in the queue
+MAX_COALESCE_ATTEMPTS = 3 # To update a queued job before enqueuing a new one instead
+DEFERRED_META_KEY = 'coalesce_deferred' # Set on the jobs scheduled by defer_until_quiet()
+FIRST_ENQUEUED_META_KEY = 'coalesce_first_enqueued_at' # When the first of the pushes for a deferred job was queued
+MAX_QUIET_PERIODS = 5 # So that a steady stream of pushes still gets built (at most this many quiet periods after the first)
+
+
+
+def get_coalesce_key(payload:Dict[str,Any]) -> str:
+    """
+    Returns 'owner/repo/branch' from the identifier in the payload.
+    """
+    return '/'.join(payload['identifier'].split('--')[:3])
+
+
+def get_coalesce_index_key(job_id:str) -> str:
+    return f'obs-pdf:coalesce-key:{job_id}'
+
+
+def index_job(connection:Redis, job:Job) -> str:
+    """
+    Records the job's owner/repo/branch (or '' if it isn't one of our payloads).
+
+    Returns the recorded value.
+    """
+    try:
+        coalesce_key = get_coalesce_key(job.args[0]) if job.args else ''
+    except (KeyError, TypeError, AttributeError):
+        coalesce_key = '' # Not one of our payloads
+    connection.set(get_coalesce_index_key(job.id), coalesce_key, ex=COALESCE_INDEX_TTL_SECONDS)
+    return coalesce_key
+
+
+def find_queued_jobs(queue:Queue, coalesce_key:str, exclude_job_id:Optional[str]=None) -> List[Job]:
+    """
+    Returns the jobs (in queue order) still waiting for the same owner/repo/branch.
+    """
+    job_ids = [job_id for job_id in queue.get_job_ids() if job_id != exclude_job_id]
+    if not job_ids:
+        return []
+    indexed_keys = queue.connection.mget([get_coalesce_index_key(job_id) for job_id in job_ids])
+    matching_jobs = []
+    for job_id, indexed_key in zip(job_ids, indexed_keys):
+        job = None
+        if indexed_key is None: # Not seen before
+            job = queue.fetch_job(job_id)
+            if job is None:
+                continue
+            indexed_key = index_job(queue.connection, job)
+        elif isinstance(indexed_key, bytes):
+            indexed_key = indexed_key.decode('utf-8')
+        if indexed_key == coalesce_key:
+            job = job or queue.fetch_job(job_id)
+            if job is not None:
+                matching_jobs.append(job)
+    return matching_jobs
+
+
+def find_started_jobs(queue:Queue, coalesce_key:str) -> List[Job]:
+    """
+    Returns the jobs currently being built for the same owner/repo/branch.
+    """
+    matching_jobs = []
+    for job_id in StartedJobRegistry(queue=queue).get_job_ids():
+        job = queue.fetch_job(job_id)
+        if job is None or not job.args:
+            continue
+        try:
+            if get_coalesce_key(job.args[0]) == coalesce_key:
+                matching_jobs.append(job)
+        except (KeyError, TypeError, AttributeError):
+            continue # Not one of our payloads
+    return matching_jobs
+
+
+def enqueue_coalesced(queue:Queue, payload:Dict[str,Any], job_function_name:str=JOB_FUNCTION_NAME,
+                        **enqueue_kwargs) -> Tuple[Job,bool]:
+    """
+    Enqueues a PDF job, unless a job for the same owner/repo/branch is still waiting,
+        in which case that job gets this newer payload instead.
+
+    The job is only updated if it's still in the queue (checked in a Redis transaction)
+        else a worker might already have started it with the older payload.
+
+    Returns the job, and True if it was an existing job.
+    """
+    coalesce_key = get_coalesce_key(payload)
+    for _attempt in range(MAX_COALESCE_ATTEMPTS):
+        queued_jobs = find_queued_jobs(queue, coalesce_key)
+        if not queued_jobs:
+            break
+        job = queued_jobs[-1]
+        if job.args[0] == payload:
+            return job, True
+        with queue.connection.pipeline() as pipeline:
+            try:
+                pipeline.watch(queue.key, job.key) # Dequeuing (or changing) the job aborts the update
+                if job.id.encode('utf-8') not in pipeline.lrange(queue.key, 0, -1):
+                    continue # It's just been started
+                job.meta.setdefault('superseded_identifiers', []).append(job.args[0]['identifier'])
+                job.args = (payload,)
+                pipeline.multi()
+                job.save(pipeline=pipeline)
+                pipeline.execute()
+                return job, True
+            except WatchError:
+                continue # Something changed, so look again
+    job = queue.enqueue(job_function_name, payload, **enqueue_kwargs)
+    index_job(queue.connection, job)
+    return job, False
+
+
+def defer_until_quiet(queue:Queue, payload:Dict[str,Any], current_job:Job, quiet_seconds:float) -> Optional[Job]:
+    """
+    Called as a job starts (rather than waiting in the worker).
+
+    If the job was enqueued less than quiet_seconds ago (and isn't already a deferred one),
+        schedules it to start again once it's been that long (so that a burst of pushes can finish arriving),
+        or if there's already a deferred job for the same owner/repo/branch, gives that one this newer payload
+            and schedules it again from this push (but no later than MAX_QUIET_PERIODS after the first one).
+    The rq workers need to be run with --with-scheduler to start the deferred jobs.
+
+    Returns the deferred job (or None if the current job should carry on).
+    """
+    if not quiet_seconds or current_job.enqueued_at is None or current_job.meta.get(DEFERRED_META_KEY):
+        return None
+    now = datetime.utcnow()
+    waited_seconds = (now - current_job.enqueued_at).total_seconds()
+    if waited_seconds >= quiet_seconds:
+        return None
+    quiet_at = now + timedelta(seconds=quiet_seconds - waited_seconds)
+
+    coalesce_key = get_coalesce_key(payload)
+    registry = ScheduledJobRegistry(queue=queue)
+    for job_id in registry.get_job_ids():
+        job = queue.fetch_job(job_id)
+        if job is None or not job.meta.get(DEFERRED_META_KEY) \
+        or not job.args or get_coalesce_key(job.args[0]) != coalesce_key:
+            continue
+        with queue.connection.pipeline() as pipeline:
+            try:
+                pipeline.watch(registry.key, job.key) # Aborts if the job gets moved into the queue
+                if pipeline.zscore(registry.key, job.id) is None:
+                    break # It's just been moved into the queue
+                job.meta.setdefault('superseded_identifiers', []).append(job.args[0]['identifier'])
+                job.args = (payload,)
+                first_enqueued_at = utcparse(job.meta[FIRST_ENQUEUED_META_KEY]) \
+                                        if FIRST_ENQUEUED_META_KEY in job.meta else current_job.enqueued_at
+                scheduled_at = min(quiet_at, first_enqueued_at + timedelta(seconds=MAX_QUIET_PERIODS * quiet_seconds))
+                pipeline.multi()
+                job.save(pipeline=pipeline)
+                # As ScheduledJobRegistry.schedule() does, but in the transaction
+                pipeline.zadd(registry.key, {job.id: calendar.timegm(scheduled_at.utctimetuple())})
+                pipeline.execute()
+                return job
+            except WatchError:
+                break # So schedule a new one instead
+    return queue.enqueue_in(quiet_at - now, current_job.func_name, payload, job_timeout=current_job.timeout,
+                            meta={DEFERRED_META_KEY: True, FIRST_ENQUEUED_META_KEY: utcformat(current_job.enqueued_at)})
+# end of defer_until_quiet function
+
+
+def find_superseding_job(queue:Queue, payload:Dict[str,Any], current_job:Job) -> Optional[Job]:
+    """
+    Called as a job starts.
+
+    Returns a newer job waiting for the same owner/repo/branch (if there is one),
+        in which case the current job doesn't need to be built.
+    """
+    queued_jobs = find_queued_jobs(queue, get_coalesce_key(payload), exclude_job_id=current_job.id)
+    return queued_jobs[-1] if queued_jobs else None
+
+
+def make_cancel_check(queue:Queue, payload:Dict[str,Any], current_job:Job) -> Callable[[],bool]:
+    """
+    Returns a function for the ConTeXt watchdog
+        that returns True once a newer job for the same owner/repo/branch has been queued,
+        i.e., the queue itself is the cancellation channel
+        (so it also works for jobs enqueued by tX Enqueue Job).
+    """
+    coalesce_key = get_coalesce_key(payload)
+
+    def cancel_check() -> bool:
+        return bool(find_queued_jobs(queue, coalesce_key, exclude_job_id=current_job.id))
+    return cancel_check
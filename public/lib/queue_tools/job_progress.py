@@ -0,0 +1,82 @@
+"""
+Saving build progress into the rq job meta (in Redis)
+    and reading it back for the /status endpoint.
+"""
+from typing import Any, Dict, Optional
+from datetime import datetime
+from time import time
+
+from redis import Redis
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+
+
+
+PROGRESS_SAVE_INTERVAL_SECONDS = 5 # Don't write to Redis for every ConTeXt line
+
+
+
+class JobProgressSaver:
+    """
+    A BuildProgress callback that saves the progress into job.meta['progress'],
+        immediately if the stage changed, otherwise at most every min_interval_seconds.
+    """
+    def __init__(self, job:Job, min_interval_seconds:float=PROGRESS_SAVE_INTERVAL_SECONDS) -> None:
+        self.job = job
+        self.min_interval_seconds = min_interval_seconds
+        self.last_saved_time = 0.0
+        self.last_saved_stage:Optional[str] = None
+
+
+    def __call__(self, progress_dict:Dict[str,Any]) -> None:
+        now = time()
+        if progress_dict['stage'] == self.last_saved_stage \
+        and now - self.last_saved_time < self.min_interval_seconds:
+            return
+        self.job.meta['progress'] = progress_dict
+        self.job.save_meta()
+        self.last_saved_time = now
+        self.last_saved_stage = progress_dict['stage']
+# end of JobProgressSaver class
+
+
+
+def get_job_status(connection:Redis, job_id:str) -> Optional[Dict[str,Any]]:
+    """
+    Returns a JSON-able dict about the job (or None if it's unknown/expired).
+
+    If the job has started and has got some way, the remaining time is estimated
+        from how long it has taken so far.
+    """
+    try:
+        job = Job.fetch(job_id, connection=connection)
+    except NoSuchJobError:
+        return None
+
+    status_dict:Dict[str,Any] = {'job_id': job.id, 'status': job.get_status()}
+    if job.args and isinstance(job.args[0], dict) and 'identifier' in job.args[0]:
+        status_dict['identifier'] = job.args[0]['identifier']
+    for time_name in ('enqueued_at', 'started_at', 'ended_at'):
+        time_value = getattr(job, time_name)
+        if time_value is not None:
+            status_dict[time_name] = time_value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if status_dict['status'] == 'queued':
+        queue_position = job.get_position()
+        if queue_position is not None:
+            status_dict['queue_position'] = queue_position
+
+    if status_dict['status'] == 'finished' and job.result is not None:
+        status_dict['result'] = job.result
+        # The repo jobs return the build log status, as they record build errors rather than raising them
+        if isinstance(job.result, dict) and job.result.get('status') == 'error':
+            status_dict['status'] = 'failed'
+
+    progress_dict = job.meta.get('progress')
+    if progress_dict:
+        status_dict['progress'] = progress_dict
+        if job.started_at is not None and job.ended_at is None \
+        and 0 < progress_dict['percent'] < 100:
+            elapsed_seconds = (datetime.utcnow() - job.started_at).total_seconds()
+            status_dict['eta_seconds'] = round(elapsed_seconds * (100 - progress_dict['percent']) / progress_dict['percent'])
+    return status_dict
+# end of get_job_status function
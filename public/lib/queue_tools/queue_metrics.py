@@ -0,0 +1,152 @@
+"""
+Queue wait, throughput and saturation metrics for the PDF job queue.
+
+Each job records when it started (with the queue length at the time) and each build how long it took
+    in Redis sorted sets, so the figures cover all of the workers over the last window_seconds.
+
+From those we recommend a number of workers (for autoscaling the worker containers):
+    enough to keep up with the recent arrival rate at TARGET_UTILISATION (Little's law)
+    plus enough to work through the current backlog within TARGET_DRAIN_SECONDS.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import math
+import os
+from time import time
+
+from rq import Queue, Worker
+from rq.job import Job
+
+
+
+METRICS_WINDOW_SECONDS = int(os.getenv('QUEUE_METRICS_WINDOW_SECONDS', '1800'))
+TARGET_UTILISATION = float(os.getenv('QUEUE_METRICS_TARGET_UTILISATION', '0.7'))
+TARGET_DRAIN_SECONDS = int(os.getenv('QUEUE_METRICS_TARGET_DRAIN_SECONDS', '600'))
+MIN_RECOMMENDED_WORKERS = int(os.getenv('QUEUE_METRICS_MIN_WORKERS', '1'))
+MAX_RECOMMENDED_WORKERS = int(os.getenv('QUEUE_METRICS_MAX_WORKERS', '20'))
+DEFAULT_BUILD_SECONDS = 300 # Until there are some recent builds to go by
+
+
+
+def get_wait_seconds(job:Job) -> Optional[float]:
+    """
+    Returns how long the job waited in the queue (from the rq timestamps, both UTC).
+    """
+    if job.enqueued_at is None or job.started_at is None:
+        return None
+    return max((job.started_at - job.enqueued_at).total_seconds(), 0)
+
+
+def recommend_workers(arrivals_per_minute:float, mean_build_seconds:float, backlog:int,
+                        target_utilisation:float=TARGET_UTILISATION, target_drain_seconds:int=TARGET_DRAIN_SECONDS,
+                        min_workers:int=MIN_RECOMMENDED_WORKERS, max_workers:int=MAX_RECOMMENDED_WORKERS) -> int:
+    """
+    Returns the number of workers needed to keep up with the arrivals (without running flat out)
+        and to clear the backlog in time.
+    """
+    workers_for_arrivals = arrivals_per_minute / 60 * mean_build_seconds / target_utilisation
+    workers_for_backlog = backlog * mean_build_seconds / target_drain_seconds
+    return min(max(math.ceil(workers_for_arrivals + workers_for_backlog - 1e-9), min_workers), max_workers)
+# end of recommend_workers function
+
+
+
+class QueueMetrics:
+    """
+    Records job starts and ends for a queue, and summarises them.
+    """
+    def __init__(self, queue:Queue, window_seconds:int=METRICS_WINDOW_SECONDS) -> None:
+        self.queue = queue
+        self.connection = queue.connection
+        self.window_seconds = window_seconds
+        key_prefix = f'obs-pdf:queue-metrics:{queue.name}'
+        self.starts_key = f'{key_prefix}:starts' # Members are 'job_id:queue_length'
+        self.ends_key = f'{key_prefix}:ends' # Members are 'job_id:build_seconds'
+
+
+    def add(self, key:str, member:str, now:float) -> None:
+        pipeline = self.connection.pipeline()
+        pipeline.zadd(key, {member: now})
+        pipeline.zremrangebyscore(key, 0, now - self.window_seconds)
+        pipeline.expire(key, self.window_seconds * 2)
+        pipeline.execute()
+
+
+    def record_job_start(self, job:Job, now:Optional[float]=None) -> int:
+        """
+        Records the start along with the current queue length (which it returns).
+        """
+        queue_length = len(self.queue)
+        self.add(self.starts_key, f'{job.id}:{queue_length}', time() if now is None else now)
+        return queue_length
+
+
+    def record_job_end(self, job:Job, build_seconds:float, now:Optional[float]=None) -> None:
+        self.add(self.ends_key, f'{job.id}:{build_seconds:.3f}', time() if now is None else now)
+
+
+    def get_recent(self, key:str, now:float) -> List[Tuple[str,float]]:
+        """
+        Returns the (value, time) pairs from the window (oldest first).
+        """
+        return [(member.decode('utf-8').rsplit(':', 1)[1], score)
+                for member, score in self.connection.zrangebyscore(key, now - self.window_seconds, now, withscores=True)]
+
+
+    def get_worker_stats(self) -> Dict[str,int]:
+        """
+        Returns the number of workers and how many are busy.
+        """
+        workers = Worker.all(queue=self.queue)
+        return {'workers': len(workers),
+                'busy_workers': sum(1 for worker in workers if worker.get_state() == 'busy')}
+
+
+    def get_summary(self, now:Optional[float]=None) -> Dict[str,Any]:
+        """
+        Returns a dict of the current figures (rates are per minute, times are in seconds).
+        """
+        if now is None:
+            now = time()
+        starts = self.get_recent(self.starts_key, now)
+        ends = self.get_recent(self.ends_key, now)
+        backlog = len(self.queue)
+        # Only count the part of the window since the oldest record (e.g., just after a deployment)
+        oldest_times = [recorded_times[0][1] for recorded_times in (starts, ends) if recorded_times]
+        window_minutes = max(now - min(oldest_times), 60) / 60 if oldest_times else 1
+
+        build_seconds = [float(value) for value, _recorded_time in ends]
+        mean_build_seconds = sum(build_seconds) / len(build_seconds) if build_seconds else DEFAULT_BUILD_SECONDS
+        # Everything that arrived either got started or is still in the queue
+        backlog_growth = backlog - int(starts[0][0]) if starts else 0
+        arrivals_per_minute = max((len(starts) + backlog_growth) / window_minutes, 0)
+
+        summary = {'backlog': backlog,
+                   'jobs_per_minute': round(len(ends) / window_minutes, 3),
+                   'arrivals_per_minute': round(arrivals_per_minute, 3),
+                   'mean_build_seconds': round(mean_build_seconds, 1),
+                   **self.get_worker_stats()}
+        # The fraction of the workers' time in the window that went on builds
+        summary['busy_fraction'] = round(min(sum(build_seconds) / (summary['workers'] * window_minutes * 60), 1), 3) \
+                                    if summary['workers'] else None
+        # How long until the queue is empty at the current arrival rate
+        drain_rate_per_second = max(summary['workers'], 1) / mean_build_seconds - arrivals_per_minute / 60
+        summary['drain_eta_seconds'] = round(backlog / drain_rate_per_second) if drain_rate_per_second > 0 else None
+        summary['recommended_workers'] = recommend_workers(arrivals_per_minute, mean_build_seconds, backlog)
+        return summary
+    # end of QueueMetrics.get_summary function
+# end of QueueMetrics class
+
+
+
+def send_queue_metrics(stats_client:Any, stats_prefix:str, summary:Dict[str,Any]) -> None:
+    """
+    Sends the summary (from QueueMetrics.get_summary) as Graphite gauges
+        (except the backlog, which the job handler already sends as the queue length).
+    """
+    for name in ('jobs_per_minute', 'arrivals_per_minute', 'mean_build_seconds',
+                 'drain_eta_seconds', 'workers', 'busy_workers', 'recommended_workers'):
+        if summary.get(name) is not None:
+            stats_client.gauge(f'{stats_prefix}.{name}', summary[name])
+    if summary.get('busy_fraction') is not None:
+        stats_client.gauge(f'{stats_prefix}.busy_percent', round(summary['busy_fraction'] * 100, 1))
+# end of send_queue_metrics function
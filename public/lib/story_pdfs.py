@@ -0,0 +1,130 @@
+"""
+Separate PDFs of each story (chapter), cut out of the full book once it's been typeset,
+    so that the mobile and web apps can fetch a story (a few hundred KB) rather than the whole book.
+
+OBSTexExport gives each chapter's \\section a reference and puts another one on the chapter's last page.
+ConTeXt records the (real) page number of each reference in its .tuc file
+    (the data that it keeps between runs for the table of contents),
+    and qpdf then copies those pages into the story PDFs.
+
+If the page numbers aren't there or qpdf isn't installed, there just aren't any story PDFs.
+"""
+from typing import Dict, Optional, Tuple
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.pdf_optimizer import QPDF_COMMAND, QPDF_TIMEOUT_SECONDS, QPDF_WARNINGS_EXIT_CODE, \
+                                get_qpdf_version, get_qpdf_arguments
+
+
+
+# ConTeXt references for the first and last pages of each chapter, e.g., obs-chapter-01 and obs-chapter-01-end
+CHAPTER_REFERENCE_PREFIX = 'obs-chapter-'
+CHAPTER_END_REFERENCE_SUFFIX = '-end'
+STORY_PDF_WORKERS = 4 # Each qpdf run reads the whole book
+
+# The reference is either a key, e.g., ["obs-chapter-01"]={ … }
+#   or a value inside the table that has its page number, e.g., ["reference"]="obs-chapter-01",
+CHAPTER_REFERENCE_RE = re.compile(
+    rf'"{re.escape(CHAPTER_REFERENCE_PREFIX)}(\d+)({re.escape(CHAPTER_END_REFERENCE_SUFFIX)})?"(\]=\{{)?')
+REALPAGE_RE = re.compile(r'\["realpage"\]=(\d+)')
+
+
+
+def get_lua_table_span(lua_text:str, index:int, is_table_start:bool) -> Tuple[int,int]:
+    """
+    Returns the start and end of the Lua table that starts at the index
+        (or else the one that the index is inside).
+    """
+    if is_table_start:
+        start_index = index
+    else: # Go back to the { that isn't closed before the index
+        depth = 0
+        for start_index in range(index, -1, -1):
+            if lua_text[start_index] == '}':
+                depth += 1
+            elif lua_text[start_index] == '{':
+                if depth == 0:
+                    break
+                depth -= 1
+    depth = 0
+    for end_index in range(start_index, len(lua_text)):
+        if lua_text[end_index] == '{':
+            depth += 1
+        elif lua_text[end_index] == '}':
+            depth -= 1
+            if depth == 0:
+                return start_index, end_index + 1
+    return start_index, len(lua_text)
+# end of get_lua_table_span function
+
+
+def get_chapter_page_ranges(tuc_filepath:str) -> Dict[str,Tuple[int,int]]:
+    """
+    Returns the first and last page numbers of each chapter (keyed by the two-digit chapter number)
+        from the ConTeXt .tuc file (or an empty dict if it can't be read).
+    """
+    try:
+        with open(tuc_filepath, 'rt', encoding='utf-8', errors='replace') as tuc_file:
+            tuc_text = tuc_file.read()
+    except OSError:
+        return {}
+
+    first_pages:Dict[str,int] = {}
+    last_pages:Dict[str,int] = {}
+    for match in CHAPTER_REFERENCE_RE.finditer(tuc_text):
+        chapter_number = match.group(1).zfill(2)
+        is_table_start = match.group(3) is not None
+        table_start, table_end = get_lua_table_span(tuc_text, match.end() - 1 if is_table_start else match.start(),
+                                                    is_table_start)
+        realpage_match = REALPAGE_RE.search(tuc_text, table_start, table_end)
+        if realpage_match:
+            (last_pages if match.group(2) else first_pages).setdefault(chapter_number, int(realpage_match.group(1)))
+    return {chapter_number: (first_page, last_pages[chapter_number])
+            for chapter_number, first_page in sorted(first_pages.items())
+            if chapter_number in last_pages and first_page <= last_pages[chapter_number]}
+# end of get_chapter_page_ranges function
+
+
+def make_story_pdfs(pdf_filepath:str, page_ranges:Dict[str,Tuple[int,int]], out_dirpath:str,
+                        filename_prefix:str='', deterministic:bool=False) -> Tuple[Dict[str,str],Optional[str]]:
+    """
+    Copies each chapter's pages (from get_chapter_page_ranges) into its own PDF in out_dirpath
+        (see get_qpdf_arguments for deterministic).
+
+    Returns the file path of each story PDF (keyed by the chapter number)
+        and the reason if they couldn't be made (else None).
+    """
+    if not page_ranges:
+        return {}, "No chapter page numbers were found"
+    qpdf_version = get_qpdf_version()
+    if qpdf_version is None:
+        return {}, f"{QPDF_COMMAND} isn't installed"
+    os.makedirs(out_dirpath, exist_ok=True)
+
+    def make_story_pdf(chapter_number:str, first_page:int, last_page:int) -> Optional[str]:
+        """
+        Returns the reason if it couldn't be made.
+        """
+        story_pdf_filepath = os.path.join(out_dirpath, f'{filename_prefix}{chapter_number}.pdf')
+        try:
+            qpdf_run = subprocess.run([QPDF_COMMAND, *get_qpdf_arguments(qpdf_version, deterministic), '--empty',
+                                       '--pages', pdf_filepath, f'{first_page}-{last_page}', '--', story_pdf_filepath],
+                                      capture_output=True, text=True, timeout=QPDF_TIMEOUT_SECONDS)
+        except (OSError, subprocess.SubprocessError) as e:
+            return str(e)
+        if qpdf_run.returncode not in (0, QPDF_WARNINGS_EXIT_CODE) or not os.path.isfile(story_pdf_filepath):
+            return f"{QPDF_COMMAND} returned {qpdf_run.returncode} for chapter {chapter_number}: {qpdf_run.stderr.strip()[:500]}"
+        return None
+
+    with ThreadPoolExecutor(max_workers=STORY_PDF_WORKERS) as executor:
+        reasons = list(executor.map(lambda chapter_number: make_story_pdf(chapter_number, *page_ranges[chapter_number]),
+                                    page_ranges))
+    for reason in reasons:
+        if reason:
+            return {}, reason
+    return {chapter_number: os.path.join(out_dirpath, f'{filename_prefix}{chapter_number}.pdf')
+            for chapter_number in page_ranges}, None
+# end of make_story_pdfs function
@@ -0,0 +1,12 @@
+"""
+Offline load-test harness for the OBS PDF job handler.
+
+Runs webhook.job against local stand-ins for everything it normally talks to:
+    git.door43.org and api.door43.org -> a local HTTP server with synthetic OBS repos
+    the S3 CDN bucket and CloudWatch -> moto
+    Redis -> fakeredis
+    Graphite -> a null (counting) statsd client
+    ConTeXt -> a fake typesetter with configurable latency
+
+Run it with `python3 -m load_test --help` from the public folder.
+"""
@@ -0,0 +1,48 @@
+"""
+Command line for the offline load test, e.g.,
+    python3 -m load_test --jobs 50 --rate 0.2 --workers 4 --latency 20 --report /tmp/load-test.json
+"""
+import argparse
+import json
+import sys
+
+from load_test.harness import LoadTestConfig, run_load_test
+from load_test.stand_ins import FakeTypesetter
+
+
+DEFAULT_REPORT_FILEPATH = '/tmp/obs-load-test-report.json'
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline load test of the OBS PDF job handler.")
+    parser.add_argument('--jobs', type=int, default=20, help="Number of jobs to enqueue")
+    parser.add_argument('--rate', type=float, default=0.5, help="Target arrival rate (jobs/second)")
+    parser.add_argument('--poisson', action='store_true', help="Random (Poisson) arrivals rather than evenly spaced")
+    parser.add_argument('--workers', type=int, default=2, help="Number of simulated rq workers")
+    parser.add_argument('--languages', default='en', help="Comma-separated language codes for the synthetic repos")
+    parser.add_argument('--owners', type=int, default=3, help="Number of distinct repo owners")
+    parser.add_argument('--branches', type=int, default=2, help="Number of distinct branches per repo")
+    parser.add_argument('--latency', type=float, default=5, help="Mean fake typesetting seconds per PDF")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Random +/- fraction of the typesetting latency")
+    parser.add_argument('--fail-rate', type=float, default=0, help="Fraction of fake typesetting runs that fail")
+    parser.add_argument('--variants', help="Comma-separated PDF variants for each job (e.g., print,screen,lowband)")
+    parser.add_argument('--seed', type=int, help="Random seed (for repeatable runs)")
+    parser.add_argument('--report', default=DEFAULT_REPORT_FILEPATH, help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    config = LoadTestConfig(num_jobs=args.jobs, arrival_rate=args.rate, poisson=args.poisson,
+                            num_workers=args.workers, language_ids=args.languages.split(','),
+                            num_owners=args.owners, num_branches=args.branches,
+                            typesetter=FakeTypesetter(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate),
+                            seed=args.seed, variants=args.variants.split(',') if args.variants else None)
+    report = run_load_test(config)
+    with open(args.report, 'wt') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(json.dumps({key:report[key] for key in ('elapsed_seconds', 'outcomes', 'throughput_jobs_per_minute',
+                                                   'throughput_PDFs_per_minute', 'latency_seconds')}, indent=2))
+    print(f"Full report saved to {args.report}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
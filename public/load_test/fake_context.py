@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Stands in for the ConTeXt command line during load tests:
+#   prints the same sort of run and FIGURE: lines as ConTeXt (spread over the requested latency)
+#   and then writes a big-enough fake PDF (and the .tuc file with the chapter page numbers) next to the TeX file.
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+
+MIN_PDF_SIZE = 1_100_000 # PdfFromDcs rejects anything under 1MB
+
+
+def write_tuc_file(tuc_filepath:str, tex_text:str) -> None:
+    """
+    Writes the page numbers of the chapter references like ConTeXt does
+        (a title page and then two frames per page, after four pages of front matter).
+    """
+    page_number = 4
+    references = []
+    for chapter_tex in re.split(r'(?=\\section\[)', tex_text)[1:]:
+        chapter_reference = re.match(r'\\section\[([^\]]+)\]', chapter_tex).group(1)
+        page_number += 1
+        references.append(f'     ["{chapter_reference}"]={{ ["references"]={{ ["realpage"]={page_number} }} }},')
+        page_number += (len(re.findall(r'\\message\{FIGURE: ', chapter_tex)) + 1) // 2
+        references.append(f'     ["{chapter_reference}-end"]={{ ["references"]={{ ["realpage"]={page_number} }} }},')
+    with open(tuc_filepath, 'wt', encoding='utf-8') as tuc_file:
+        tuc_file.write('return {\n ["structures"]={\n  ["references"]={\n   ["collected"]={\n    [""]={\n')
+        tuc_file.write('\n'.join(references))
+        tuc_file.write('\n    },\n   },\n  },\n },\n}\n')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fake ConTeXt for load testing.")
+    parser.add_argument('tex_filepath')
+    parser.add_argument('--latency', type=float, default=30, help="Mean seconds per document")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Random +/- fraction of the latency")
+    parser.add_argument('--runs', type=int, default=2, help="Number of passes to pretend to do")
+    parser.add_argument('--fail-rate', type=float, default=0, help="Fraction of documents that hit a 'tex error'")
+    args = parser.parse_args()
+
+    with open(args.tex_filepath, 'rt', encoding='utf-8') as tex_file:
+        tex_text = tex_file.read()
+    figure_ids = re.findall(r'\\message\{FIGURE: ([^}]+)\}', tex_text)
+    latency = max(0.0, args.latency * (1 + random.uniform(-args.jitter, args.jitter)))
+    will_fail = random.random() < args.fail_rate
+    num_steps = max(1, args.runs * len(figure_ids))
+    step_seconds = latency / num_steps
+
+    for run_num in range(1, args.runs+1):
+        print(f"mtx-context     | run {run_num}: luatex --fmt=cont-en \"{args.tex_filepath}\"", flush=True)
+        for n, figure_id in enumerate(figure_ids):
+            time.sleep(step_seconds)
+            print(f"FIGURE: {figure_id}", flush=True)
+            if will_fail and run_num == 1 and n == len(figure_ids) // 2:
+                print("tex error       > fake error for load testing", flush=True)
+                time.sleep(latency) # ConTeXt would carry on under --nonstopmode
+                return 1
+
+    write_tuc_file(os.path.splitext(args.tex_filepath)[0] + '.tuc', tex_text)
+    pdf_filepath = os.path.splitext(args.tex_filepath)[0] + '.pdf'
+    with open(pdf_filepath, 'wb') as pdf_file:
+        pdf_file.write(b'%PDF-1.4\n% Fake PDF for load testing\n')
+        pdf_file.write(b'\0' * MIN_PDF_SIZE)
+    print(f"mtx-context     | fake run complete: {pdf_filepath}", flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Drives webhook.job at a target arrival rate against the local stand-ins
+    and reports throughput and latency percentiles.
+
+The environment variables that point the job handler at the stand-ins
+    are read when the lib modules are imported,
+    so run_load_test() sets them up before importing webhook.
+"""
+from typing import Any, Dict, List, Optional
+import functools
+import os
+import random
+import tempfile
+import threading
+from datetime import datetime
+from time import sleep, time
+
+from load_test.stand_ins import LocalDoor43Server, NullStatsClient, FakeTypesetter, start_mock_aws
+
+
+
+class LoadTestConfig:
+    def __init__(self, num_jobs:int=20, arrival_rate:float=0.5, poisson:bool=False,
+                 num_workers:int=2, language_ids:Optional[List[str]]=None,
+                 num_owners:int=3, num_branches:int=2, prefix:str='dev-',
+                 typesetter:Any=None, seed:Optional[int]=None, variants:Optional[List[str]]=None) -> None:
+        self.num_jobs = num_jobs
+        self.arrival_rate = arrival_rate # jobs/second
+        self.poisson = poisson # else evenly spaced
+        self.num_workers = num_workers
+        self.language_ids = language_ids or ['en']
+        self.num_owners = num_owners
+        self.num_branches = num_branches
+        self.prefix = prefix
+        self.typesetter = typesetter or FakeTypesetter()
+        self.seed = seed
+        self.variants = variants # PDF variants for each job (else just the default one)
+# end of LoadTestConfig class
+
+
+
+class JobRecord:
+    def __init__(self, identifier:str, enqueued_time:float) -> None:
+        self.identifier = identifier
+        self.enqueued_time = enqueued_time
+        self.started_time:Optional[float] = None
+        self.ended_time:Optional[float] = None
+        self.outcome = 'queued'
+# end of JobRecord class
+
+
+
+def percentile(values:List[float], percent:float) -> Optional[float]:
+    """
+    Nearest-rank percentile (None if there are no values).
+    """
+    if not values:
+        return None
+    sorted_values = sorted(values)
+    rank = max(1, int(round(percent / 100 * len(sorted_values) + 0.5)))
+    return round(sorted_values[min(rank, len(sorted_values)) - 1], 3)
+# end of percentile function
+
+
+def summarise_durations(durations:List[float]) -> Dict[str,Any]:
+    return {'count': len(durations),
+            'mean': round(sum(durations) / len(durations), 3) if durations else None,
+            'p50': percentile(durations, 50), 'p90': percentile(durations, 90),
+            'p95': percentile(durations, 95), 'p99': percentile(durations, 99),
+            'max': round(max(durations), 3) if durations else None}
+# end of summarise_durations function
+
+
+def make_image_folder(language_ids:List[str]) -> str:
+    """
+    Makes a folder of empty image files so that the preflight check finds all the frame images.
+    """
+    from lib.obs import chapters_and_frames
+    image_folder_path = tempfile.mkdtemp(prefix='obs-load-test-images--') + '/'
+    for story_num, frame_count in enumerate(chapters_and_frames.frame_counts, start=1):
+        for frame_num in range(1, frame_count+1):
+            open(os.path.join(image_folder_path, f'obs-en-{str(story_num).zfill(2)}-{str(frame_num).zfill(2)}.jpg'), 'wb').close()
+    return image_folder_path
+# end of make_image_folder function
+
+
+def run_load_test(config:LoadTestConfig) -> Dict[str,Any]:
+    """
+    Returns the report dict.
+    """
+    rng = random.Random(config.seed)
+
+    # 1. Local stand-ins for git.door43.org, api.door43.org and the CDN (read over HTTP)
+    door43_server = LocalDoor43Server(config.language_ids).start()
+    os.environ.update({'DOOR43_SITE_URL': door43_server.base_url,
+                       'DOOR43_CATALOG_URL': f'{door43_server.base_url}/v3/catalog.json',
+                       'CDN_DOWNLOAD_BASE_URL': door43_server.base_url,
+                       'OBS_IMAGE_FOLDER': make_image_folder(config.language_ids),
+                       'OBS_FONT_CACHE_DIR': tempfile.mkdtemp(prefix='obs-load-test-fonts--') + '/',
+                       'QUEUE_PREFIX': config.prefix,
+                       'TEST_MODE': 'load-test',
+                       'AWS_ACCESS_KEY_ID': 'load-test', 'AWS_SECRET_ACCESS_KEY': 'load-test',
+                       'AWS_DEFAULT_REGION': 'us-west-2'})
+
+    # 2. moto for S3 (and CloudWatch)
+    aws_mock, door43_server.s3_reader = start_mock_aws([f'{config.prefix}cdn.door43.org'])
+
+    # 3. Now it's safe to import the job handler (it reads the environment at import time)
+    from fakeredis import FakeStrictRedis
+    from rq import Queue
+    from rq.job import JobStatus
+    from rq.registry import StartedJobRegistry
+    import webhook
+    from lib.log_shipping import LogShipper, MemoryLogSink
+    from lib.pdf_from_dcs import PdfFromDcs
+
+    webhook.log_shipper = LogShipper(MemoryLogSink()) # Instead of CloudWatch
+    stats_client = NullStatsClient()
+    webhook.stats_client = stats_client
+    # Each build gets its own folders (as if each worker was in its own container)
+    webhook.PdfFromDcs = functools.partial(PdfFromDcs, isolated=True)
+    PdfFromDcs.get_context_command = lambda pdf_from_dcs, tex_filepath: config.typesetter.get_command(tex_filepath)
+    PdfFromDcs.reload_fonts = False # There's no ConTeXt to load them for
+
+    # Find out how each job ended (the job function itself returns nothing)
+    thread_state = threading.local()
+    original_save_build_log, original_record_skipped_job = webhook.save_build_log, webhook.record_skipped_job
+    def save_build_log(prefix:str, repo_owner_username:str, repo_name:str, PDF_log_dict:Dict[str,Any], *args:Any) -> None:
+        thread_state.outcome = PDF_log_dict.get(thread_state.branch_name, {}).get('status', 'unknown')
+        original_save_build_log(prefix, repo_owner_username, repo_name, PDF_log_dict, *args)
+    def record_skipped_job(*args:Any) -> None:
+        original_record_skipped_job(*args)
+        thread_state.outcome = 'skipped'
+    webhook.save_build_log, webhook.record_skipped_job = save_build_log, record_skipped_job
+
+    # 4. fakeredis instead of Redis, and worker threads instead of rq worker processes
+    redis_connection = FakeStrictRedis()
+    queue = Queue(webhook.webhook_queue_name, connection=redis_connection)
+    started_registry = StartedJobRegistry(queue=queue)
+    job_records:Dict[str,JobRecord] = {}
+    all_enqueued_event = threading.Event()
+
+    def worker_loop() -> None:
+        while True:
+            was_all_enqueued = all_enqueued_event.is_set() # Checked first so the last job can't be missed
+            dequeued = Queue.dequeue_any([queue], timeout=None, connection=redis_connection)
+            if dequeued is None:
+                if was_all_enqueued:
+                    return
+                sleep(0.05)
+                continue
+            job, _queue = dequeued
+            job_record = job_records[job.id]
+            job_record.started_time = time()
+            thread_state.outcome = 'unknown'
+            thread_state.branch_name = job.args[0]['identifier'].split('--')[2]
+            job.started_at = datetime.utcnow()
+            job.set_status(JobStatus.STARTED)
+            started_registry.add(job, -1)
+            job.save()
+            try:
+                job.perform()
+                job.set_status(JobStatus.FINISHED)
+            except Exception as e:
+                job.set_status(JobStatus.FAILED)
+                thread_state.outcome = f'exception: {type(e).__name__}'
+            started_registry.remove(job)
+            job.ended_at = datetime.utcnow()
+            job.save()
+            job_record.ended_time = time()
+            job_record.outcome = thread_state.outcome
+
+    worker_threads = [threading.Thread(target=worker_loop, name=f'LoadTestWorker-{n}', daemon=True)
+                      for n in range(1, config.num_workers+1)]
+    for worker_thread in worker_threads:
+        worker_thread.start()
+
+    # 5. Drive the queue at the arrival rate
+    print(f"Enqueuing {config.num_jobs} jobs at {config.arrival_rate}/s for {config.num_workers} worker(s)…")
+    start_time = time()
+    owners = [f'load-test-{n}' for n in range(1, config.num_owners+1)]
+    branches = ['master'] + [f'branch-{n}' for n in range(1, config.num_branches)]
+    for n in range(config.num_jobs):
+        language_id = rng.choice(config.language_ids)
+        owner, branch = rng.choice(owners), rng.choice(branches)
+        commit_hash = f'{rng.getrandbits(40):010x}'
+        payload = {'identifier': f'{owner}--{language_id}_obs--{branch}--{commit_hash}',
+                   'source': f'https://git.door43.org/{owner}/{language_id}_obs/archive/{branch}.zip',
+                   'input_format': 'md', 'output_format': 'pdf',
+                   'resource_type': 'Open_Bible_Stories'}
+        if config.variants:
+            payload['variants'] = config.variants
+        job_id = f'load-test-{n}'
+        job_records[job_id] = JobRecord(payload['identifier'], time()) # Before a worker can pick it up
+        queue.enqueue('webhook.job', payload, job_timeout=-1, job_id=job_id)
+        if n < config.num_jobs - 1:
+            sleep(rng.expovariate(config.arrival_rate) if config.poisson else 1 / config.arrival_rate)
+    all_enqueued_event.set()
+    for worker_thread in worker_threads:
+        worker_thread.join()
+    elapsed_seconds = time() - start_time
+    webhook.log_shipper.close()
+    aws_mock.stop()
+    door43_server.stop()
+
+    # 6. Report
+    records = list(job_records.values())
+    outcome_counts:Dict[str,int] = {}
+    for job_record in records:
+        outcome_counts[job_record.outcome] = outcome_counts.get(job_record.outcome, 0) + 1
+    built_records = [job_record for job_record in records if job_record.outcome == 'success']
+    return {'config': {'num_jobs': config.num_jobs, 'arrival_rate': config.arrival_rate,
+                       'poisson': config.poisson, 'num_workers': config.num_workers,
+                       'language_ids': config.language_ids, 'num_owners': config.num_owners,
+                       'num_branches': config.num_branches, 'typesetter': vars(config.typesetter),
+                       'seed': config.seed},
+            'elapsed_seconds': round(elapsed_seconds, 1),
+            'outcomes': outcome_counts,
+            'throughput_jobs_per_minute': round(len(records) / elapsed_seconds * 60, 2),
+            'throughput_PDFs_per_minute': round(len(built_records) / elapsed_seconds * 60, 2),
+            'latency_seconds': { # From being enqueued until the job ended
+                'all': summarise_durations([r.ended_time - r.enqueued_time for r in records]),
+                'built': summarise_durations([r.ended_time - r.enqueued_time for r in built_records])},
+            'queue_wait_seconds': summarise_durations([r.started_time - r.enqueued_time for r in records]),
+            'service_seconds': summarise_durations([r.ended_time - r.started_time for r in records]),
+            'stats': dict(stats_client.counts),
+            'last_gauges': dict(stats_client.gauges),
+            'log_events': {'shipped': webhook.log_shipper.total_shipped, 'dropped': webhook.log_shipper.total_dropped,
+                           'batches': webhook.log_shipper.sink.num_batches},
+            'stand_in_requests': dict(door43_server.request_counts)}
+# end of run_load_test function
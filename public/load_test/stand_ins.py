@@ -0,0 +1,172 @@
+"""
+Local stand-ins for the external services that the job handler uses.
+"""
+from typing import Any, Callable, Dict, List, Optional
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from load_test.synthetic_obs import make_obs_files, make_obs_zip
+
+
+
+FAKE_CONTEXT_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_context.py')
+
+
+
+class LocalDoor43Server:
+    """
+    Serves, on localhost:
+        /<owner>/<repo>/archive/<spec>.zip -- synthetic OBS repos (like git.door43.org)
+        /v3/catalog.json -- a catalog of the synthetic languages (like api.door43.org)
+        /<bucket>/<key> -- objects from the (moto) S3 bucket (like s3-us-west-2.amazonaws.com)
+    """
+    def __init__(self, language_ids:List[str]) -> None:
+        self.language_ids = language_ids
+        self.zip_cache:Dict[str,bytes] = {}
+        self.zip_cache_lock = threading.Lock()
+        self.s3_reader:Optional[Callable[[str,str],Optional[bytes]]] = None # Set once moto is running
+        self.request_counts:Counter = Counter()
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status, body, content_type = server.handle_path(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args:Any) -> None:
+                pass # Too noisy
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.base_url = f'http://127.0.0.1:{self.http_server.server_address[1]}'
+        self.thread = threading.Thread(target=self.http_server.serve_forever, name='LocalDoor43Server', daemon=True)
+
+
+    def start(self) -> 'LocalDoor43Server':
+        self.thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        self.http_server.shutdown()
+
+
+    def get_repo_zip(self, repo_name:str) -> bytes:
+        """
+        The content only depends on the language (the first part of the repo name),
+            so each one is only made once.
+        """
+        with self.zip_cache_lock:
+            if repo_name not in self.zip_cache:
+                language_id = repo_name.split('_')[0]
+                self.zip_cache[repo_name] = make_obs_zip(repo_name, make_obs_files(language_id))
+            return self.zip_cache[repo_name]
+
+
+    def get_catalog(self) -> Dict[str,Any]:
+        return {'languages': [{'identifier': language_id,
+                               'resources': [{'identifier': 'obs',
+                                              'projects': [{'formats': [{'format': 'application/zip; type=bundle content=text/markdown',
+                                                                         'url': f'{self.base_url}/load-test/{language_id}_obs/archive/master.zip'}]}]}]}
+                              for language_id in self.language_ids]}
+
+
+    def handle_path(self, path:str):
+        """
+        Returns the HTTP status code, the body (bytes) and the content type.
+        """
+        parts = path.strip('/').split('/')
+        if len(parts) == 4 and parts[2] == 'archive' and parts[3].endswith('.zip'):
+            self.request_counts['archive'] += 1
+            return 200, self.get_repo_zip(parts[1]), 'application/zip'
+        if path == '/v3/catalog.json':
+            self.request_counts['catalog'] += 1
+            return 200, json.dumps(self.get_catalog()).encode('utf-8'), 'application/json'
+        if len(parts) > 1 and self.s3_reader is not None:
+            self.request_counts['cdn'] += 1
+            body = self.s3_reader(parts[0], '/'.join(parts[1:]))
+            if body is not None:
+                return 200, body, 'application/json'
+        return 404, b'Not found', 'text/plain'
+# end of LocalDoor43Server class
+
+
+
+class NullStatsClient:
+    """
+    Stands in for statsd.StatsClient, just counting what it's given.
+    """
+    def __init__(self) -> None:
+        self.counts:Counter = Counter()
+        self.timings:Dict[str,List[float]] = {}
+        self.gauges:Dict[str,float] = {}
+        self.lock = threading.Lock()
+
+    def incr(self, stat:str, count:int=1, rate:float=1) -> None:
+        with self.lock:
+            self.counts[stat] += count
+
+    def decr(self, stat:str, count:int=1, rate:float=1) -> None:
+        self.incr(stat, -count, rate)
+
+    def timing(self, stat:str, delta:float, rate:float=1) -> None:
+        with self.lock:
+            self.timings.setdefault(stat, []).append(delta)
+
+    def gauge(self, stat:str, value:float, rate:float=1, delta:bool=False) -> None:
+        with self.lock:
+            self.gauges[stat] = value
+# end of NullStatsClient class
+
+
+
+class FakeTypesetter:
+    """
+    Replaces the ConTeXt command line with fake_context.py
+        (so the real ConTeXt runner with its log streaming, progress and cancellation still gets used).
+
+    Any object with a get_command(tex_filepath) method can be used instead.
+    """
+    def __init__(self, latency:float=30, jitter:float=0.2, runs:int=2, fail_rate:float=0) -> None:
+        self.latency, self.jitter, self.runs, self.fail_rate = latency, jitter, runs, fail_rate
+
+    def get_command(self, tex_filepath:str) -> str:
+        return f'"{sys.executable}" "{FAKE_CONTEXT_FILEPATH}" --latency {self.latency} --jitter {self.jitter}' \
+               f' --runs {self.runs} --fail-rate {self.fail_rate} "{tex_filepath}"'
+# end of FakeTypesetter class
+
+
+
+def start_mock_aws(bucket_names:List[str]):
+    """
+    Starts moto (in this process) and creates the buckets.
+
+    Returns the started mock and a function that reads an object (or returns None).
+    """
+    import boto3
+    try:
+        from moto import mock_aws # moto 5
+    except ImportError:
+        from moto import mock_s3 as mock_aws # Older moto (CloudWatch isn't mocked, but we replace that handler anyway)
+    aws_mock = mock_aws()
+    aws_mock.start()
+    s3_client = boto3.client('s3', region_name='us-west-2')
+    for bucket_name in bucket_names:
+        s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+
+    def read_s3_object(bucket_name:str, key:str) -> Optional[bytes]:
+        try:
+            return s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        except s3_client.exceptions.NoSuchBucket:
+            return None
+    return aws_mock, read_s3_object
+# end of start_mock_aws function
@@ -0,0 +1,22 @@
+"""
+Synthetic OBS resource containers for load testing
+    (the content comes from the benchmark corpus generator).
+"""
+from typing import Dict
+import io
+import zipfile
+
+from benchmarks.corpus import make_obs_files
+
+
+
+def make_obs_zip(repo_name:str, obs_files:Dict[str,str]) -> bytes:
+    """
+    Returns a zip archive like the ones Gitea makes (with everything inside a repo_name folder).
+    """
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_DEFLATED) as obs_zip:
+        for relative_path, contents in obs_files.items():
+            obs_zip.writestr(f'{repo_name}/{relative_path}', contents)
+    return zip_buffer.getvalue()
+# end of make_obs_zip function
@@ -1,12 +1,23 @@
 #!/usr/bin/python3
 
+from typing import Any, Dict, Optional, Tuple, Union
+import json
 import os
+from urllib.parse import quote
 
-from flask import Flask, request, send_from_directory, Response, redirect
+from flask import Flask, request, send_from_directory, Response, redirect, jsonify
+from redis import Redis
+from rq import Queue
 
-from lib.general_tools.app_utils import get_output_dir
-from lib.general_tools.file_utils import read_file
-from lib.pdf_from_dcs import PdfFromDcs
+from lib.build_log import load_build_log, get_build_fingerprint, get_reusable_build
+from lib.general_tools.file_utils import remove_tree
+from lib.general_tools.url_utils import get_url
+from lib.pdf_from_dcs import PdfFromDcs, DOOR43_SITE_URL
+from lib.pdf_variants import get_pdf_variants
+from lib.queue_tools.build_status import load_build_status
+from lib.queue_tools.job_coalescer import JOB_FUNCTION_NAME, get_coalesce_key, enqueue_coalesced, find_started_jobs
+from lib.queue_tools.job_progress import get_job_status
+from rq_settings import REDIS_URL, webhook_queue_name, pdf_job_timeout_seconds
 
 
 prefix = os.getenv('QUEUE_PREFIX', '') # Gets (optional) QUEUE_PREFIX environment variable -- set to 'dev-' for development
@@ -22,62 +33,204 @@ config_file = os.path.join(project_dir, 'config', 'settings.ini')
 if os.path.isfile(config_file):
     app.config.from_pyfile(config_file)
 
+redis_connection = Redis.from_url(REDIS_URL) # Doesn't actually connect until it's used
+
+
+
+def get_request_parameters() -> Tuple[Optional[str], Union[str,Tuple[str,str,str]]]:
+    """
+    Reads the PdfFromDcs parameters from the request arguments.
+
+    Returns the parameter_type and the parameter(s)
+        or None and the error message if there's no valid parameter.
+    """
+    parameter = request.args.get('lang_code', '')
+    if parameter:
+        return 'Catalog_lang_code', parameter
+
+    parameter = request.args.get('repo', '')
+    if parameter:
+        if parameter.strip('/').count('/') == 1:
+            return 'Door43_repo', parameter
+        return None, 'Bad Request - invalid Door43 username/repo specification'
+
+    parameter1 = request.args.get('username', '')
+    if parameter1:
+        parameter2 = request.args.get('repo_name', '')
+        parameter3 = request.args.get('spec', '')
+        if not parameter2 or not parameter3:
+            return None, 'Bad Request - repo_name and spec should follow username'
+        return 'username_repoName_spec', (parameter1, parameter2, parameter3)
+
+    # can't find any valid parameter
+    return None, 'Bad Request - no lang_code or repo or username'
+# end of get_request_parameters()
+
+
+
+def make_job_payload(parameter_type:str, parameter:Union[str,Tuple[str,str,str]],
+                        commit_hash:Optional[str]=None) -> Dict[str,Any]:
+    """
+    Returns a queue payload like the ones that tX Enqueue Job makes for the webhook,
+        so that the rq worker builds (and logs) requests from here in exactly the same way.
+
+    If the commit_hash (that the branch/tag currently points to) is given, it's added to the identifier
+        so that the build log records it (and the job coalescing still goes by the first three parts).
+
+    Catalog language codes and Door43 repos without a spec (which get their master branch built
+        into the old auto_PDFs CDN folder) aren't logged in a repo's build log
+        so they get their own job functions (see get_job_function_name() below).
+    """
+    if parameter_type == 'Catalog_lang_code':
+        return {'identifier': f'catalog--{parameter}--obs', 'lang_code': parameter}
+
+    if parameter_type == 'Door43_repo':
+        username, repo_name = parameter.strip('/').split('/')
+        return {'identifier': f'Door43_repo--{username}--{repo_name}', 'Door43_repo': f'{username}/{repo_name}'}
+
+    username, repo_name, spec = parameter
+    return {'identifier': f'{username}--{repo_name}--{spec}' + (f'--{commit_hash}' if commit_hash else ''),
+            'source': f'{DOOR43_SITE_URL}/{username}/{repo_name}/archive/{spec}.zip',
+            'input_format': 'md', 'output_format': 'pdf',
+            'resource_type': 'Open_Bible_Stories'}
+# end of make_job_payload()
+
+
+def get_job_function_name(payload:Dict[str,Any]) -> str:
+    if 'lang_code' in payload:
+        return 'webhook.catalog_job'
+    if 'Door43_repo' in payload:
+        return 'webhook.door43_repo_job'
+    return JOB_FUNCTION_NAME
+
+
+def get_current_commit_hash(username:str, repo_name:str, spec:str) -> Optional[str]:
+    """
+    Returns the hash of the commit that the branch/tag currently points to
+        (or None if DCS can't tell us).
+    """
+    commits_url = f"{DOOR43_SITE_URL}/api/v1/repos/{quote(username)}/{quote(repo_name)}/commits?sha={quote(spec)}&limit=1"
+    try:
+        return json.loads(get_url(commits_url))[0]['sha']
+    except Exception as e:
+        print(f"Unable to get the current commit for {username}/{repo_name}--{spec}: {e}")
+        return None
+# end of get_current_commit_hash()
+
+
+def get_status_url(job_id:str) -> str:
+    return f"{request.host_url.rstrip('/')}/status/{job_id}"
+
 
 
 @app.route('/', methods=['POST', 'GET'])
 def pdf_from_dcs():
+    """
+    Returns the details of an existing PDF (200) if one was already built for the same repo/spec
+            from the commit that it currently points to,
+        otherwise queues the build for the rq worker
+        and returns (202) the job id and a URL where its progress can be checked.
+
+    Add force=1 to the arguments to ignore any existing PDF.
+    """
     if request.method != 'GET':
         return 'Bad Request', 400
 
-    parameter = request.args.get('lang_code', '')
-    if parameter:
-        print(f"\n\nStarting to process OBS PDF request for Door43 Catalog language code '{parameter}'…")
-        parameter_type = 'Catalog_lang_code'
-    else:
-        parameter = request.args.get('repo', '')
-        if parameter:
-            if parameter.strip('/').count('/') == 1:
-                print(f"\n\nStarting to process OBS PDF request for Door43 repo '{parameter}'…")
-                parameter_type = 'Door43_repo'
-            else:
-                return 'Bad Request - invalid Door43 username/repo specification', 400
-        else:
-            parameter1 = request.args.get('username', '')
-            if parameter1:
-                parameter2 = request.args.get('repo_name', '')
-                parameter3 = request.args.get('spec', '')
-                if not parameter2 or not parameter3:
-                    return 'Bad Request - repo_name and spec should follow username', 400
-                print(f"\n\nStarting to process OBS PDF request for Door43 '{parameter1}'/'{parameter2}'-'{parameter3}'…")
-                parameter_type = 'username_repoName_spec'
-                parameter = (parameter1, parameter2, parameter3)
-            else: # can't find any valid parameter
-                return 'Bad Request - no lang_code or repo or username', 400
+    parameter_type, parameter = get_request_parameters()
+    if parameter_type is None:
+        return parameter, 400
+    print(f"\n\nStarting to process OBS PDF request for {parameter_type} {parameter}…")
 
     try:
-        with PdfFromDcs(prefix, parameter_type, parameter) as f:
-            run_result = f.run()
-
-    except ChildProcessError:
-        err_text = 'AN ERROR OCCURRED GENERATING THE PDF\r\n\r\n'
-        err_text += read_file(os.path.join(get_output_dir(), 'context.err'))
-        err_text += '\r\n\r\n\r\nFULL ConTeXt OUTPUT\r\n\r\n'
-        err_text += read_file(os.path.join(get_output_dir(), 'context.out'))
-        return Response(err_text, mimetype='text/plain')
+        current_commit_hash = None
+        if parameter_type == 'username_repoName_spec' and not request.args.get('force', ''):
+            username, repo_name, spec = parameter
+            current_commit_hash = get_current_commit_hash(username, repo_name, spec)
+        payload = make_job_payload(parameter_type, parameter, current_commit_hash)
+        if current_commit_hash is not None: # Otherwise we can't tell if an existing PDF is out of date
+            build_fingerprint = get_build_fingerprint(None, get_pdf_variants(None))
+            # The Redis build status saves fetching the JSON build log from the CDN
+            reusable_build = get_reusable_build({spec: load_build_status(redis_connection, prefix, username, repo_name, spec)},
+                                                spec, current_commit_hash, build_fingerprint) \
+                                or get_reusable_build(load_build_log(prefix, username, repo_name), spec,
+                                                      current_commit_hash, build_fingerprint)
+            if reusable_build is not None:
+                return jsonify({'status': 'success', 'cached': True,
+                                'identifier': payload['identifier'],
+                                'PDF_url': reusable_build['PDF_url'],
+                                'processed_at': reusable_build.get('processed_at')}), 200
+
+        queue = Queue(webhook_queue_name, connection=redis_connection)
+        started_jobs = find_started_jobs(queue, get_coalesce_key(payload))
+        if started_jobs: # Don't cancel a build that's already running for the same thing
+            job, status = started_jobs[0], 'started'
+        else:
+            job, was_existing = enqueue_coalesced(queue, payload,
+                                    job_function_name=get_job_function_name(payload),
+                                    job_timeout=pdf_job_timeout_seconds)
+            status = 'queued'
+            print(f"{'Updated existing' if was_existing else 'Enqueued new'} job {job.id} for {payload['identifier']}")
 
-    except Exception as e: # all other exceptions
+    except Exception as e: # e.g., can't connect to Redis
         print(f"Got an EXCEPTION: {e}") # Show exception string in console
-        return Response(str(e), mimetype='text/plain') # Return exception string to user
+        return Response(str(e), mimetype='text/plain', status=503) # Return exception string to user
 
-    # return redirect(f'/output/{lang_code}/{pdf_file}', code=302)
-    if run_result: # it should be the URL of the file on S3
-        return f'Success @ <a href="{run_result}">{run_result[8:]}</a>', 200
-    # else:
-    return 'PDF Build Error', 500
+    status_url = get_status_url(job.id)
+    return jsonify({'status': status, 'job_id': job.id,
+                    'identifier': payload['identifier'],
+                    'status_url': status_url}), 202, {'Location': status_url}
 # end of pdf_from_dcs()
 
 
 
+@app.route('/preflight', methods=['GET'], strict_slashes=False)
+def preflight():
+    """
+    Quickly checks the source (without building anything)
+        and returns JSON lists of any errors (that stop a build) and warnings found.
+    """
+    parameter_type, parameter = get_request_parameters()
+    if parameter_type is None:
+        return parameter, 400
+    print(f"\n\nStarting OBS PDF preflight check for {parameter_type} {parameter}…")
+
+    warnings = []
+    f = None
+    try:
+        # Isolated so that the (several) uwsgi processes don't clean up each other's downloads
+        with PdfFromDcs(prefix, parameter_type, parameter, isolated=True) as f:
+            errors = f.preflight()
+            warnings = f.preflight_warnings
+    except Exception as e:
+        print(f"Got an EXCEPTION: {e}") # Show exception string in console
+        errors = [{'code':'fetch-failed', 'location':str(parameter), 'message':str(e)}]
+    finally:
+        if f is not None:
+            remove_tree(f.tmp_download_dirpath)
+
+    return jsonify({'ok': not errors, 'errors': errors, 'warnings': warnings}), 200 if not errors else 422
+# end of preflight()
+
+
+
+@app.route('/status/<job_id>', methods=['GET'])
+def job_status(job_id:str):
+    """
+    Returns JSON showing how far a queued PDF job has got
+        (from the progress that the job saves in Redis).
+    """
+    try:
+        status_dict = get_job_status(redis_connection, job_id)
+    except Exception as e: # e.g., can't connect to Redis
+        print(f"Got an EXCEPTION: {e}") # Show exception string in console
+        return jsonify({'job_id': job_id, 'error': str(e)}), 503
+    if status_dict is None:
+        return jsonify({'job_id': job_id, 'error': 'Unknown (or expired) job'}), 404
+    return jsonify(status_dict), 200
+# end of job_status()
+
+
+
 @app.route('/test', methods=['POST', 'GET'], strict_slashes=False)
 def test_page():
     return send_from_directory(os.path.join(project_dir, 'static'), 'test_response.html')
@@ -0,0 +1,162 @@
+# OBS PDF rq worker that preloads everything that doesn't change between jobs
+#
+# Start it with
+#   rq worker --config rq_settings --worker-class obs_worker.PreloadedWorker
+#
+# rq forks a new work horse for each job, and the job function's module (webhook.py)
+#   is normally imported in there, i.e., once per job, along with boto3,
+#   and every build then re-reads the templates, reloads the fonts and makes its own S3 connection.
+# The log messages from the work horses are also passed back to this process
+#   to be sent to CloudWatch in the background (see lib/log_shipping.py).
+# This worker does all of that once in the parent process so that each forked work horse starts warm.
+#
+# To keep the long-lived parent healthy, the worker stops after a number of jobs
+#   or if its memory grows too much, exiting with RECYCLE_EXIT_CODE so that the start script
+#   (see resources/docker-app/start_RqApp_*.sh) knows to start a fresh one.
+
+from typing import Dict, Optional
+import os
+import sys
+from time import time
+
+from rq import Worker
+
+
+MAX_JOBS_BEFORE_RECYCLE = int(os.getenv('WORKER_MAX_JOBS', '100'))
+MAX_RSS_MB_BEFORE_RECYCLE = int(os.getenv('WORKER_MAX_RSS_MB', '1024'))
+CATALOG_MAX_AGE_SECONDS = int(os.getenv('WORKER_CATALOG_MAX_AGE_SECONDS', '900'))
+RECYCLE_EXIT_CODE = 75 # EX_TEMPFAIL
+
+
+
+def get_rss_bytes() -> int:
+    """
+    Returns the current resident set size of this process (or the peak one if /proc isn't available).
+    """
+    try:
+        with open('/proc/self/statm', 'rt') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # KiB on Linux
+# end of get_rss_bytes function
+
+
+
+class PreloadedWorker(Worker):
+    """
+    An rq Worker that preloads the job handler and its caches before forking work horses,
+        and recycles itself after MAX_JOBS_BEFORE_RECYCLE jobs or MAX_RSS_MB_BEFORE_RECYCLE of memory.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.preload_seconds:Dict[str,float] = {}
+        self.num_jobs_done = 0
+        self.catalog_loaded_at:Optional[float] = None
+        self.recycle_reason:Optional[str] = None
+        self.log_forwarder = None
+
+
+    def preload(self) -> None:
+        """
+        Imports the job handler and loads everything that every job would otherwise load for itself.
+        """
+        from lib.preloading import run_timed, preload_templates, preload_font_data, reload_context_fonts
+
+        def import_job_handler() -> None:
+            import webhook
+            import boto3 # webhook imports it on first use (i.e., in every forked job)
+
+        def make_s3_handler() -> None:
+            # No requests are made in this process, so there are no connections to be shared by the forks
+            import webhook
+            from lib.aws_tools.s3_handler import S3Handler
+            from lib.pdf_from_dcs import AWS_REGION_NAME, CDN_BUCKET_NAME
+            webhook.cdn_s3_handler = S3Handler(bucket_name=f'{webhook.prefix}{CDN_BUCKET_NAME}',
+                                                aws_access_key_id=webhook.aws_access_key_id,
+                                                aws_secret_access_key=webhook.aws_secret_access_key,
+                                                aws_region_name=AWS_REGION_NAME)
+
+        def start_log_shipping() -> None:
+            import webhook
+            from lib.log_shipping import LogShipper, LogForwarder, CloudWatchLogSink
+            log_shipper = LogShipper(CloudWatchLogSink(webhook.aws_access_key_id, webhook.aws_secret_access_key,
+                                                       webhook.AWS_REGION_NAME))
+            self.log_forwarder = webhook.log_shipper = LogForwarder(log_shipper)
+
+        def reload_fonts() -> None:
+            import subprocess
+            from lib.pdf_from_dcs import PdfFromDcs
+            try:
+                reload_context_fonts()
+            except (OSError, subprocess.CalledProcessError) as e: # Then each build still does it
+                self.log.warning(f"Unable to preload the ConTeXt fonts: {e}")
+                return
+            PdfFromDcs.reload_fonts = False # Already done for all of the builds from this worker
+
+        self.preload_seconds = run_timed({'job handler': import_job_handler,
+                                          'S3 client': make_s3_handler,
+                                          'log shipping': start_log_shipping,
+                                          'templates': preload_templates,
+                                          'font data': preload_font_data,
+                                          'ConTeXt fonts': reload_fonts,
+                                          })
+        self.refresh_catalog()
+        self.log.info(f"Preloaded in {sum(self.preload_seconds.values()):.2f}s: {self.preload_seconds}")
+    # end of PreloadedWorker.preload function
+
+
+    def refresh_catalog(self) -> None:
+        """
+        Keeps a recent copy of the Door43 Catalog for the catalog language jobs.
+        """
+        if self.catalog_loaded_at is not None and time() - self.catalog_loaded_at < CATALOG_MAX_AGE_SECONDS:
+            return
+        import webhook
+        from lib.general_tools.url_utils import get_catalog
+        start_time = time()
+        try:
+            webhook.catalog = get_catalog()
+        except Exception as e: # The builds can still fetch it themselves
+            self.log.warning(f"Unable to preload the Door43 Catalog: {e}")
+            webhook.catalog = None
+            return
+        self.catalog_loaded_at = time()
+        self.preload_seconds['catalog'] = round(self.catalog_loaded_at - start_time, 3)
+    # end of PreloadedWorker.refresh_catalog function
+
+
+    def work(self, *args, **kwargs):
+        self.preload()
+        try:
+            result = super().work(*args, **kwargs)
+        finally:
+            if self.log_forwarder is not None:
+                self.log_forwarder.close() # Sends whatever's left from the last jobs
+        saved_seconds = self.num_jobs_done * sum(self.preload_seconds.values())
+        self.log.info(f"Preloading saved about {saved_seconds:.1f}s over {self.num_jobs_done} job(s)")
+        if self.recycle_reason is not None:
+            self.log.info(f"Worker {self.key}: exiting to be recycled because {self.recycle_reason}")
+            sys.exit(RECYCLE_EXIT_CODE)
+        return result
+    # end of PreloadedWorker.work function
+
+
+    def execute_job(self, job, queue):
+        self.refresh_catalog()
+        super().execute_job(job, queue) # Forks the work horse (which inherits everything preloaded) and waits for it
+        self.num_jobs_done += 1
+        saved_seconds = sum(self.preload_seconds.values())
+        self.log.info(f"Job {job.id} ran with everything preloaded (saving about {saved_seconds:.2f}s)")
+        import webhook
+        webhook.stats_client.timing(f'{webhook.job_handler_stats_prefix}.worker.preload_saved', round(saved_seconds * 1000))
+
+        rss_mb = get_rss_bytes() / 1_048_576
+        if self.num_jobs_done >= MAX_JOBS_BEFORE_RECYCLE:
+            self.recycle_reason = f"it has done {self.num_jobs_done} jobs"
+        elif rss_mb > MAX_RSS_MB_BEFORE_RECYCLE:
+            self.recycle_reason = f"it's using {rss_mb:.0f}MB"
+        if self.recycle_reason is not None:
+            self._stop_requested = True # The work loop then stops before taking another job
+    # end of PreloadedWorker.execute_job function
+# end of PreloadedWorker class
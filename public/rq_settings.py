@@ -27,3 +27,8 @@ QUEUES = [webhook_queue_name]
 
 # Our stuff
 debug_mode_flag = getenv('DEBUG_MODE', None)
+# Optionally reschedule a job that's been queued for less than this long to start once it has been
+#   so that a burst of pushes to the same branch can be coalesced into one build (needs --with-scheduler)
+coalesce_quiet_seconds = float(getenv('COALESCE_QUIET_SECONDS', '0'))
+# Timeout for jobs enqueued by the Flask front end (ConTeXt can take several minutes)
+pdf_job_timeout_seconds = int(getenv('PDF_JOB_TIMEOUT_SECONDS', '1800'))
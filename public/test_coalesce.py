@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+# Local test of the job coalescing using a fake Redis (pip install fakeredis)
+#   so it doesn't need a real queue (or AWS)
+
+import calendar
+from datetime import timedelta
+
+from fakeredis import FakeStrictRedis
+from rq import Queue
+
+from lib.queue_tools import job_coalescer
+from rq.registry import ScheduledJobRegistry
+
+from lib.queue_tools.job_coalescer import MAX_QUIET_PERIODS, defer_until_quiet, enqueue_coalesced, \
+                                            find_superseding_job, make_cancel_check
+
+
+def make_payload(identifier:str) -> dict:
+    return {'identifier': identifier,
+            'source': f"https://git.door43.org/{'/'.join(identifier.split('--')[:2])}/archive/{identifier.split('--')[2]}.zip",
+            'input_format': 'md', 'output_format': 'pdf', 'resource_type': 'Open_Bible_Stories'}
+
+
+def test_enqueue_side_coalescing() -> None:
+    queue = Queue('test_queue', connection=FakeStrictRedis())
+    job1, was_existing1 = enqueue_coalesced(queue, make_payload('owner--en_obs--master--aaa'))
+    job2, was_existing2 = enqueue_coalesced(queue, make_payload('owner--en_obs--master--bbb'))
+    job3, was_existing3 = enqueue_coalesced(queue, make_payload('owner--en_obs--develop--ccc'))
+    assert not was_existing1 and was_existing2 and not was_existing3
+    assert job2.id == job1.id
+    assert len(queue) == 2
+    queued_job = queue.fetch_job(job1.id)
+    assert queued_job.args[0]['identifier'] == 'owner--en_obs--master--bbb'
+    assert queued_job.meta['superseded_identifiers'] == ['owner--en_obs--master--aaa']
+
+
+def test_enqueue_while_dequeuing() -> None:
+    queue = Queue('test_queue', connection=FakeStrictRedis())
+    job1, _was_existing = enqueue_coalesced(queue, make_payload('owner--en_obs--master--aaa'))
+    # As if a worker started the job just after it was found
+    original_find_queued_jobs = job_coalescer.find_queued_jobs
+    def find_queued_jobs_then_dequeue(*args, **kwargs):
+        queued_jobs = original_find_queued_jobs(*args, **kwargs)
+        queue.remove(job1)
+        return queued_jobs
+    job_coalescer.find_queued_jobs = find_queued_jobs_then_dequeue
+    try:
+        job2, was_existing2 = enqueue_coalesced(queue, make_payload('owner--en_obs--master--bbb'))
+    finally:
+        job_coalescer.find_queued_jobs = original_find_queued_jobs
+    assert not was_existing2 and job2.id != job1.id
+    assert queue.fetch_job(job1.id).args[0]['identifier'] == 'owner--en_obs--master--aaa'
+    assert queue.get_job_ids() == [job2.id]
+
+
+def test_dequeue_side_coalescing() -> None:
+    queue = Queue('test_queue', connection=FakeStrictRedis())
+    # As if the jobs were enqueued by something that doesn't coalesce (e.g., tX Enqueue Job)
+    job1 = queue.enqueue('webhook.job', make_payload('owner--en_obs--master--aaa'))
+    job2 = queue.enqueue('webhook.job', make_payload('owner--en_obs--master--bbb'))
+    queue.enqueue('webhook.job', make_payload('owner--fr_obs--master--ccc'))
+    queue.remove(job1) # rq removes the job from the queue before it's started
+    superseding_job = find_superseding_job(queue, job1.args[0], job1)
+    assert superseding_job is not None and superseding_job.id == job2.id
+    queue.remove(job2)
+    assert find_superseding_job(queue, job2.args[0], job2) is None
+
+
+def get_scheduled_timestamp(queue:Queue, job_id:str) -> int:
+    return int(queue.connection.zscore(ScheduledJobRegistry(queue=queue).key, job_id))
+
+
+def test_quiet_period_deferral() -> None:
+    queue = Queue('test_queue', connection=FakeStrictRedis())
+    job1 = queue.enqueue('webhook.job', make_payload('owner--en_obs--master--aaa'))
+    assert defer_until_quiet(queue, job1.args[0], job1, quiet_seconds=0) is None
+    deferred_job = defer_until_quiet(queue, job1.args[0], job1, quiet_seconds=30)
+    assert deferred_job is not None and deferred_job.id != job1.id
+    assert ScheduledJobRegistry(queue=queue).get_job_ids() == [deferred_job.id]
+    first_timestamp = calendar.timegm(job1.enqueued_at.utctimetuple())
+    assert abs(get_scheduled_timestamp(queue, deferred_job.id) - (first_timestamp + 30)) <= 1
+    # Another push 10s later gets merged into the deferred job, which then waits for 30s after that push
+    job2 = queue.enqueue('webhook.job', make_payload('owner--en_obs--master--bbb'))
+    job2.enqueued_at = job1.enqueued_at + timedelta(seconds=10)
+    assert defer_until_quiet(queue, job2.args[0], job2, quiet_seconds=30).id == deferred_job.id
+    assert len(ScheduledJobRegistry(queue=queue)) == 1
+    assert get_scheduled_timestamp(queue, deferred_job.id) == first_timestamp + 40
+    scheduled_job = queue.fetch_job(deferred_job.id)
+    assert scheduled_job.args[0]['identifier'] == 'owner--en_obs--master--bbb'
+    assert scheduled_job.meta['superseded_identifiers'] == ['owner--en_obs--master--aaa']
+    # But a steady stream of pushes can't put it off for ever
+    job3 = queue.enqueue('webhook.job', make_payload('owner--en_obs--master--ccc'))
+    job3.enqueued_at = job1.enqueued_at + timedelta(seconds=MAX_QUIET_PERIODS * 30)
+    assert defer_until_quiet(queue, job3.args[0], job3, quiet_seconds=30).id == deferred_job.id
+    assert get_scheduled_timestamp(queue, deferred_job.id) == first_timestamp + MAX_QUIET_PERIODS * 30
+    scheduled_job = queue.fetch_job(deferred_job.id)
+    # And the deferred job runs when it's started
+    assert defer_until_quiet(queue, scheduled_job.args[0], scheduled_job, quiet_seconds=30) is None
+
+
+def test_cancel_check() -> None:
+    queue = Queue('test_queue', connection=FakeStrictRedis())
+    running_job = queue.enqueue('webhook.job', make_payload('owner--en_obs--master--aaa'))
+    queue.remove(running_job)
+    cancel_check = make_cancel_check(queue, running_job.args[0], running_job)
+    assert not cancel_check()
+    enqueue_coalesced(queue, make_payload('owner--en_obs--develop--bbb'))
+    assert not cancel_check()
+    enqueue_coalesced(queue, make_payload('owner--en_obs--master--ccc'))
+    assert cancel_check()
+
+
+if __name__ == '__main__':
+    test_enqueue_side_coalescing()
+    test_enqueue_while_dequeuing()
+    test_dequeue_side_coalescing()
+    test_quiet_period_deferral()
+    test_cancel_check()
+    print("Job coalescing tests passed.")
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+# Local test of the background log shipping using the in-memory stand-in sink
+#   so it doesn't need AWS CloudWatch
+
+import logging
+import os
+import threading
+
+from lib.log_shipping import LogShipper, LogForwarder, LogShippingHandler, MemoryLogSink, split_message
+
+
+class BlockedSink(MemoryLogSink):
+    """
+    A sink that doesn't return until it's released (like a very slow network).
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.released_event = threading.Event()
+
+    def put_events(self, log_group:str, stream_name:str, events:list) -> None:
+        self.released_event.wait()
+        super().put_events(log_group, stream_name, events)
+
+
+def test_batched_shipping() -> None:
+    sink = MemoryLogSink()
+    shipper = LogShipper(sink, flush_interval_seconds=60)
+    logger = logging.getLogger('test_batched_shipping')
+    logger.setLevel(logging.INFO)
+    logger.addHandler(LogShippingHandler(shipper, 'group', 'stream'))
+    for n in range(100):
+        logger.info(f"Message {n}")
+    shipper.ship('FAILED_group', 'stream', "Failure message")
+    assert shipper.flush(timeout=5)
+    assert sink.get_messages('group', 'stream') == [f"Message {n}" for n in range(100)]
+    assert sink.get_messages('FAILED_group', 'stream') == ["Failure message"]
+    assert sink.num_batches == 2 # One for each stream
+    shipper.close()
+
+
+def test_bounded_queue() -> None:
+    sink = BlockedSink()
+    shipper = LogShipper(sink, max_queued_events=10, flush_interval_seconds=0.01)
+    shipper.ship('group', 'stream', "First message") # Taken by the (now blocked) shipping thread
+    while shipper.queued_events:
+        pass
+    for n in range(25):
+        shipper.ship('group', 'stream', f"Message {n}")
+    assert len(shipper.queued_events) == 10 and shipper.total_dropped == 15
+    assert not shipper.flush(timeout=0.1) # Still blocked
+    sink.released_event.set()
+    shipper.close()
+    messages = sink.get_messages('group', 'stream')
+    assert messages[:11] == ["First message"] + [f"Message {n}" for n in range(15, 25)] # The oldest were dropped
+    assert "dropped 15 message(s)" in messages[11]
+
+
+def test_forwarding_from_forked_process() -> None:
+    sink = MemoryLogSink()
+    forwarder = LogForwarder(LogShipper(sink, flush_interval_seconds=60))
+    pid = os.fork()
+    if pid == 0: # The child (like an rq work horse)
+        forwarder.ship('group', 'stream', "From the child " + 'x' * 100_000) # Gets split into several datagrams
+        os._exit(0)
+    os.waitpid(pid, 0)
+    forwarder.close() # Sends everything
+    messages = sink.get_messages('group', 'stream')
+    assert ''.join(messages) == "From the child " + 'x' * 100_000 and len(messages) > 1
+
+
+def test_malformed_forwarded_message() -> None:
+    sink = MemoryLogSink()
+    forwarder = LogForwarder(LogShipper(sink, flush_interval_seconds=60))
+    forwarder.ship('group', 'stream', "Before")
+    forwarder.send_socket.send(b'{"not": "a list"') # Truncated JSON
+    forwarder.send_socket.send(b'\xff\xfe') # Not UTF-8
+    forwarder.send_socket.send(b'42')
+    forwarder.ship('group', 'stream', "After")
+    forwarder.close()
+    assert forwarder.thread.is_alive() # Still receiving
+    messages = sink.get_messages('group', 'stream')
+    assert messages[:2] == ["Before", "After"] and forwarder.shipper.total_dropped == 3
+
+
+def test_split_message() -> None:
+    parts = split_message('ሰላም' * 10, 10) # 3 bytes per character
+    assert ''.join(parts) == 'ሰላም' * 10
+    assert all(len(part.encode('utf-8')) <= 10 for part in parts)
+
+
+if __name__ == '__main__':
+    test_batched_shipping()
+    test_bounded_queue()
+    test_forwarding_from_forked_process()
+    test_malformed_forwarded_message()
+    test_split_message()
+    print("Log shipping tests passed.")
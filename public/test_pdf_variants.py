@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+# Local test of the checking of the requested PDF variants
+#   so it doesn't need ImageMagick (or ConTeXt)
+
+import os
+import stat
+import tempfile
+
+import lib.pdf_variants
+from lib.general_tools.file_utils import remove_tree
+from lib.pdf_variants import DEFAULT_VARIANT_SETTINGS, get_pdf_variants, prepare_image_folder
+
+
+def test_valid_variants() -> None:
+    assert get_pdf_variants() == [{'name': 'print', **DEFAULT_VARIANT_SETTINGS}]
+    variants = get_pdf_variants(['screen', {'name': 'small', 'img_res': '180px', 'paper_size': 'A5'}])
+    assert [variant['name'] for variant in variants] == ['screen', 'small']
+    assert variants[0]['jpeg_quality'] == 70
+    assert variants[1] == {'name': 'small', 'img_res': '180px', 'jpeg_quality': None, 'paper_size': 'A5'}
+
+
+def test_invalid_variants() -> None:
+    for variant_specs in ('screen', # Not a list
+                          ['print', 'screen', 'lowband', 'a', 'b'], # Too many
+                          [{'img_res': '180px'}], # No name
+                          [42],
+                          ['Big Print'], ['../print'], # Not fit for file names
+                          [{'name': 'print', 'font': 'Noto'}], # Unknown setting
+                          [{'name': 'huge', 'img_res': '720px'}], # Bigger than the original pictures
+                          [{'name': 'tiny', 'img_res': '0px'}],
+                          [{'name': 'odd', 'img_res': 180}],
+                          [{'name': 'lossy', 'jpeg_quality': 0}],
+                          [{'name': 'lossless', 'jpeg_quality': 100}],
+                          [{'name': 'text', 'jpeg_quality': '70'}],
+                          [{'name': 'flag', 'jpeg_quality': True}],
+                          [{'name': 'legal', 'paper_size': 'legal'}],
+                          ['print', {'name': 'print', 'paper_size': 'A4'}]): # Given twice
+        try:
+            get_pdf_variants(variant_specs)
+        except ValueError:
+            continue
+        raise AssertionError(f"Variants {variant_specs!r} should have been rejected")
+
+
+def write_script(dirpath:str, name:str, script_text:str) -> str:
+    script_filepath = os.path.join(dirpath, name)
+    with open(script_filepath, 'wt') as script_file:
+        script_file.write(f'#!/bin/sh\n{script_text}\n')
+    os.chmod(script_filepath, stat.S_IRWXU)
+    return script_filepath
+
+
+def test_smaller_pictures_keep_their_size() -> None:
+    test_dirpath = tempfile.mkdtemp()
+    try:
+        original_dirpath = os.path.join(test_dirpath, '360px/')
+        os.makedirs(original_dirpath)
+        for filename in ('obs-en-01-01.jpg', 'obs-en-01-02.jpg'):
+            open(os.path.join(original_dirpath, filename), 'wb').close()
+        arguments_filepath = os.path.join(test_dirpath, 'mogrify-arguments.txt')
+        # Stand-ins for ImageMagick: the originals are 360px at 72 DPI (with the units undefined)
+        lib.pdf_variants.IDENTIFY_COMMAND = write_script(test_dirpath, 'identify', "printf '360 72 Undefined'")
+        lib.pdf_variants.MOGRIFY_COMMAND = write_script(test_dirpath, 'mogrify', f'echo "$@" > {arguments_filepath}')
+        lib.pdf_variants.ORIGINAL_IMAGE_FOLDER_PATH = original_dirpath
+        lib.pdf_variants.VARIANT_IMAGE_DIRPATH = os.path.join(test_dirpath, 'variants/')
+        image_folderpath, reason = prepare_image_folder('180px', 40)
+        assert reason is None and image_folderpath == os.path.join(test_dirpath, 'variants/180px-q40/')
+        with open(arguments_filepath, 'rt') as arguments_file:
+            arguments = arguments_file.read()
+        # Half the pixels at half the density are typeset at the same size
+        assert '-resize 180x -units PixelsPerInch -density 36 -quality 40 ' in arguments
+
+        lib.pdf_variants.IDENTIFY_COMMAND = write_script(test_dirpath, 'identify', 'exit 1')
+        image_folderpath, reason = prepare_image_folder('90px', None)
+        assert image_folderpath == original_dirpath and reason
+    finally:
+        remove_tree(test_dirpath)
+
+
+
+if __name__ == '__main__':
+    test_valid_variants()
+    test_invalid_variants()
+    test_smaller_pictures_keep_their_size()
+    print("PDF variant tests passed.")
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+# Local test of the queue throughput figures and worker recommendation using a fake Redis (pip install fakeredis)
+#   so it doesn't need a real queue
+
+from fakeredis import FakeStrictRedis
+from rq import Queue, Worker
+from rq.job import Job
+
+from lib.queue_tools.queue_metrics import QueueMetrics, recommend_workers
+
+
+NOW = 1_700_000_000.0
+
+
+def test_recommend_workers() -> None:
+    # 1 job a minute of 30s keeps one worker busy half the time, i.e., 0.71 workers at 70%
+    assert recommend_workers(1, 30, backlog=0, target_utilisation=0.7) == 1
+    assert recommend_workers(6, 30, backlog=0, target_utilisation=0.7) == 5 # 4.29 rounded up
+    assert recommend_workers(6, 30, backlog=40, target_utilisation=0.7, target_drain_seconds=600) == 7 # Plus 2 for the backlog
+    assert recommend_workers(0, 30, backlog=0, min_workers=1) == 1
+    assert recommend_workers(600, 300, backlog=0, max_workers=20) == 20
+
+
+def test_fixed_arrival_rate() -> None:
+    connection = FakeStrictRedis()
+    queue = Queue('test_queue', connection=connection)
+    for worker_name in ('worker1', 'worker2'):
+        worker = Worker([queue], connection=connection, name=worker_name)
+        worker.register_birth()
+    worker.set_state('busy')
+    queue_metrics = QueueMetrics(queue, window_seconds=1800)
+    # A job arrives (and starts straight away) every 30s and takes 30s to build
+    for n in range(60):
+        job = Job.create('webhook.job', connection=connection, id=f'job{n}')
+        queue_metrics.record_job_start(job, now=NOW - 1800 + 30 * n)
+        queue_metrics.record_job_end(job, 30, now=NOW - 1800 + 30 * n + 30)
+    # And one from before the window that's ignored
+    queue_metrics.record_job_end(Job.create('webhook.job', connection=connection, id='old'), 3000, now=NOW - 2000)
+
+    summary = queue_metrics.get_summary(now=NOW)
+    assert summary['backlog'] == 0
+    assert summary['arrivals_per_minute'] == 2
+    assert summary['jobs_per_minute'] == 2
+    assert summary['mean_build_seconds'] == 30
+    assert summary['workers'] == 2 and summary['busy_workers'] == 1
+    assert summary['busy_fraction'] == 0.5 # 60 builds of 30s over 2 workers for 30 minutes
+    assert summary['drain_eta_seconds'] == 0
+    assert summary['recommended_workers'] == 2 # 1.43 rounded up
+
+    # Jobs still waiting count as arrivals too, and add to the recommendation
+    for n in range(10):
+        queue.enqueue('webhook.job', {'identifier': f'owner--repo--branch{n}'})
+    summary = queue_metrics.get_summary(now=NOW)
+    assert summary['backlog'] == 10
+    assert summary['arrivals_per_minute'] == round(70 / 30, 3)
+    assert summary['recommended_workers'] == 3 # 1.67 for the arrivals and 0.5 for the backlog
+    assert summary['drain_eta_seconds'] == round(10 / (2 / 30 - 70 / 30 / 60))
+
+
+
+if __name__ == '__main__':
+    test_recommend_workers()
+    test_fixed_arrival_rate()
+    print("Queue metrics tests passed.")
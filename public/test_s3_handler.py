@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Local test of the skipping of unchanged S3 uploads and copies using moto (pip install moto[s3])
+#   so it doesn't need AWS
+
+import os
+import tempfile
+
+import boto3
+try:
+    from moto import mock_aws # moto 5
+except ImportError:
+    from moto import mock_s3 as mock_aws
+
+from lib.aws_tools.s3_handler import S3Handler
+
+
+BUCKET_NAME = 'test-bucket'
+
+
+def make_s3_handler() -> S3Handler:
+    boto3.client('s3', region_name='us-west-2', aws_access_key_id='testing', aws_secret_access_key='testing') \
+        .create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+    return S3Handler(bucket_name=BUCKET_NAME, aws_access_key_id='testing', aws_secret_access_key='testing')
+
+
+def write_temp_file(content:bytes) -> str:
+    file_descriptor, filepath = tempfile.mkstemp(suffix='.pdf')
+    with os.fdopen(file_descriptor, 'wb') as temp_file:
+        temp_file.write(content)
+    return filepath
+
+
+def test_upload_file() -> None:
+    with mock_aws():
+        s3_handler = make_s3_handler()
+        filepath = write_temp_file(b'%PDF-1.5 first')
+        try:
+            assert s3_handler.upload_file(filepath, 'u/a/b.pdf', cache_time=60)
+            assert not s3_handler.upload_file(filepath, 'u/a/b.pdf', cache_time=60) # Same ETag (MD5) and cache time
+            assert s3_handler.upload_file(filepath, 'u/a/b.pdf', cache_time=60, immutable=True) # New cache time
+            assert s3_handler.get_object_head('u/a/b.pdf')['CacheControl'] == 'max-age=60, immutable'
+            with open(filepath, 'wb') as changed_file:
+                changed_file.write(b'%PDF-1.5 second')
+            assert s3_handler.upload_file(filepath, 'u/a/b.pdf', cache_time=60, immutable=True) # New contents
+        finally:
+            os.remove(filepath)
+        assert s3_handler.get_object_head('u/a/missing.pdf') is None
+
+
+def test_copy_file() -> None:
+    with mock_aws():
+        s3_handler = make_s3_handler()
+        filepath = write_temp_file(b'%PDF-1.5 first')
+        try:
+            s3_handler.upload_file(filepath, 'u/a/0123/b.pdf', cache_time=31536000, immutable=True)
+            assert s3_handler.copy_file('u/a/0123/b.pdf', 'u/a/b.pdf')
+            assert not s3_handler.copy_file('u/a/0123/b.pdf', 'u/a/b.pdf') # Same ETag and cache time
+            copied_object = s3_handler.get_object_head('u/a/b.pdf')
+            assert copied_object['CacheControl'] == 'max-age=600'
+            assert copied_object['ContentType'] == 'application/pdf'
+            with open(filepath, 'wb') as changed_file:
+                changed_file.write(b'%PDF-1.5 second')
+            s3_handler.upload_file(filepath, 'u/a/4567/b.pdf', cache_time=31536000, immutable=True)
+            assert s3_handler.copy_file('u/a/4567/b.pdf', 'u/a/b.pdf') # New contents
+        finally:
+            os.remove(filepath)
+
+
+
+if __name__ == '__main__':
+    test_upload_file()
+    test_copy_file()
+    print("S3 handler tests passed.")
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+# Local test of finding the story (chapter) page numbers in a ConTeXt .tuc file
+#   so it doesn't need ConTeXt (or qpdf)
+
+import os
+import tempfile
+
+from lib.story_pdfs import get_chapter_page_ranges, get_lua_table_span
+
+
+# Cut down from a real .tuc file: the chapter starts are the collected references (keyed by name)
+#   and the chapter ends are \pagereference's in the lists (where the name is a value inside the table)
+TUC_TEXT = '''return {
+ ["structures"]={
+  ["references"]={
+   ["collected"]={
+    [""]={
+     ["obs-chapter-01"]={
+      ["references"]={ ["internal"]=3, ["realpage"]=3, ["x"]=1 },
+      ["entries"]={ ["text"]="1. The Creation" },
+     },
+     ["obs-chapter-02"]={
+      ["references"]={ ["internal"]=7, ["realpage"]=6 },
+     },
+     ["obs-chapter-03"]={
+      ["references"]={ ["internal"]=11, ["realpage"]=9 },
+     },
+    },
+   },
+  },
+  ["lists"]={
+   ["collected"]={
+    {
+     ["metadata"]={ ["kind"]="pagereference" },
+     ["references"]={ ["realpage"]=5, ["reference"]="obs-chapter-01-end" },
+    },
+    {
+     ["references"]={ ["reference"]="obs-chapter-02-end", ["realpage"]=8 },
+    },
+   },
+  },
+ },
+}
+'''
+
+
+def write_tuc_file(tuc_text:str) -> str:
+    file_descriptor, tuc_filepath = tempfile.mkstemp(suffix='.tuc')
+    with os.fdopen(file_descriptor, 'wt', encoding='utf-8') as tuc_file:
+        tuc_file.write(tuc_text)
+    return tuc_filepath
+
+
+def test_lua_table_span() -> None:
+    lua_text = '{ ["a"]={ ["b"]={ 1 }, ["c"]=2 }, ["d"]=3 }'
+    table_start = lua_text.index('{', 1)
+    assert get_lua_table_span(lua_text, table_start, is_table_start=True) == (table_start, lua_text.index(', ["d"]'))
+    # From inside the table, the inner tables before the index are skipped over
+    assert get_lua_table_span(lua_text, lua_text.index('["c"]'), is_table_start=False) \
+            == (table_start, lua_text.index(', ["d"]'))
+    assert get_lua_table_span('{ ["a"]={ 1', 0, is_table_start=True) == (0, len('{ ["a"]={ 1')) # Unclosed
+
+
+def test_chapter_page_ranges() -> None:
+    tuc_filepath = write_tuc_file(TUC_TEXT)
+    try:
+        page_ranges = get_chapter_page_ranges(tuc_filepath)
+    finally:
+        os.remove(tuc_filepath)
+    # Chapter 3 has no end reference so it's left out
+    assert page_ranges == {'01': (3, 5), '02': (6, 8)}
+
+
+def test_missing_tuc_file() -> None:
+    assert get_chapter_page_ranges('/nonexistent/obs.tuc') == {}
+    tuc_filepath = write_tuc_file('return {}')
+    try:
+        assert get_chapter_page_ranges(tuc_filepath) == {}
+    finally:
+        os.remove(tuc_filepath)
+
+
+
+if __name__ == '__main__':
+    test_lua_table_span()
+    test_chapter_page_ranges()
+    test_missing_tuc_file()
+    print("Story PDF tests passed.")
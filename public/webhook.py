@@ -7,45 +7,54 @@
 #       job() function (at bottom here) is executed by rq package when there is an available entry in the named queue.
 
 # Python imports
-from typing import Dict, Tuple, Any, Optional
+from typing import Callable, Dict, Tuple, Any, Optional, Union, TYPE_CHECKING
 import os
 import tempfile
 import shutil
-import json
+from copy import deepcopy
 from datetime import datetime, timedelta, date
 from time import time
 import sys
 import traceback
 import logging
-from urllib.error import HTTPError
 
 # Library (PyPi) imports
+from redis import Redis
 from rq import get_current_job, Queue
 from statsd import StatsClient # Graphite front-end
-from boto3 import Session # AWS S3 handler
-from watchtower import CloudWatchLogHandler # AWS CloudWatch log handler
 
 # Local imports
-from rq_settings import prefix, debug_mode_flag, webhook_queue_name
-from lib.aws_tools.s3_handler import S3Handler
+from rq_settings import prefix, debug_mode_flag, webhook_queue_name, coalesce_quiet_seconds
+from lib.build_log import MY_NAME, MY_VERSION_STRING, MY_NAME_VERSION_STRING, load_build_log, save_build_log, \
+                            get_build_fingerprint, get_reusable_build
 from lib.general_tools.app_utils import get_output_dir
-from lib.general_tools.file_utils import read_file, empty_folder, write_file
-from lib.general_tools.url_utils import get_url
+from lib.general_tools.file_utils import read_file, empty_folder
+from lib.build_checkpoints import expire_stale_checkpoints
+from lib.log_shipping import LogShipper, LogForwarder, CloudWatchLogSink, LogShippingHandler
+from lib.context_runner import BuildCancelledError
+from lib.queue_tools.build_status import load_build_status, save_build_status
+from lib.queue_tools.job_coalescer import defer_until_quiet, find_superseding_job, make_cancel_check
+from lib.queue_tools.job_progress import JobProgressSaver
+from lib.queue_tools.queue_metrics import QueueMetrics, get_wait_seconds, send_queue_metrics
 from lib.pdf_from_dcs import PdfFromDcs
+from lib.pdf_variants import get_pdf_variants
+
+if TYPE_CHECKING:
+    from lib.aws_tools.s3_handler import S3Handler
 
 
-# The following will be recording in the build log (JSON) file
-MY_NAME = 'ConTeXt OBS PDF creator'
-MY_VERSION_STRING = '1.02' # Mostly to determine PDF fixes
-MY_NAME_VERSION_STRING = f"{MY_NAME} v{MY_VERSION_STRING}"
-CDN_BUCKET_NAME = 'cdn.door43.org'
 AWS_REGION_NAME = 'us-west-2'
+MAX_SKIPPED_LOG_ENTRIES = 10
+MAX_REUSED_LOG_ENTRIES = 10
+MAX_PREFLIGHT_LOG_WARNINGS = 50
+LOG_FLUSH_TIMEOUT_SECONDS = 10
 
 
 if prefix not in ('', 'dev-'):
     logging.critical(f"Unexpected prefix: {prefix!r} -- expected '' or 'dev-'")
 tx_stats_prefix = f"tx.{'dev' if prefix else 'prod'}"
 job_handler_stats_prefix = f"{tx_stats_prefix}.job-handler"
+queue_stats_prefix = f"{tx_stats_prefix}.enqueue-job.queue.OBSPDF"
 
 
 # Credentials -- get the secret ones from environment variables
@@ -62,36 +71,144 @@ log_group_name = f"{'' if test_mode_flag or travis_flag else prefix}tX" \
 
 # Setup logging
 logger = logging.getLogger(job_handler_stats_prefix)
-boto3_session = Session(aws_access_key_id=aws_access_key_id,
-                    aws_secret_access_key=aws_secret_access_key,
-                    region_name=AWS_REGION_NAME)
-main_watchtower_log_handler = CloudWatchLogHandler(boto3_session=boto3_session,
-                                            # use_queues=False, # Because this forked process is quite transient
-                                            log_group=log_group_name,
-                                            stream_name='tX-PDF-Job-Handler')
-logger.addHandler(main_watchtower_log_handler)
 logger.setLevel(logging.DEBUG if debug_mode_flag else logging.INFO)
 # Change these loggers to only report errors:
 logging.getLogger('boto3').setLevel(logging.ERROR)
 logging.getLogger('botocore').setLevel(logging.ERROR)
-logger.debug(f"Logging to AWS CloudWatch group '{log_group_name}' using key '…{aws_access_key_id[-2:]}'.")
+# Our log messages are sent to AWS CloudWatch in the background by a LogShipper
+#   which is made when the first job starts -- unless the preloading worker (obs_worker.py)
+#   has already set a LogForwarder to pass them on to its own (long-lived) shipper
+log_shipper:Optional[Union[LogShipper,LogForwarder]] = None
+main_log_handler:Optional[logging.Handler] = None
 
 
 # Get the Graphite URL from the environment, otherwise use a local test instance
 graphite_url = os.getenv('GRAPHITE_HOSTNAME', 'localhost')
 stats_client = StatsClient(host=graphite_url, port=8125)
 
+# These are set by the preloading worker (obs_worker.py) before it forks the jobs
+#   else each build makes its own
+cdn_s3_handler:Optional['S3Handler'] = None
+catalog:Optional[dict] = None
+
+
+
+def get_log_shipper() -> Union[LogShipper,LogForwarder]:
+    global log_shipper
+    if log_shipper is None:
+        log_shipper = LogShipper(CloudWatchLogSink(aws_access_key_id, aws_secret_access_key, AWS_REGION_NAME))
+    return log_shipper
+# end of get_log_shipper function
+
+
+def get_main_log_handler() -> logging.Handler:
+    """
+    Returns the AWS CloudWatch log handler for our logger
+        (making it the first time).
+    """
+    global main_log_handler
+    if main_log_handler is None:
+        main_log_handler = LogShippingHandler(get_log_shipper(), log_group_name, 'tX-PDF-Job-Handler')
+        logger.addHandler(main_log_handler)
+        logger.debug(f"Logging to AWS CloudWatch group '{log_group_name}' using key '…{aws_access_key_id[-2:]}'.")
+    return main_log_handler
+# end of get_main_log_handler function
+
+
+def flush_logs() -> None:
+    """
+    Makes sure that the job's log messages get sent before the (forked) job process exits.
+
+    Doesn't wait at all if they're being forwarded to the preloading worker.
+    """
+    if not get_log_shipper().flush(timeout=LOG_FLUSH_TIMEOUT_SECONDS):
+        print(f"Gave up waiting for the log messages to be sent after {LOG_FLUSH_TIMEOUT_SECONDS}s", file=sys.stderr)
+# end of flush_logs function
+
+
+def start_queue_metrics(queue:Queue, current_job:Any) -> Optional[QueueMetrics]:
+    """
+    Sends how long the job waited in the queue, records its start,
+        and sends the queue throughput and saturation figures (including the recommended number of workers).
+
+    Returns the QueueMetrics for end_queue_metrics() (or None if Redis let us down).
+    """
+    wait_seconds = get_wait_seconds(current_job)
+    if wait_seconds is not None:
+        stats_client.timing(f'{queue_stats_prefix}.wait', round(wait_seconds * 1000))
+    try:
+        queue_metrics = QueueMetrics(queue)
+        queue_metrics.record_job_start(current_job)
+        summary = queue_metrics.get_summary()
+    except Exception as e: # The build can still go ahead
+        logger.error(f"Unable to update the queue metrics: {e}")
+        return None
+    send_queue_metrics(stats_client, queue_stats_prefix, summary)
+    logger.info(f"Queue metrics (waited {wait_seconds}s): {summary}")
+    return queue_metrics
+# end of start_queue_metrics function
+
+
+def end_queue_metrics(queue_metrics:Optional[QueueMetrics], current_job:Any, start_time:float) -> None:
+    """
+    Records how long the job took (for the recent build durations).
+
+    Only called for jobs that ran ConTeXt
+        (so the quick superseded, cancelled, reused and preflight-failed jobs don't skew the figures).
+    """
+    if queue_metrics is None:
+        return
+    try:
+        queue_metrics.record_job_end(current_job, time() - start_time)
+    except Exception as e:
+        logger.error(f"Unable to update the queue metrics: {e}")
+# end of end_queue_metrics function
+
+
+def find_reusable_build(prefix:str, repo_owner_username:str, repo_name:str, tag_or_branch_name:str,
+                        commit_hash:str, build_fingerprint:str,
+                        redis_connection:Optional[Redis]=None) -> Tuple[Optional[Dict[str,Any]],Dict[str,Any]]:
+    """
+    Looks for a successful build of the same commit with the same options, variants and PDF creator version
+        (in the Redis build status first, then in the JSON build log).
 
-def process_PDF_job(prefix:str, payload:Dict[str,Any]) -> str:
+    Returns the build log entry (or None) and the JSON build log
+        (or an empty dict if the Redis build status says there's nothing to reuse).
+    """
+    if redis_connection is not None:
+        build_status = load_build_status(redis_connection, prefix, repo_owner_username, repo_name, tag_or_branch_name)
+        if build_status is not None \
+        and not get_reusable_build({tag_or_branch_name: build_status}, tag_or_branch_name, commit_hash, build_fingerprint):
+            return None, {} # It's for a different commit (or options), so don't bother fetching the log
+    PDF_log_dict = load_build_log(prefix, repo_owner_username, repo_name)
+    return get_reusable_build(PDF_log_dict, tag_or_branch_name, commit_hash, build_fingerprint), PDF_log_dict
+# end of find_reusable_build function
+
+
+def process_PDF_job(prefix:str, payload:Dict[str,Any], cancel_check:Optional[Callable[[],bool]]=None,
+                        progress_callback:Optional[Callable[[Dict[str,Any]],None]]=None,
+                        redis_connection:Optional[Redis]=None) -> Tuple[str,bool,Dict[str,Any]]:
     """
     prefix may be '' or 'dev-'.
     payload is the dict passed to tX Enqueue Job as JSON.
+    cancel_check (if given) is called while ConTeXt is running
+        and returns True if the build has been superseded by a newer one.
+    progress_callback (if given) is passed on to PdfFromDcs.
+    redis_connection (if given) keeps a fast copy of the last successful build (see lib/queue_tools/build_status.py).
+
+    If the commit hash is given and the JSON build log already has a successful PDF
+        for that commit (with the same options, variants and PDF creator version),
+        nothing is downloaded or built: the existing PDF is recorded as 'reused' instead.
 
     Expects an identifier in the payload of one of the two following forms:
         '<repo_owner_username>--<repo_name>--<tag_name>', or
         '<repo_owner_username>--<repo_name>--<branch_name>--commit_hash'.
 
-    Returns a job description obtained from the payload.
+    The payload can also have a list of 'variants' of the PDF to make (see lib/pdf_variants.py).
+
+    Returns a job description obtained from the payload,
+        whether ConTeXt was run (i.e., the PDF wasn't reused, cancelled, stopped by the preflight check
+        or resumed from a checkpoint), and the job result (see get_job_result()).
     """
     logger.debug(f"process_PDF_job( {prefix}, {payload} ) {' (in debug mode)' if debug_mode_flag else ''}")
     assert payload['input_format'] == 'md'
@@ -110,46 +227,105 @@ def process_PDF_job(prefix:str, payload:Dict[str,Any]) -> str:
 
     optionsDict:Dict[str,str] = payload['options'] if 'options' in payload else {}
 
-    # See if a JSON log file already exists
-    base_download_url = f'https://s3-us-west-2.amazonaws.com/{prefix}cdn.door43.org'
-    repo_part = f'u/{repo_owner_username}/{repo_name}'
-    filename_part = 'PDF_details.json'
-    json_url = f'{base_download_url}/{repo_part}/{filename_part}'
-    logger.info(f"Checking for JSON build log at {json_url}…")
+    PDF_log_dict = None
+    build_fingerprint = None
     try:
-        PDF_log_dict = json.loads(get_url(json_url))
-    except HTTPError as e:
-        logger.info(f"No existing build log to read: {e}")
-        PDF_log_dict = {}
-    except Exception as e:
-        logger.error()
-        PDF_log_dict = {f"Error when trying to read build log: {e}"}
+        build_fingerprint = get_build_fingerprint(optionsDict, get_pdf_variants(payload.get('variants')))
+    except ValueError: # PdfFromDcs reports it below
+        pass
+    if len(parameters) == 4 and build_fingerprint is not None:
+        reusable_build, PDF_log_dict = find_reusable_build(prefix, repo_owner_username, repo_name, tag_or_branch_name,
+                                                    parameters[3], build_fingerprint, redis_connection)
+        if reusable_build is not None:
+            logger.info(f"Reusing the PDF already made for {description}: {reusable_build['PDF_url']}")
+            stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.reused')
+            reused_list = reusable_build.get('reused', [])
+            reused_list.append({'identifier': description,
+                                'reused_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')})
+            reusable_build['reused'] = reused_list[-MAX_REUSED_LOG_ENTRIES:]
+            save_build_log(prefix, repo_owner_username, repo_name, PDF_log_dict, aws_access_key_id, aws_secret_access_key)
+            if redis_connection is not None:
+                save_build_status(redis_connection, prefix, repo_owner_username, repo_name, tag_or_branch_name,
+                                  reusable_build)
+            return description, False, get_job_result(reusable_build, "Reused the PDF already made for this commit")
+
+    # See if a JSON log file already exists
+    if not PDF_log_dict:
+        PDF_log_dict = load_build_log(prefix, repo_owner_username, repo_name)
     logger.info(f"Got previous build log = {PDF_log_dict}")
 
     if tag_or_branch_name not in PDF_log_dict: PDF_log_dict[tag_or_branch_name] = {}
+    previous_entry = deepcopy(PDF_log_dict[tag_or_branch_name]) # Kept if this build gets cancelled
     PDF_log_dict[tag_or_branch_name]['PDF_creator'] = MY_NAME
     PDF_log_dict[tag_or_branch_name]['PDF_creator_version'] = MY_VERSION_STRING
     PDF_log_dict[tag_or_branch_name]['source_url'] = payload['source']
     if optionsDict: PDF_log_dict[tag_or_branch_name]['options'] = payload['options']
 
     logger.info(f"Calling v{MY_VERSION_STRING} PdfFromDcs('{prefix}', 'username_repoName_spec', {parameters}, {optionsDict})…")
+    build_checkpoints = None
+    log_dirpath = get_output_dir() # Where ConTeXt's output goes
+    was_typeset = was_cancelled = False
     try:
-        with PdfFromDcs(prefix, parameter_type='username_repoName_spec', parameter=parameters, options=optionsDict) as f:
-            upload_URL = f.run()
-            logger.info(f"PDF made and uploaded to {upload_URL}")
-            # Update JSON log file
-            PDF_log_dict[tag_or_branch_name]['status'] = 'success'
-            PDF_log_dict[tag_or_branch_name]['PDF_url'] = upload_URL
-            PDF_log_dict[tag_or_branch_name]['message'] = "PDF made and uploaded"
-            if len(parameters) == 4:
-                PDF_log_dict[tag_or_branch_name]['commit_hash'] = parameters[3]
-
-    except ChildProcessError:
+        with PdfFromDcs(prefix, parameter_type='username_repoName_spec', parameter=parameters, options=optionsDict,
+                        cancel_check=cancel_check, progress_callback=progress_callback,
+                        cdn_s3_handler=cdn_s3_handler, checkpoint_key=payload['identifier'],
+                        variants=payload.get('variants')) as f:
+            build_checkpoints = f.checkpoints
+            log_dirpath = f.log_dirpath
+            # Reject broken repos before they tie up ConTeXt for minutes
+            preflight_errors = f.preflight()
+            if f.preflight_warnings:
+                PDF_log_dict[tag_or_branch_name]['preflight_warnings'] = f.preflight_warnings[:MAX_PREFLIGHT_LOG_WARNINGS]
+            else:
+                PDF_log_dict[tag_or_branch_name].pop('preflight_warnings', None)
+            if preflight_errors:
+                logger.error(f"Preflight check found {len(preflight_errors)} problem(s): {preflight_errors[:10]}")
+                PDF_log_dict[tag_or_branch_name]['status'] = 'error'
+                PDF_log_dict[tag_or_branch_name]['message'] = f"Preflight check found {len(preflight_errors)} problem(s) so no PDF was built"
+                PDF_log_dict[tag_or_branch_name]['preflight_errors'] = preflight_errors
+            else:
+                upload_URL = f.run()
+                if not upload_URL or not upload_URL.startswith('https://'):
+                    # run() returns the error text if the build or upload failed
+                    raise Exception(f"No PDF was uploaded: {upload_URL}")
+                logger.info(f"PDF made and uploaded to {upload_URL}")
+                # Update JSON log file
+                PDF_log_dict[tag_or_branch_name]['status'] = 'success'
+                PDF_log_dict[tag_or_branch_name]['PDF_url'] = upload_URL
+                PDF_log_dict[tag_or_branch_name]['message'] = "PDF made and uploaded"
+                if f.pdf_optimization is not None:
+                    PDF_log_dict[tag_or_branch_name]['PDF_optimization'] = f.pdf_optimization
+                if 'variants' in payload:
+                    PDF_log_dict[tag_or_branch_name]['PDF_variants'] = f.pdf_variants
+                if f.story_pdfs_url is not None:
+                    PDF_log_dict[tag_or_branch_name]['PDF_stories_url'] = f.story_pdfs_url
+                if f.pdf_pointer_url is not None:
+                    PDF_log_dict[tag_or_branch_name]['PDF_pointer_url'] = f.pdf_pointer_url
+                PDF_log_dict[tag_or_branch_name].pop('preflight_errors', None)
+                if len(parameters) == 4:
+                    PDF_log_dict[tag_or_branch_name]['commit_hash'] = parameters[3]
+                else: # Don't leave the one from an older build
+                    PDF_log_dict[tag_or_branch_name].pop('commit_hash', None)
+                PDF_log_dict[tag_or_branch_name]['build_fingerprint'] = f.build_fingerprint
+                was_typeset = f.was_typeset
+
+    except BuildCancelledError as e:
+        logger.info(f"PDF build for {description} was cancelled: {e}")
+        stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.superseded')
+        # The status and message still describe the last build that finished
+        PDF_log_dict[tag_or_branch_name] = previous_entry
+        PDF_log_dict[tag_or_branch_name]['superseded'] = {'identifier': description,
+                    'message': "Build cancelled because a newer commit was queued",
+                    'superseded_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+        was_cancelled = True
+
+    except ChildProcessError as e:
         logger.critical(f"ConTeXt went wrong: {e}")
+        was_typeset = True
         err_text = 'AN ERROR OCCURRED GENERATING THE PDF\r\n\r\n'
-        err_text += read_file(os.path.join(get_output_dir(), 'context.err'))
+        err_text += read_file(os.path.join(log_dirpath, 'context.err'))
         err_text += '\r\n\r\n\r\nFULL ConTeXt OUTPUT\r\n\r\n'
-        err_text += read_file(os.path.join(get_output_dir(), 'context.out'))
+        err_text += read_file(os.path.join(log_dirpath, 'context.out'))
         logger.critical(err_text)
         PDF_log_dict[tag_or_branch_name]['status'] = 'error'
         PDF_log_dict[tag_or_branch_name]['message'] = "Error within ConTeXt PDF build system"
@@ -160,31 +336,63 @@ def process_PDF_job(prefix:str, payload:Dict[str,Any]) -> str:
         PDF_log_dict[tag_or_branch_name]['message'] = str(e)
 
     # Save (new/updated) JSON log file
-    PDF_log_dict[tag_or_branch_name]['processed_at'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    if not was_cancelled:
+        PDF_log_dict[tag_or_branch_name].pop('superseded', None)
+        PDF_log_dict[tag_or_branch_name]['processed_at'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
     logger.info(f"Final build log = {PDF_log_dict}")
-    log_filepath = f'/tmp/{filename_part}'
-    write_file(log_filepath, PDF_log_dict)
-    logger.info(f"Saving JSON build log to {json_url} …")
-    cdn_s3_handler = S3Handler(bucket_name=f'{prefix}{CDN_BUCKET_NAME}',
-                                aws_access_key_id=aws_access_key_id,
-                                aws_secret_access_key=aws_secret_access_key,
-                                aws_region_name=AWS_REGION_NAME)
-    s3_commit_key = f'{repo_part}/{filename_part}'
-    cdn_s3_handler.upload_file(log_filepath, s3_commit_key, cache_time=2)
-
-    return description
+    save_build_log(prefix, repo_owner_username, repo_name, PDF_log_dict, aws_access_key_id, aws_secret_access_key)
+    if redis_connection is not None: # Only kept after a success
+        save_build_status(redis_connection, prefix, repo_owner_username, repo_name, tag_or_branch_name,
+                          PDF_log_dict[tag_or_branch_name])
+    # Keep the checkpoints after an error so that a requeued job can resume (they expire anyway)
+    if build_checkpoints is not None and (was_cancelled or PDF_log_dict[tag_or_branch_name]['status'] == 'success'):
+        build_checkpoints.clear()
+
+    if was_cancelled:
+        return description, was_typeset, {'status': 'superseded', 'PDF_url': None,
+                                          'message': PDF_log_dict[tag_or_branch_name]['superseded']['message']}
+    return description, was_typeset, get_job_result(PDF_log_dict[tag_or_branch_name])
 # end of process_PDF_job function
 
 
-def job(queued_json_payload:Dict[str,Any]) -> None:
+def get_job_result(entry:Dict[str,Any], message:Optional[str]=None) -> Dict[str,Any]:
+    """
+    Returns the parts of the build log entry that rq saves as the job result
+        (so that the Flask front end's /status/<job_id> can report them).
+    """
+    return {'status': entry.get('status'), 'PDF_url': entry.get('PDF_url'),
+            'message': entry.get('message') if message is None else message}
+
+
+def record_skipped_job(prefix:str, payload:Dict[str,Any], reason:str) -> None:
+    """
+    Adds an entry for a job that didn't need building to the JSON build log.
+    """
+    repo_owner_username, repo_name, tag_or_branch_name = payload['identifier'].split('--')[:3]
+    PDF_log_dict = load_build_log(prefix, repo_owner_username, repo_name)
+    if tag_or_branch_name not in PDF_log_dict: PDF_log_dict[tag_or_branch_name] = {}
+    skipped_list = PDF_log_dict[tag_or_branch_name].get('skipped', [])
+    skipped_list.append({'identifier': payload['identifier'],
+                         'reason': reason,
+                         'skipped_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')})
+    PDF_log_dict[tag_or_branch_name]['skipped'] = skipped_list[-MAX_SKIPPED_LOG_ENTRIES:]
+    save_build_log(prefix, repo_owner_username, repo_name, PDF_log_dict, aws_access_key_id, aws_secret_access_key)
+# end of record_skipped_job function
+
+
+def job(queued_json_payload:Dict[str,Any]) -> Dict[str,Any]:
     """
     This function is called by the rq package to process a job in the queue(s).
         (Don't rename this function.)
 
+    Returns the job result (which rq saves): the 'status', 'PDF_url' and 'message' from the build log entry
+        (or a 'deferred' or 'superseded' status if it wasn't built).
+
     The job is removed from the queue before the job is started,
         but if the job throws an exception or times out (timeout specified in enqueue process)
             then the job gets added to the 'failed' queue.
     """
+    get_main_log_handler()
     logger.info(MY_NAME_VERSION_STRING)
     logger.debug("tX PDF JobHandler received a job" + (" (in debug mode)" if debug_mode_flag else ""))
     start_time = time()
@@ -192,45 +400,67 @@ def job(queued_json_payload:Dict[str,Any]) -> None:
 
     logger.info(f"Clearing /tmp folder…")
     empty_folder('/tmp/', only_prefix='tX_') # Stops failed jobs from accumulating in /tmp
+    num_expired_checkpoints = expire_stale_checkpoints()
+    if num_expired_checkpoints:
+        logger.info(f"Removed {num_expired_checkpoints} stale build checkpoint(s)")
 
     # logger.info(f"Updating queue statistics…")
-    our_queue= Queue(webhook_queue_name, connection=get_current_job().connection)
+    current_job = get_current_job()
+    our_queue= Queue(webhook_queue_name, connection=current_job.connection)
+
+    # Start again later if this branch might still be getting a burst of pushes
+    deferred_job = defer_until_quiet(our_queue, queued_json_payload, current_job, coalesce_quiet_seconds)
+    if deferred_job is not None:
+        logger.info(f"Deferring {queued_json_payload['identifier']} to job {deferred_job.id} until the branch has been quiet for {coalesce_quiet_seconds}s")
+        stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.deferred')
+        flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
+        return {'status': 'deferred', 'PDF_url': None, 'message': f"Deferred to job {deferred_job.id}",
+                'deferred_job_id': deferred_job.id}
+
     len_our_queue = len(our_queue) # Should normally sit at zero here
     # logger.debug(f"Queue '{webhook_queue_name}' length={len_our_queue}")
-    stats_client.gauge(f'{tx_stats_prefix}.enqueue-job.queue.OBSPDF.length.current', len_our_queue)
-    logger.info(f"Updated stats for '{tx_stats_prefix}.enqueue-job.queue.OBSPDF.length.current' to {len_our_queue}")
+    stats_client.gauge(f'{queue_stats_prefix}.length.current', len_our_queue)
+    logger.info(f"Updated stats for '{queue_stats_prefix}.length.current' to {len_our_queue}")
+    queue_metrics = start_queue_metrics(our_queue, current_job)
 
     # Save some stats
     stats_client.incr(f"{job_handler_stats_prefix}.jobs.OBSPDF.input.{queued_json_payload['input_format']}")
     stats_client.incr(f"{job_handler_stats_prefix}.jobs.OBSPDF.subject.{queued_json_payload['resource_type']}")
 
+    # No need to build this one if a newer job for the same branch is waiting behind it
+    superseding_job = find_superseding_job(our_queue, queued_json_payload, current_job)
+    if superseding_job is not None:
+        logger.info(f"Skipping {queued_json_payload['identifier']} because it's superseded by queued job {superseding_job.id}")
+        stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.superseded')
+        record_skipped_job(prefix, queued_json_payload, f"Superseded by queued {superseding_job.args[0]['identifier']}")
+        flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
+        return {'status': 'superseded', 'PDF_url': None, 'message': f"Superseded by queued job {superseding_job.id}",
+                'superseding_job_id': superseding_job.id}
+
     try:
-        job_descriptive_name = process_PDF_job(prefix, queued_json_payload)
+        job_descriptive_name, was_typeset, job_result = process_PDF_job(prefix, queued_json_payload,
+                                    cancel_check=make_cancel_check(our_queue, queued_json_payload, current_job),
+                                    progress_callback=JobProgressSaver(current_job),
+                                    redis_connection=current_job.connection)
     except Exception as e:
         # Catch most exceptions here so we can log them to CloudWatch
         prefixed_name = f"{prefix}tX_PDF_Job_Handler"
         logger.critical(f"{prefixed_name} threw an exception while processing: {queued_json_payload}")
         logger.critical(f"{e}: {traceback.format_exc()}")
-        main_watchtower_log_handler.close() # Ensure queued logs are uploaded to AWS CloudWatch
-        # Now attempt to log it to an additional, separate FAILED log
+        # Now attempt to log it to an additional, separate FAILED log (via the same shipper)
         logger2 = logging.getLogger(prefixed_name)
         log_group_name = f"FAILED_{'' if test_mode_flag or travis_flag else prefix}tX" \
                          f"{'_DEBUG' if debug_mode_flag else ''}" \
                          f"{'_TEST' if test_mode_flag else ''}" \
                          f"{'_TravisCI' if travis_flag else ''}"
-        boto3_session = Session(aws_access_key_id=aws_access_key_id,
-                            aws_secret_access_key=aws_secret_access_key,
-                            region_name='us-west-2')
-        failure_watchtower_log_handler = CloudWatchLogHandler(boto3_session=boto3_session,
-                                                    use_queues=False,
-                                                    log_group=log_group_name,
-                                                    stream_name=prefixed_name)
-        logger2.addHandler(failure_watchtower_log_handler)
+        failure_log_handler = LogShippingHandler(get_log_shipper(), log_group_name, prefixed_name)
+        logger2.addHandler(failure_log_handler)
         logger2.setLevel(logging.DEBUG)
         logger2.info(f"Logging to AWS CloudWatch group '{log_group_name}' using key '…{aws_access_key_id[-2:]}'.")
         logger2.critical(f"{prefixed_name} threw an exception while processing: {queued_json_payload}")
         logger2.critical(f"{e}: {traceback.format_exc()}")
-        failure_watchtower_log_handler.close()
+        logger2.removeHandler(failure_log_handler)
+        flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
         raise e # We raise the exception again so it goes into the failed queue
 
     elapsed_milliseconds = round((time() - start_time) * 1000)
@@ -241,7 +471,85 @@ def job(queued_json_payload:Dict[str,Any]) -> None:
         logger.info(f"{prefix}tX job handling for {job_descriptive_name} PDF completed in {round(time() - start_time)} seconds.")
 
     stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.completed')
-    main_watchtower_log_handler.close() # Ensure queued logs are uploaded to AWS CloudWatch
+    if was_typeset:
+        end_queue_metrics(queue_metrics, current_job, start_time)
+    flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
+    return job_result
 # end of job function
 
+
+def catalog_job(queued_json_payload:Dict[str,Any]) -> Optional[str]:
+    """
+    This function is called by the rq package for jobs enqueued by the Flask front end
+        for a Door43 Catalog language code (which aren't tied to one repo's build log).
+
+    Returns the URL of the uploaded PDF (which rq saves as the job result)
+        or None if the build was cancelled because it was superseded.
+    """
+    return run_unlogged_job(queued_json_payload, 'Catalog_lang_code', queued_json_payload['lang_code'],
+                            f"catalog '{queued_json_payload['lang_code']}'")
+# end of catalog_job function
+
+
+def door43_repo_job(queued_json_payload:Dict[str,Any]) -> Optional[str]:
+    """
+    This function is called by the rq package for jobs enqueued by the Flask front end
+        for a Door43 'username/repo' (which, as before, gets its master branch built
+        into the old auto_PDFs CDN folder rather than logged in the repo's build log).
+
+    Returns the URL of the uploaded PDF (which rq saves as the job result)
+        or None if the build was cancelled because it was superseded.
+    """
+    return run_unlogged_job(queued_json_payload, 'Door43_repo', queued_json_payload['Door43_repo'],
+                            f"Door43 repo '{queued_json_payload['Door43_repo']}'")
+# end of door43_repo_job function
+
+
+def run_unlogged_job(queued_json_payload:Dict[str,Any], parameter_type:str, parameter:str,
+                        description:str) -> Optional[str]:
+    """
+    Builds and uploads the PDF for catalog_job() or door43_repo_job() above.
+    """
+    get_main_log_handler()
+    logger.info(MY_NAME_VERSION_STRING)
+    logger.info(f"tX PDF JobHandler received a job for {description}")
+    start_time = time()
+    stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.attempted')
+
+    current_job = get_current_job()
+    our_queue= Queue(webhook_queue_name, connection=current_job.connection)
+    queue_metrics = start_queue_metrics(our_queue, current_job)
+    try:
+        with PdfFromDcs(prefix, parameter_type=parameter_type, parameter=parameter,
+                        cancel_check=make_cancel_check(our_queue, queued_json_payload, current_job),
+                        progress_callback=JobProgressSaver(current_job), catalog=catalog,
+                        cdn_s3_handler=cdn_s3_handler, checkpoint_key=queued_json_payload['identifier']) as f:
+            upload_URL = f.run()
+            if not upload_URL or not upload_URL.startswith('https://'):
+                raise Exception(f"No PDF was uploaded: {upload_URL}")
+            if f.checkpoints is not None:
+                f.checkpoints.clear()
+            was_typeset = f.was_typeset
+    except BuildCancelledError as e:
+        logger.info(f"PDF build for {description} was cancelled: {e}")
+        stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.superseded')
+        flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
+        return None
+    except Exception as e:
+        logger.critical(f"{prefix}tX_PDF_Job_Handler threw an exception while processing: {queued_json_payload}")
+        logger.critical(f"{e}: {traceback.format_exc()}")
+        if isinstance(e, ChildProcessError): # ConTeXt was run
+            end_queue_metrics(queue_metrics, current_job, start_time)
+        flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
+        raise e # We raise the exception again so it goes into the failed queue
+
+    stats_client.timing(f'{job_handler_stats_prefix}.job.OBSPDF.duration', round((time() - start_time) * 1000))
+    logger.info(f"{prefix}tX job handling for {description} PDF completed in {round(time() - start_time)} seconds: {upload_URL}")
+    stats_client.incr(f'{job_handler_stats_prefix}.jobs.OBSPDF.completed')
+    if was_typeset:
+        end_queue_metrics(queue_metrics, current_job, start_time)
+    flush_logs() # Ensure queued logs are uploaded to AWS CloudWatch
+    return upload_URL
+# end of run_unlogged_job function
+
 # end of webhook.py for tX OBS PDF Job Handler
@@ -4,4 +4,11 @@ set -e
 # Start the Rq worker
 cd /app/obs-pdf/public
 #rq worker --config rq_settings --name tX_Dev_HTML_Job_Handler
-rq worker --config rq_settings
+# The worker exits with 75 when it wants to be replaced by a fresh one
+#   (see obs_worker.py) -- anything else ends the container as before
+while true; do
+    status=0
+    rq worker --config rq_settings --worker-class obs_worker.PreloadedWorker --with-scheduler || status=$?
+    if [ $status -ne 75 ]; then exit $status; fi
+    echo "Restarting the recycled rq worker…"
+done